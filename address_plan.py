@@ -0,0 +1,103 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+"""
+Address layout of a device subnet. Onboarding creates the /29 of a device
+itself, so its addresses are fixed and need no lookup in eman:
+
+    10.0.0.8/29   subnet
+    10.0.0.9      gateway, the vEdge
+    10.0.0.10-14  dhcp interfaces and scope range
+    10.0.0.15     broadcast
+
+e.g.
+plan = address_plan("10.0.0.8/29")
+plan.gateway          # '10.0.0.9'
+scope_range(plan)     # '10.0.0.10:10.0.0.14'
+"""
+
+import collections
+import ipaddress
+
+DEVICE_PREFIX = 29
+DHCP_HOSTS = 5
+
+# subnet: the device subnet, e.g. '10.0.0.8/29'
+# gateway: its first address
+# hosts: tuple of the dhcp addresses right after the gateway, lowest first
+AddressPlan = collections.namedtuple("AddressPlan", ["subnet", "gateway", "hosts"])
+
+
+def address_plan(subnet, hosts=DHCP_HOSTS):
+    """
+    :param subnet: (str) a device subnet, e.g. '10.0.0.8/29'
+    :param hosts: (int) number of dhcp addresses after the gateway
+    :return: AddressPlan of subnet. Raises ValueError if subnet is not a
+    network or has no room for the gateway and hosts.
+    """
+    network = ipaddress.ip_network(subnet, strict=False)
+    if network.num_addresses < hosts + 3:
+        raise ValueError(f"{subnet} has no room for a gateway and {hosts} hosts")
+    gateway = network.network_address + 1
+    return AddressPlan(
+        str(network),
+        str(gateway),
+        tuple(str(gateway + count) for count in range(1, hosts + 1)),
+    )
+
+
+def device_subnet(gateway):
+    """
+    :param gateway: (str) gateway of a device, e.g. from csv-deviceIP
+    :return: (str) the /29 whose first address is gateway
+    """
+    return f"{ipaddress.ip_address(gateway) - 1}/{DEVICE_PREFIX}"
+
+
+def subnet_gateway(subnet):
+    """
+    :param subnet: (str) a device subnet
+    :return: (str) its gateway, the first address
+    """
+    return address_plan(subnet).gateway
+
+
+def scope_range(plan):
+    """
+    :param plan: AddressPlan
+    :return: (str) the scope range as 'first:last', the dhcp addresses
+    """
+    return f"{plan.hosts[0]}:{plan.hosts[-1]}"
+
+
+def verify_plan(am, plan):
+    """
+    Checks the plan against eman: the hosts must be the highest block of
+    free addresses in the subnet, the one get_range would have picked.
+
+    :param am: Eman
+    :param plan: AddressPlan
+    :return: (str) what eman disagrees on, '' if nothing
+    """
+    first, last = am.get_range(plan.subnet, len(plan.hosts))
+    if (str(first), str(last)) == (plan.hosts[0], plan.hosts[-1]):
+        return ""
+    if not first:
+        return f"eman has no {len(plan.hosts)} free addresses in {plan.subnet}"
+    return (
+        f"eman's free range in {plan.subnet} is {first}:{last}, "
+        f"not {scope_range(plan)}"
+    )
@@ -0,0 +1,389 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+"""
+Benchmarks of eman.py and the onboarding pipeline against stub backends, no
+eman server is contacted.
+
+    python benchmark.py                           # writes benchmark-results.json
+    python benchmark.py --baseline baseline.json  # and compares with a stored run
+    python benchmark.py --only get_range --rows 100 1000
+
+A results file can be used as the baseline of a later run. Timings are the
+best of --repeat rounds, so noise from other processes mostly drops out.
+"""
+
+import argparse
+import contextlib
+import csv
+import datetime
+import ipaddress
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+
+import constants
+import eman
+from eman import Eman
+from eman_simulator import EmanSimulator, SimulatorTransport
+
+RESULTS_FILE = "benchmark-results.json"
+
+
+class StubTransport:
+    """
+    Transport that answers every command instantly.
+
+    Attributes:
+        answer: output returned for every command
+    """
+
+    def __init__(self, answer="Success"):
+        self.answer = answer
+
+    def run(self, command):
+        return self.answer, ""
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def quiet():
+    """Silences logging and the print calls left in eman.py and onboarding.py."""
+    logging.disable(logging.CRITICAL)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def measure(func, repeat=5):
+    """
+    :param func: callable without arguments
+    :param repeat: (int) rounds, the fastest one is kept
+    :return: (dict) per_call seconds and the number of calls per round
+    """
+    timer = timeit.Timer(func)
+    with quiet():
+        number, __elapsed = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number))
+    return {"per_call": best / number, "calls": number}
+
+
+def free_list(prefix, used_every=7):
+    """
+    :param prefix: (int) prefix length of the subnet
+    :param used_every: (int) every n-th address is taken
+    :return: (str) next-avail -comma output of a partly used subnet
+    """
+    network = ipaddress.ip_network(f"10.0.0.0/{prefix}")
+    return ",".join(
+        str(ip) for count, ip in enumerate(network.hosts()) if count % used_every
+    )
+
+
+def bench_send_command(repeat):
+    am = Eman("bench", "bench", transport=StubTransport())
+    return measure(lambda: am.send_command("-f=int-find -n=bench"), repeat)
+
+
+def bench_generate_command(repeat):
+    options = dict(
+        scope_name="bench-host",
+        description="bench-host",
+        subnet="10.0.0.8/29",
+        ranges="10.0.0.10:10.0.0.14",
+        policy="Home Based LAN",
+        selectiontags=("IPPhones", "OtherDevices"),
+        dhcpserver="server-test-7-k",
+        defaultrouter="10.0.0.9",
+        callmanager="192.168.146.221,192.168.131.161",
+    )
+    return measure(lambda: Eman._add_scope_command(**options), repeat)
+
+
+def bench_get_range(prefix, repeat):
+    am = Eman("bench", "bench", transport=StubTransport(free_list(prefix)))
+    return measure(lambda: am.get_range(f"10.0.0.0/{prefix}", 5), repeat)
+
+
+def bench_get_ip_from_string(repeat):
+    # string: what get_ip_from_string has to find in it, checked before timing
+    expected = {
+        "Successfully added Subnet 10.34.33.16/29": "10.34.33.16/29",
+        "Successfully added interface 10.34.33.20 (host.cisco.com)": "10.34.33.20",
+        "Successfully added Subnet 2001:420:30a:200::a10/57": (
+            "2001:420:30a:200::a10/57"
+        ),
+        "Successfully added interface 2001:420:30a:200::a10": "2001:420:30a:200::a10",
+        "ip:10.0.0.1": "10.0.0.1",
+        "Subnet:10.0.0.8/29 found": "10.0.0.8/29",
+        "ERROR: No available addresses found": None,
+    }
+    strings = list(expected)
+    for string, ip in expected.items():
+        found = eman.get_ip_from_string(string)
+        if found != ip:
+            raise AssertionError(
+                f"get_ip_from_string({string!r}) is {found!r}, not {ip!r}"
+            )
+
+    def parse():
+        for string in strings:
+            eman.get_ip_from_string(string)
+
+    result = measure(parse, repeat)
+    result["per_call"] /= len(strings)
+    return result
+
+
+def bench_parse_ip_list(prefix, repeat):
+    output = free_list(prefix)
+    return measure(lambda: eman.parse_ip_list(output), repeat)
+
+
+def write_rows(csv_file, rows):
+    """
+    Writes a synthetic onboarding csv. Every device already has a gateway in
+    its own /29 of 10.0.0.0/8, so no region address block is needed.
+    """
+    first = int(ipaddress.ip_address("10.0.0.0"))
+    with open(csv_file, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["csv-host-name", "csv-deviceIP", "csv-deviceId", "REGION"])
+        for count in range(rows):
+            gateway = ipaddress.ip_address(first + count * 8 + 1)
+            writer.writerow([f"bench-{count}", gateway, f"device-{count}", "TEST"])
+
+
+def bench_read_csv(rows, repeat):
+    try:
+        from onboarding import UserOnboard
+    except ImportError as error:
+        return {"skipped": f"onboarding can not be imported: {error}"}
+
+    best = None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="eman-bench-") as directory:
+        csv_file = os.path.join(directory, f"bench-{rows}.csv")
+        write_rows(csv_file, rows)
+        os.chdir(directory)
+        try:
+            for __round in range(max(1, repeat // 2)):
+                simulator = EmanSimulator(address_blocks=["10.0.0.0/8"])
+                onboard = UserOnboard(
+                    username="bench",
+                    password="bench",
+                    csv_file=csv_file,
+                    transport=SimulatorTransport(simulator=simulator),
+                    metrics_file="",
+                    results_file=os.path.join(directory, "results.csv"),
+                )
+                with quiet():
+                    start = time.perf_counter()
+                    onboard.read_csv()
+                    elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            os.chdir(cwd)
+    return {"per_call": best / rows, "calls": rows, "rows_per_second": rows / best}
+
+
+def bench_shared_block(repeat, workers=8, new=8):
+    """
+    Onboards devices that already have a /29 (deleted and re-added) next to
+    new ones, all in a full address block, with workers in parallel. A new
+    row must never take a /29 while its device re-adds it, so every row has
+    to succeed; checked before the timing is reported.
+    """
+    try:
+        from onboarding import UserOnboard
+    except ImportError as error:
+        return {"skipped": f"onboarding can not be imported: {error}"}
+
+    block = ipaddress.ip_network(constants.regionsab["TEST"])
+    subnets = list(block.subnets(new_prefix=29))
+    existing = subnets[: len(subnets) - new]
+    best = None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="eman-bench-") as directory:
+        csv_file = os.path.join(directory, "shared-block.csv")
+        results_file = os.path.join(directory, "results.jsonl")
+        with open(csv_file, "w", newline="") as handle:
+            writer = csv.writer(handle)
+            writer.writerow(["csv-host-name", "csv-deviceIP", "csv-deviceId", "REGION"])
+            for count, subnet in enumerate(existing):
+                gateway = subnet.network_address + 1
+                writer.writerow([f"old-{count}", gateway, f"device-{count}", "TEST"])
+                if count < new:
+                    writer.writerow([f"new-{count}", "", f"new-{count}", "TEST"])
+        os.chdir(directory)
+        try:
+            for seed in range(max(1, repeat // 2)):
+                simulator = EmanSimulator(address_blocks=[str(block)], seed=seed)
+                transport = SimulatorTransport(simulator=simulator)
+                with quiet():
+                    for subnet in existing:
+                        Eman("bench", "bench", transport=transport).add_subnet(
+                            subnet=str(subnet), function="LAN"
+                        )
+                simulator.latency = (0, 0.002)
+                onboard = UserOnboard(
+                    username="bench",
+                    password="bench",
+                    csv_file=csv_file,
+                    transport=transport,
+                    workers=workers,
+                    region_limit=workers,
+                    metrics_file="",
+                    results_file=results_file,
+                )
+                with quiet():
+                    start = time.perf_counter()
+                    onboard.read_csv()
+                    elapsed = time.perf_counter() - start
+                with open(results_file) as handle:
+                    failed = [
+                        result
+                        for result in map(json.loads, handle)
+                        if result["status"] != "ok"
+                    ]
+                if failed:
+                    raise AssertionError(f"rows failed in a shared block: {failed}")
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            os.chdir(cwd)
+    rows = len(existing) + new
+    return {"per_call": best / rows, "calls": rows, "rows_per_second": rows / best}
+
+
+def benchmarks(rows):
+    """
+    :param rows: row counts of the read_csv benchmarks
+    :return: list of (name, function taking repeat)
+    """
+    found = [
+        ("send_command", bench_send_command),
+        ("_generate_command", bench_generate_command),
+    ]
+    for prefix in (29, 24, 22):
+        found.append(
+            (
+                f"get_range_/{prefix}",
+                lambda repeat, p=prefix: bench_get_range(p, repeat),
+            )
+        )
+    found.append(("get_ip_from_string", bench_get_ip_from_string))
+    found.append(("parse_ip_list_/22", lambda repeat: bench_parse_ip_list(22, repeat)))
+    found.append(("read_csv_shared_block", bench_shared_block))
+    for count in rows:
+        found.append(
+            (f"read_csv_{count}", lambda repeat, c=count: bench_read_csv(c, repeat))
+        )
+    return found
+
+
+def run(only=None, rows=(100, 1000, 10000), repeat=5):
+    """
+    :param only: names containing any of these strings are run, None runs all
+    :return: (dict) results keyed by benchmark name
+    """
+    results = {}
+    for name, bench in benchmarks(rows):
+        if only and not any(part in name for part in only):
+            continue
+        results[name] = bench(repeat)
+        print(f"{name:<24} {describe(results[name])}", file=sys.stderr)
+    return results
+
+
+def describe(result):
+    if "skipped" in result:
+        return f"skipped: {result['skipped']}"
+    text = f"{result['per_call'] * 1e6:12.2f} us/call"
+    if "rows_per_second" in result:
+        text += f" {result['rows_per_second']:10.1f} rows/s"
+    return text
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    :param results: (dict) results of this run
+    :param baseline: (dict) results of the stored run
+    :param threshold: (float) relative change that counts as slower or faster
+    :return: (list) names of the benchmarks that got slower
+    """
+    slower = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or "per_call" not in result or "per_call" not in before:
+            continue
+        ratio = result["per_call"] / before["per_call"]
+        if ratio > 1 + threshold:
+            verdict = "slower"
+            slower.append(name)
+        elif ratio < 1 - threshold:
+            verdict = "faster"
+        else:
+            verdict = "same"
+        print(f"{name:<24} {ratio:6.2f}x {verdict}", file=sys.stderr)
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", default=RESULTS_FILE, help="results json file")
+    parser.add_argument("--baseline", help="results json of an earlier run")
+    parser.add_argument("--only", nargs="*", help="run benchmarks matching these")
+    parser.add_argument("--rows", nargs="*", type=int, default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change reported as slower/faster (default 0.1)",
+    )
+    args = parser.parse_args(argv)
+
+    results = run(only=args.only, rows=args.rows, repeat=args.repeat)
+    with open(args.output, "w") as handle:
+        json.dump(
+            {
+                "time": datetime.datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "results": results,
+            },
+            handle,
+            indent=2,
+        )
+
+    if args.baseline:
+        with open(args.baseline) as handle:
+            baseline = json.load(handle)["results"]
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,389 @@
+#!/usr/bin/env python
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+"""
+Command line entry point for vEdge onboarding and eman maintenance.
+
+    python cli.py onboard devices.csv --workers 8 --resume
+    python cli.py update-scopes host-a host-b --selection-tags IPPhones OtherDevices
+    python cli.py update-scopes --match "*-cvo-*" --subnet 10.35.105.0/29 --policy P
+    python cli.py find --interface host-a
+    python cli.py cleanup --scope host-a --subnet 10.0.0.8/29 --dry-run
+
+Every subcommand imports only what it needs, and logging is only set up
+once eman is actually called, so quick maintenance commands start fast.
+Credentials come from --username/--password or secrets.py.
+"""
+
+import argparse
+import sys
+
+from credentials import MissingCredentialsError
+
+
+def connect(args, workers=1):
+    """
+    :param workers: (int) calls made at once, session and http transports
+    keep a connection for each
+    :return: Eman for the connection options of a subcommand
+    """
+    from credentials import load_credentials
+    from eman import Eman
+
+    username, password = load_credentials(args.username, args.password)
+    options = {}
+    if args.transport in ("session", "http"):
+        options["size"] = workers
+    if args.timeout:
+        options["timeout"] = args.timeout
+    if args.batch_timeout and args.transport != "session":
+        options["batch_timeout"] = args.batch_timeout
+    return Eman(username, password, transport=args.transport, retry=True, **options)
+
+
+def onboard(args):
+    from onboarding import UserOnboard
+
+    options = {}
+    if args.metrics is not None:
+        options["metrics_file"] = args.metrics
+    unfinished = UserOnboard(
+        username=args.username,
+        password=args.password,
+        csv_file=args.csv_file,
+        limit=args.limit,
+        batch=args.batch,
+        transport=args.transport,
+        workers=args.workers,
+        resume=args.resume,
+        journal_file=args.journal,
+        reconcile=args.reconcile,
+        timeout=args.timeout,
+        batch_timeout=args.batch_timeout,
+        deadline=args.deadline,
+        results_file=args.results,
+        verify_addresses=args.verify_addresses,
+        **options,
+    ).read_csv()
+    return 1 if unfinished else 0
+
+
+def option_changes(args):
+    """
+    :return: (dict) the scope fields set on the command line
+    """
+    changes = {
+        "policy": args.policy,
+        "callmanager": args.callmanager,
+        "description": args.description,
+        "ddnsenabled": args.ddns_enabled,
+        "ddnsdomain": args.ddns_domain,
+        "selectiontags": tuple(args.selection_tags or ()),
+    }
+    for assignment in args.set:
+        field, separator, value = assignment.partition("=")
+        if not separator:
+            raise ValueError(f"--set {assignment!r} is not FIELD=VALUE")
+        changes[field] = value
+    return changes
+
+
+def update_scopes(args):
+    from scope_update import select_updates, update_scopes as apply_updates
+
+    failed = 0
+    with connect(args, workers=args.workers) as am:
+        try:
+            updates = select_updates(
+                am,
+                names=args.scopes,
+                pattern=args.match,
+                subnets=args.subnet,
+                csv_file=args.csv,
+                changes=option_changes(args),
+            )
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 2
+
+        if args.dry_run:
+            for name, changes in updates:
+                print(f"would modify {name}: {changes}")
+            return 0
+
+        for result in apply_updates(am, updates, workers=args.workers):
+            if result.error is None:
+                print(f"{result.name}: ok {result.result}")
+            else:
+                print(f"{result.name}: failed {result.error}")
+                failed += 1
+    return 1 if failed else 0
+
+
+def find(args):
+    from eman import UnableToFindError
+
+    with connect(args) as am:
+        if args.interface:
+            print(am.find_interface(args.interface))
+        elif args.subnet:
+            found = am.find_interfaces(subnet=args.subnet, return_as_dictionary=True)
+            if isinstance(found, dict):
+                for ip, name in found.items():
+                    print(f"{ip} {name}")
+            else:
+                print(found)
+        elif args.scopes:
+            for key, value in am.get_scopes_by_subnet(args.scopes).items():
+                print(f"{key}: {value}")
+        else:
+            try:
+                ips = am.find_list_of_next_available_ips(
+                    subnet=args.next_available,
+                    number_of_addresses_returned=str(args.count),
+                    ping=False,
+                )
+            except UnableToFindError as error:
+                print(error, file=sys.stderr)
+                return 1
+            print("\n".join(ips))
+    return 0
+
+
+def cleanup_targets(args):
+    """
+    :return: list of ('scope' or 'subnet', name) to delete, scopes first for
+    each csv row as onboarding's cleanup does
+    """
+    targets = [("scope", name) for name in args.scope]
+    targets += [("subnet", subnet) for subnet in args.subnet]
+    if args.csv_file:
+        from address_plan import device_subnet
+        from csv_source import read_rows
+
+        for row in read_rows(args.csv_file):
+            if row.error:
+                print(f"{args.csv_file}:{row.line}: {row.error}", file=sys.stderr)
+                continue
+            if row.device_ip is None:
+                continue
+            subnet = device_subnet(row.device_ip)
+            targets += [("scope", row.hostname), ("subnet", subnet)]
+    return targets
+
+
+def cleanup(args):
+    targets = cleanup_targets(args)
+    if args.dry_run:
+        for kind, name in targets:
+            print(f"would delete {kind} {name}")
+        return 0
+
+    failed = 0
+    with connect(args) as am:
+        batch = am.batch()
+        for kind, name in targets:
+            if kind == "scope":
+                batch.del_scope(name, key=name)
+            else:
+                batch.del_subnet(name, key=name)
+        for name, command, result in batch.flush():
+            print(f"{name}: {result}")
+            if "ERROR" in str(result):
+                failed += 1
+    return 1 if failed else 0
+
+
+def build_parser():
+    connection = argparse.ArgumentParser(add_help=False)
+    connection.add_argument("--username", default="")
+    connection.add_argument("--password", default="")
+    connection.add_argument(
+        "--transport", default="perl", help="perl, session, http or simulator"
+    )
+    connection.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="seconds one eman call may take before it is killed",
+    )
+    connection.add_argument(
+        "--batch-timeout",
+        type=float,
+        default=None,
+        help="seconds each 250 commands of a batch may take (default --timeout)",
+    )
+    connection.add_argument(
+        "--log-level", default=None, help="level of the per-call eman log (INFO)"
+    )
+    connection.add_argument(
+        "--log-sample",
+        type=float,
+        default=None,
+        help="share (0-1) of the eman log records below WARNING that are kept",
+    )
+    connection.add_argument(
+        "--log-format", choices=["text", "json"], default=None, help="log file format"
+    )
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_onboard = commands.add_parser(
+        "onboard", parents=[connection], help="vEdge bulk on-boarding from a csv"
+    )
+    parser_onboard.set_defaults(handler=onboard)
+    parser_onboard.add_argument("csv_file", help="absolute path to the csv file")
+    parser_onboard.add_argument("--batch", action="store_true")
+    parser_onboard.add_argument("--workers", type=int, default=1)
+    parser_onboard.add_argument("--limit", type=int, default=None)
+    parser_onboard.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the steps completed by the previous run of this csv file",
+    )
+    parser_onboard.add_argument("--journal", default="", help="journal file to use")
+    parser_onboard.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="only change what differs from eman for rows with a csv-deviceIP",
+    )
+    parser_onboard.add_argument(
+        "--metrics",
+        default=None,
+        help="metrics file written at the end of the run (.json or Prometheus "
+        "text), logs/onboarding_metrics.prom by default, '' for none",
+    )
+    parser_onboard.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        help="seconds the run may take, rows not started by then are reported",
+    )
+    parser_onboard.add_argument(
+        "--results",
+        default="",
+        help="results file (.xlsx, .csv or .jsonl), vedge_onboarding-<date>.xlsx "
+        "by default",
+    )
+    parser_onboard.add_argument(
+        "--verify-addresses",
+        action="store_true",
+        help="check each device's planned scope range against eman's free "
+        "addresses before using it",
+    )
+
+    parser_update = commands.add_parser(
+        "update-scopes", parents=[connection], help="modify existing dhcp scopes"
+    )
+    parser_update.set_defaults(handler=update_scopes)
+    parser_update.add_argument("scopes", nargs="*", help="scope names")
+    parser_update.add_argument(
+        "--match", default="", help="shell style pattern of scope names to update"
+    )
+    parser_update.add_argument(
+        "--subnet",
+        action="append",
+        default=[],
+        help="subnet whose scopes --match is applied to, once per subnet",
+    )
+    parser_update.add_argument(
+        "--csv",
+        default="",
+        help="csv with a name (or csv-host-name) column and a column per field "
+        "to change, its values take precedence over the options",
+    )
+    parser_update.add_argument("--policy", default="")
+    parser_update.add_argument("--callmanager", default="")
+    parser_update.add_argument("--description", default="")
+    parser_update.add_argument("--ddns-enabled", choices=["Y", "N"], default="")
+    parser_update.add_argument("--ddns-domain", default="")
+    parser_update.add_argument("--selection-tags", nargs="+", default=None)
+    parser_update.add_argument(
+        "--set",
+        action="append",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="any other scope field, e.g. --set defaultrouter=10.0.0.9",
+    )
+    parser_update.add_argument(
+        "--workers",
+        type=int,
+        default=6,
+        help="scope-mods in flight at once when the transport has no batch mode",
+    )
+    parser_update.add_argument(
+        "--dry-run", action="store_true", help="only list what would be changed"
+    )
+
+    parser_find = commands.add_parser(
+        "find", parents=[connection], help="look up interfaces, scopes or free ips"
+    )
+    parser_find.set_defaults(handler=find)
+    what = parser_find.add_mutually_exclusive_group(required=True)
+    what.add_argument("--interface", help="hostname or ip of an interface")
+    what.add_argument("--subnet", help="list the interfaces of a subnet")
+    what.add_argument("--scopes", metavar="SUBNET", help="list the scopes of a subnet")
+    what.add_argument(
+        "--next-available", metavar="SUBNET", help="list free ips of a subnet"
+    )
+    parser_find.add_argument(
+        "--count", default="all", help="number of free ips to list (all)"
+    )
+
+    parser_cleanup = commands.add_parser(
+        "cleanup", parents=[connection], help="delete scopes and subnets"
+    )
+    parser_cleanup.set_defaults(handler=cleanup)
+    parser_cleanup.add_argument(
+        "csv_file",
+        nargs="?",
+        help="onboarding csv, the scope and /29 of every row with a csv-deviceIP "
+        "are deleted",
+    )
+    parser_cleanup.add_argument("--scope", action="append", default=[])
+    parser_cleanup.add_argument("--subnet", action="append", default=[])
+    parser_cleanup.add_argument(
+        "--dry-run", action="store_true", help="only list what would be deleted"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "update-scopes":
+        if not (args.scopes or args.match or args.csv):
+            parser.error("update-scopes needs scope names, --match or --csv")
+        if args.match and not args.subnet:
+            parser.error("--match needs at least one --subnet to look in")
+    if args.log_level or args.log_sample is not None or args.log_format:
+        from logging_config import configure_logging
+
+        configure_logging(
+            log_format=args.log_format, level=args.log_level, sample=args.log_sample
+        )
+
+    try:
+        return args.handler(args)
+    except MissingCredentialsError as error:
+        print(error, file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+
+class MissingCredentialsError(Exception):
+    """Exception raised when no eman username and password were given or found"""
+
+
+def load_credentials(username="", password=""):
+    """
+    Returns the credentials given, or else the ones in secrets.py, which is
+    only read when it is needed:
+
+    USERNAME = "username"
+    PASSWORD = "password"
+
+    :param username: User with rights to make changes in Eman-am or eman-cli
+    :param password: Password for expected user
+    :return: (username, password). Raises MissingCredentialsError if none were
+    given and secrets.py can not be imported.
+    """
+    if username and password:
+        return username, password
+    try:
+        from secrets import USERNAME, PASSWORD
+    except ImportError:
+        raise MissingCredentialsError(
+            "No eman credentials: pass a username and password or create "
+            "secrets.py with USERNAME and PASSWORD"
+        )
+    return USERNAME, PASSWORD
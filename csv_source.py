@@ -0,0 +1,80 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import collections
+import csv
+import itertools
+
+HOSTNAME_COLUMN = "csv-host-name"
+DEVICE_IP_COLUMN = "csv-deviceIP"
+DEVICE_ID_COLUMN = "csv-deviceId"
+REGION_COLUMN = "REGION"
+
+# line: line number in the csv file (the header is line 1)
+# hostname: csv-host-name
+# device_ip: csv-deviceIP, or None if the device has no address yet
+# region: REGION in upper case
+# fields: every column of the row as read
+# error: why the row can not be onboarded, "" for a valid row
+CsvRow = collections.namedtuple(
+    "CsvRow",
+    ["line", "hostname", "device_ip", "device_id", "region", "fields", "error"],
+    defaults=("",),
+)
+
+
+def read_rows(csv_file, limit=None):
+    """
+    Streams the rows of an onboarding csv file. Only one row is held in
+    memory at a time, so there is no limit on the size of the file. A row
+    missing a required column is yielded with its error set rather than
+    ending the stream, so the rows after it are still read.
+
+    :param csv_file: (str) path to the csv file
+    :param limit: (int) stop after this many rows, None reads them all
+    :return: generator of CsvRow
+    """
+    with open(csv_file, newline="") as handle:
+        reader = csv.DictReader(handle)
+        for line, fields in enumerate(itertools.islice(reader, limit), start=2):
+            hostname = (fields.get(HOSTNAME_COLUMN) or "").strip()
+            region = (fields.get(REGION_COLUMN) or "").strip().upper()
+            error = ""
+            if not hostname or not region:
+                error = f"{HOSTNAME_COLUMN} and {REGION_COLUMN} are required"
+            yield CsvRow(
+                line=line,
+                hostname=hostname,
+                device_ip=(fields.get(DEVICE_IP_COLUMN) or "").strip() or None,
+                device_id=(fields.get(DEVICE_ID_COLUMN) or "").strip(),
+                region=region,
+                fields=fields,
+                error=error,
+            )
+
+
+def chunked(rows, size):
+    """
+    :param rows: iterable of rows
+    :param size: (int) rows per chunk
+    :return: generator of lists of at most size rows
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
@@ -16,14 +16,43 @@
 # ------------------------------------------------------------------
 
 import os
+import collections
 import logging
 import ipaddress
 import re
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from logging_config import configure_logger
+from eman_transport import make_transport
+from probe import Prober
+from eman_cache import EmanCache, cached, invalidates
+from metrics import batch_outcome, command_function, command_outcome
+from retry import RetryPolicy
 
 LOGPATH = os.path.abspath(os.curdir) + "/logs/ete_lib.log"
-LOGGER = configure_logger(__name__, LOGPATH)
+# configured by the first Eman, importing this module writes nothing
+LOGGER = logging.getLogger(__name__)
+
+# cached reads that a write to interfaces, subnets or scopes can change
+INTERFACE_READS = ("find_interface", "find_interfaces", "find_helpers")
+SUBNET_READS = ("find_subnets_free", "get_scopes_by_subnet", "find_interfaces")
+SCOPE_READS = ("get_scopes_by_subnet",)
+
+# every IPv4 or IPv6 address in a string, with an optional /prefix. Matches
+# are candidates only, scan_ips validates them with ipaddress. An IPv4
+# address may follow a colon (e.g. 'Subnet:10.0.0.8/29'), an IPv6 one not,
+# so the middle of an IPv6 address is never taken for one.
+IP_PATTERN = re.compile(
+    r"("
+    r"(?<![\w:.])(?:[0-9A-Fa-f]{0,4}:){2,6}\d{1,3}(?:\.\d{1,3}){3}"
+    r"|(?<![\w:.])(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}"
+    r"|(?<![\w.])\d{1,3}(?:\.\d{1,3}){3}"
+    r")(?:/(\d{1,3}))?(?![\w:])"
+)
+# separators of a -comma address list
+SEPARATOR_PATTERN = re.compile(r"[,\s]+")
+# result of each command of a batch whose reply did not line up with it;
+# the batch may have been applied in part, so eman has to be checked
+BATCH_UNKNOWN = "ERROR: batch outcome unknown ({reason}), check eman before resending"
 
 class UserAuthenticationError(Exception):
     """Exception that will be thrown when user fails to authenticate with AM"""
@@ -45,9 +74,68 @@ class Eman:
         password: Password for expected user
     """
 
-    def __init__(self, username, password):
+    def __init__(
+        self,
+        username,
+        password,
+        transport="perl",
+        prober=None,
+        cache=None,
+        metrics=None,
+        retry=None,
+        **transport_options,
+    ):
+        """
+        :param username: User with rights to make changes in Eman-am or eman-cli
+        :param password: Password for expected user
+        :param transport: (str) how commands reach eman. 'perl' forks eman-am.pl per
+        call, 'session' keeps eman-am.pl running in interactive mode and 'http'
+        posts to cli.pcgi directly over keep-alive connections. A transport
+        instance with a run(command) method can be given instead.
+        :param prober: (probe.Prober) used when ping=True to find addresses that
+        are in use. Default is a native ICMP sweep with a 1 second timeout.
+        :param cache: True or an eman_cache.EmanCache to cache read-only lookups
+        (find_interface, find_helpers, get_scopes_by_subnet, ...). Writes through
+        this instance drop the cached results they affect. Off by default.
+        :param metrics: (metrics.Metrics) records the round trip of every command
+        as eman_command_seconds, labelled with its eman function and outcome
+        :param retry: (retry.RetryPolicy) retries reads that failed for a
+        transient reason (timeouts, 5xx, refused connections), and writes only
+        if they never reached eman, with backoff. Stops calling eman while its
+        circuit breaker is open. True for the default policy. Off by default.
+        :param transport_options: passed to the transport (e.g. size=4 for 'session',
+        timeout=30 to give up on calls taking longer than 30 seconds, default
+        eman_transport.DEFAULT_TIMEOUT, batch_timeout=300 to allow 300 seconds
+        for each BATCH_SIZE commands of a batch, default timeout)
+        """
+        configure_logger(__name__, LOGPATH)
         self.username = username
         self.password = password
+        if isinstance(transport, str):
+            transport = make_transport(
+                transport, username, password, **transport_options
+            )
+        self.transport = transport
+        self.prober = prober or Prober()
+        if cache is True:
+            cache = EmanCache()
+        elif cache is False:
+            cache = None
+        self.cache = cache
+        self.metrics = metrics
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Releases anything the transport keeps open (e.g. eman-am.pl sessions)."""
+        self.transport.close()
 
     def send_command(self, command):
         """
@@ -56,27 +144,33 @@ class Eman:
         :return: Success or Fail and Error
 
         """
-        perl_script_location = (
-            os.path.dirname(os.path.realpath(__file__)) + "/eman-am.pl"
-        )
-        if not os.path.exists(perl_script_location):
-            perl_script_location = os.path.relpath(
-                "../am_wrapper/am_wrapper/eman-am.pl", os.curdir
-            )
-
-        header = f'{perl_script_location} -username={self.username} \
-        -password="{self.password}"'
-
         LOGGER.debug(f"command: {command}")
 
-        full_command = f"perl {header} {command}"
+        if self.retry is None:
+            output, error = self._run(command)
+        else:
+            output, error = self.retry.call(lambda: self._run(command), command)
+        return self._handle_output(command, output, error)
 
-        os.environ["PERL_LWP_SSL_VERIFY_HOSTNAME"] = "0"
-        process = subprocess.Popen(
-            full_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True
-        )
-        output = str(process.stdout.read().decode().strip("\n").lstrip().rstrip())
-        error = str(process.stderr.read().decode().strip("\n").lstrip().rstrip())
+    def _run(self, command):
+        """
+        :return: (output, error) of one round trip through the transport
+        """
+        if self.metrics is None:
+            return self.transport.run(command)
+        with self.metrics.timer(
+            "eman_command_seconds", function=command_function(command)
+        ) as labels:
+            output, error = self.transport.run(command)
+            labels["outcome"] = command_outcome(output, error)
+        return output, error
+
+    @staticmethod
+    def _handle_output(command, output, error):
+        """
+        :return: output if eman printed anything, error otherwise. Raises
+        UserAuthenticationError if eman refused the credentials.
+        """
         if "Unauthorized" in error:
             raise UserAuthenticationError(error)
 
@@ -87,6 +181,79 @@ class Eman:
             LOGGER.error(command)
             return error
 
+    @invalidates(by_key=False)
+    def send_batch(self, commands):
+        """
+        Sends several commands through eman-am batch mode and splits the reply
+        back into one result per command. Each command is expected to answer
+        with a single line. If the reply can not be matched up line for line
+        the batch may have been applied in part, so nothing is resent: every
+        command gets an ERROR result saying its outcome is unknown. Without a
+        batch mode in the transport the commands are sent one at a time.
+
+        :param commands: (list) command strings from _generate_command
+        :return: (list) one result string per command, in the same order
+        """
+        return self._send_batch(commands)
+
+    def _send_batch(self, commands):
+        """
+        send_batch for the bulk methods, which drop the cached lookups they
+        change themselves
+        """
+        if not commands:
+            return []
+
+        run_batch = getattr(self.transport, "run_batch", None)
+        if run_batch is None:
+            return [self.send_command(command) for command in commands]
+
+        LOGGER.debug(f"batch: {len(commands)} commands")
+
+        def send():
+            if self.metrics is None:
+                return run_batch(commands)
+            with self.metrics.timer("eman_batch_seconds") as labels:
+                output, error = run_batch(commands)
+                labels["outcome"] = batch_outcome(output, error)
+            return output, error
+
+        if self.retry is None:
+            output, error = send()
+        else:
+            output, error = self.retry.call(send, f"batch of {len(commands)}")
+        return self._split_batch(commands, output, error)
+
+    @staticmethod
+    def _split_batch(commands, output, error):
+        """
+        :return: one result line per command, or one BATCH_UNKNOWN error per
+        command if the batch output does not line up with the commands.
+        Raises UserAuthenticationError if eman refused the credentials.
+        """
+        if "Unauthorized" in error:
+            raise UserAuthenticationError(error)
+
+        lines = [line.strip() for line in output.splitlines() if line.strip()]
+        if len(lines) != len(commands):
+            reason = f"{len(lines)} lines for {len(commands)} commands"
+            if error:
+                reason += f", {' '.join(error.split())}"
+            LOGGER.error("batch outcome unknown: %s", reason)
+            for command in commands:
+                LOGGER.error(command)
+            return [BATCH_UNKNOWN.format(reason=reason)] * len(commands)
+
+        for command in commands:
+            LOGGER.info(command)
+        return lines
+
+    def batch(self):
+        """
+        :return: (EmanBatch) a queue of commands that are sent together on flush
+        """
+        return EmanBatch(self)
+
     @staticmethod
     def _generate_command(**flags):
         """
@@ -119,6 +286,7 @@ class Eman:
         return command
 
     # pylint: disable-msg=R0913
+    @invalidates("find_subnets_free")
     def add_address_block(
         self,
         address_block,
@@ -179,6 +347,41 @@ class Eman:
         “Local Contact (on-site)”,“Generic User”, Metric, “Epage Alias”, “Support Group”)
         :return:
         """
+        command = self._add_address_block_command(
+            address_block,
+            function=function,
+            location=location,
+            route_point=route_point,
+            description=description,
+            status=status,
+            block_type=block_type,
+            lab=lab,
+            contact1=contact1,
+            contact1_type=contact1_type,
+        )
+
+        result = self.send_command(command=command)
+
+        LOGGER.info("add_address_block: %s", result)
+        if "ERROR" in result:
+            raise UnableToReserveError(result)
+        return result
+
+    # pylint: disable-msg=R0913
+    @classmethod
+    def _add_address_block_command(
+        cls,
+        address_block,
+        function="",
+        location="inherit",
+        route_point="inherit",
+        description="",
+        status="Active",
+        block_type="Primary",
+        lab="",
+        contact1="",
+        contact1_type="",
+    ):
         flags = {
             "function": "address-block-add",
             "AddressBlock": address_block,
@@ -192,17 +395,11 @@ class Eman:
             "Contact1": contact1,
             "Contact1type": contact1_type,
         }
-        command = self._generate_command(**flags)
-
-        result = self.send_command(command=command)
-
-        LOGGER.info("add_address_block: %s", result)
-        if "ERROR" in result:
-            raise UnableToReserveError(result)
-        return result
+        return cls._generate_command(**flags)
 
     # pylint: disable-msg=R0914
     # pylint: disable-msg=R0913
+    @invalidates(*SUBNET_READS)
     def add_subnet(
         self,
         address_block="",
@@ -314,6 +511,62 @@ class Eman:
             except UnableToFindError as error:
                 raise UnableToReserveError(error)
 
+        command = self._add_subnet_command(
+            subnet,
+            function=function,
+            status=status,
+            subnet_type=subnet_type,
+            description=description,
+            location=location,
+            dhcp_server=dhcp_server,
+            route_point=route_point,
+            area=area,
+            city=city,
+            country=country,
+            ping_before_offer=ping_before_offer,
+            trend=trend,
+            failover_backup_percentage=failover_backup_percentage,
+            alert_percent_used=alert_percent_used,
+            selection_tags=selection_tags,
+            default_router=default_router,
+            call_manager=call_manager,
+            lab=lab,
+            contact1=contact1,
+            contact1_type=contact1_type,
+        )
+        LOGGER.info(command)
+
+        result = self.send_command(command)
+
+        LOGGER.info("add_subnet: %s", result)
+        return self._added_ip(result)
+
+    # pylint: disable-msg=R0913
+    @classmethod
+    def _add_subnet_command(
+        cls,
+        subnet,
+        function="",
+        status="Active",
+        subnet_type="Primary",
+        description="",
+        location="inherit",
+        dhcp_server="",
+        route_point="inherit",
+        area="HQ",
+        city='"San Jose"',
+        country='"United States"',
+        ping_before_offer="Yes",
+        trend="Yes",
+        failover_backup_percentage="5",
+        alert_percent_used="95",
+        selection_tags="OtherDevices",
+        default_router="",
+        call_manager="",
+        lab="",
+        contact1="",
+        contact1_type="",
+    ):
         flags = {
             "function": "subnet-add",
             "subnet": subnet,
@@ -339,12 +592,15 @@ class Eman:
             "Contact1type": contact1_type,
         }
 
-        command = self._generate_command(**flags)
-        LOGGER.info(command)
+        return cls._generate_command(**flags)
 
-        result = self.send_command(command)
-
-        LOGGER.info("add_subnet: %s", result)
+    @staticmethod
+    def _added_ip(result):
+        """
+        :param result: eman output of a subnet-add or int-add
+        :return: the added subnet or ip address. Raises UnableToReserveError if
+        nothing was added.
+        """
         ip = ""
         if "Success" in result:
             ip = get_ip_from_string(string=result)
@@ -353,6 +609,7 @@ class Eman:
 
         raise UnableToReserveError(result)
 
+    @invalidates(*INTERFACE_READS)
     def add_interface(
         self,
         interface_name,
@@ -400,6 +657,102 @@ class Eman:
             except UnableToFindError as error:
                 raise UnableToReserveError(error)
 
+        print(contact1_type)
+
+        command = self._add_interface_command(
+            interface_name,
+            hostname=hostname,
+            ip=ip,
+            multihomed=multihomed,
+            ptr=ptr,
+            status=status,
+            description=description,
+            contact1=contact1,
+            contact1_type=contact1_type,
+        )
+
+        LOGGER.info(command)
+
+        result = self.send_command(command)
+
+        LOGGER.info("add_interface: %s", result)
+
+        return self._added_ip(result)
+
+    @invalidates(*INTERFACE_READS)
+    def add_interfaces_bulk(self, interfaces, workers=6, batch=False):
+        """
+        Adds several interfaces together, by up to workers concurrent
+        add_interface calls. With batch=True interfaces with an ip go out in
+        one eman-am batch request instead, if the transport has a batch mode.
+
+        e.g.
+        am.add_interfaces_bulk([
+            ("host-a", "10.0.0.9", dict(ptr="Y", description="host-a")),
+            ("host-a-ip1", "10.0.0.10", dict(ptr="Y", description="host-a-ip1")),
+        ])
+
+        :param interfaces: list of (interface_name, ip, options), options being
+        any other add_interface parameter. ip may be '' with a subnet option to
+        take the next available address.
+        :param workers: (int) add_interface calls in flight at once
+        :param batch: True to batch the interfaces with an ip. A batch whose
+        reply does not line up is not resent, its interfaces get an error
+        (see send_batch).
+        :return: (list) InterfaceResult(name, ip, result, error) per interface,
+        in the order given. error is None if the interface was added.
+        """
+        results = [None] * len(interfaces)
+
+        batched = []
+        if batch and getattr(self.transport, "run_batch", None) is not None:
+            batched = [index for index, record in enumerate(interfaces) if record[1]]
+        if batched:
+            commands = [
+                self._add_interface_command(name, ip=ip, **options)
+                for name, ip, options in (interfaces[index] for index in batched)
+            ]
+            LOGGER.info("add_interfaces_bulk: batching %s interfaces", len(commands))
+            for index, result in zip(batched, self._send_batch(commands)):
+                name, ip, options = interfaces[index]
+                LOGGER.info("add_interface: %s", result)
+                try:
+                    added = self._added_ip(result)
+                    results[index] = InterfaceResult(name, ip, added, None)
+                except UnableToReserveError as error:
+                    results[index] = InterfaceResult(name, ip, None, str(error))
+
+        def add(index):
+            name, ip, options = interfaces[index]
+            try:
+                return InterfaceResult(
+                    name, ip, self.add_interface(name, ip=ip, **options), None
+                )
+            except Exception as error:
+                LOGGER.info("add_interface %s: %s", name, error)
+                return InterfaceResult(name, ip, None, str(error))
+
+        remaining = [index for index, result in enumerate(results) if result is None]
+        if remaining:
+            workers = max(1, min(workers, len(remaining)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for index, result in zip(remaining, executor.map(add, remaining)):
+                    results[index] = result
+        return results
+
+    @classmethod
+    def _add_interface_command(
+        cls,
+        interface_name,
+        hostname="",
+        ip="",
+        multihomed="N",
+        ptr="N",
+        status="",
+        description="",
+        contact1="",
+        contact1_type="",
+    ):
         flags = {
             "function": "int-add",
             "name": interface_name,
@@ -412,26 +765,10 @@ class Eman:
             "PTR": ptr,
             "Descr": f'"{description}"',
         }
-        print(contact1_type)
-
-        command = self._generate_command(**flags)
-
-        LOGGER.info(command)
-
-        result = self.send_command(command)
-
-        LOGGER.info("add_interface: %s", result)
-
-        ip = ""
-
-        if "Success" in result:
-            ip = get_ip_from_string(result)
 
-        if ip:
-            return ip
-
-        raise UnableToReserveError(result)
+        return cls._generate_command(**flags)
 
+    @invalidates(*INTERFACE_READS)
     def add_next_ip(self, hostname, subnet, multihomed):
         """
         Function to find the next available ip within a given subnet and
@@ -460,6 +797,7 @@ class Eman:
 
         return result
 
+    @invalidates("find_interface")
     def alias_add(self, alias, interface):
         """
         Function to create an alias
@@ -479,6 +817,7 @@ class Eman:
 
         return result
 
+    @invalidates("find_interface")
     def alias_delete(self, alias):
         """
         Function to delete a specified alias from address management.
@@ -497,6 +836,7 @@ class Eman:
 
         return result
 
+    @invalidates("find_interface")
     def alias_mod(self, oldalias, newalias):
         """
         Function to modify an existing alias from address management.
@@ -516,6 +856,7 @@ class Eman:
 
         return result
 
+    @invalidates(*SCOPE_READS)
     def create_scope(self, name, descrip, subnet, iprange, policy, local):
         """
         Function to create a scope within a given subnet. The range is found
@@ -582,6 +923,7 @@ class Eman:
 
         return result
 
+    @invalidates(*SUBNET_READS)
     def del_address_block(self, address_block):
         """
         Successfully deleted an address block 10.34.182.128/27
@@ -600,6 +942,7 @@ class Eman:
 
         return result
 
+    @invalidates(*INTERFACE_READS)
     def del_interface(self, ip="", interface_name=""):
         """
         Delete an Interface.
@@ -643,6 +986,7 @@ class Eman:
 
         return result
 
+    @invalidates(*SUBNET_READS, *INTERFACE_READS)
     def del_subnet(self, subnet):
         """
         Function to delete a specified subnet from address management.
@@ -652,7 +996,7 @@ class Eman:
 
         :return: Success/Fail
         """
-        command = f"-f=subnet-del -s={subnet}"
+        command = self._del_subnet_command(subnet)
         LOGGER.info(command)
 
         result = self.send_command(command)
@@ -661,6 +1005,11 @@ class Eman:
 
         return result
 
+    @staticmethod
+    def _del_subnet_command(subnet):
+        return f"-f=subnet-del -s={subnet}"
+
+    @cached
     def find_subnets_free(self, address_block):
         """
         Description: Find all open subnets in an address block. Not currently IPv6 compatable.
@@ -674,6 +1023,7 @@ class Eman:
 
         return self.send_command(command=command)
 
+    @cached
     def find_helpers(self, local):
         """
         Function to locate dhcp helpers for a specified local.
@@ -700,6 +1050,7 @@ class Eman:
 
         return result
 
+    @cached
     def find_interfaces(
         self,
         address_block="",
@@ -739,6 +1090,45 @@ class Eman:
 
         :return: a list of found interfaces.
         """
+        command = self._find_interfaces_command(
+            address_block=address_block,
+            subnet=subnet,
+            ip=ip,
+            interface_name=interface_name,
+            number_of_interfaces_to_return=number_of_interfaces_to_return,
+            search_by_descriptiioin=search_by_descriptiioin,
+            search_by_function=search_by_function,
+            search_by_technology=search_by_technology,
+            search_by_location=search_by_location,
+            search_by_area=search_by_area,
+            search_by_city=search_by_city,
+            search_by_country=search_by_country,
+            search_by_contact=search_by_contact,
+        )
+
+        LOGGER.info(command)
+
+        result = self.send_command(command)
+
+        return self._parse_interfaces(result, return_as_dictionary)
+
+    @classmethod
+    def _find_interfaces_command(
+        cls,
+        address_block="",
+        subnet="",
+        ip="",
+        interface_name="",
+        number_of_interfaces_to_return="all",
+        search_by_descriptiioin="",
+        search_by_function="",
+        search_by_technology="",
+        search_by_location="",
+        search_by_area="",
+        search_by_city="",
+        search_by_country="",
+        search_by_contact="",
+    ):
         block_type = "S"
         if address_block:
             block_type = "A"
@@ -762,12 +1152,17 @@ class Eman:
             "Bcontact": search_by_contact,
             "type": block_type,
         }
-        command += self._generate_command(**flags)
-
-        LOGGER.info(command)
+        command += cls._generate_command(**flags)
 
-        result = self.send_command(command)
+        return command
 
+    @staticmethod
+    def _parse_interfaces(result, return_as_dictionary=False):
+        """
+        :param result: eman output of a -comma int-find
+        :param return_as_dictionary: True to return {ip: hostname}
+        :return: list of found interfaces, or the eman error string
+        """
         if "ERROR" in result:
             return result
 
@@ -783,6 +1178,7 @@ class Eman:
         LOGGER.info("find_interfaces: %s", result)
         return result.split(",")
 
+    @cached
     def find_interface(self, interface):
         """
         Function to provide address management details
@@ -849,9 +1245,49 @@ class Eman:
         :param search_by_city: (str) find from address block or subnet matching the city
         :param search_by_country: (str) find from address block or subnet matching the country
         :param search_by_contact: (str) find from address block or subnet matching the contact
-        :return: next available interface or subnet
+        :return: next available interface or subnet, or all of them comma
+        separated if more than one was asked for and found
         """
 
+        command = self._find_next_available_command(
+            address_block=address_block,
+            subnet=subnet,
+            subnet_prefix_length=subnet_prefix_length,
+            search_type=search_type,
+            display_total_count_of_addresses_returned=display_total_count_of_addresses_returned,
+            number_of_blocks_or_addresses_returned=number_of_blocks_or_addresses_returned,
+            search_by_description=search_by_description,
+            search_by_function=search_by_function,
+            search_by_technology=search_by_technology,
+            search_by_location=search_by_location,
+            search_by_area=search_by_area,
+            search_by_city=search_by_city,
+            search_by_country=search_by_country,
+            search_by_contact=search_by_contact,
+        )
+
+        result = self.send_command(command=command)
+
+        return self._parse_next_available(result)
+
+    @classmethod
+    def _find_next_available_command(
+        cls,
+        address_block="",
+        subnet="",
+        subnet_prefix_length="30",
+        search_type="I",
+        display_total_count_of_addresses_returned="",
+        number_of_blocks_or_addresses_returned="1",
+        search_by_description="",
+        search_by_function="",
+        search_by_technology="",
+        search_by_location="",
+        search_by_area="",
+        search_by_city="",
+        search_by_country="",
+        search_by_contact="",
+    ):
         command = f" -comma "
 
         flags = {
@@ -874,18 +1310,43 @@ class Eman:
         if address_block:
             flags["length"] = subnet_prefix_length
 
-        command += self._generate_command(**flags)
+        command += cls._generate_command(**flags)
 
-        result = self.send_command(command=command)
+        return command
 
+    @staticmethod
+    def _parse_next_available(result, as_list=False):
+        """
+        :param result: eman output of a next-avail
+        :param as_list: (bool) return every address found as ipaddress objects
+        :return: next available interface or subnet, all of them comma
+        separated if eman returned several, or the list with as_list. Raises
+        UnableToFindError if eman returned an error.
+        """
         LOGGER.info("find_next_available: %s", result)
         print("result = " + result)
 
         if "ERROR" in result:
             raise UnableToFindError(result)
 
+        ips = parse_ip_list(result)
+        if as_list:
+            return ips
+        if len(ips) > 1:
+            return ",".join(str(ip) for ip in ips)
         return get_ip_from_string(result)
 
+    @staticmethod
+    def _parse_available(result):
+        """
+        :param result: eman output of next-avail -r=all -comma
+        :return: (list) the available addresses as ipaddress objects, empty
+        if eman returned an error
+        """
+        if "ERROR" in result:
+            return []
+        return parse_ip_list(result)
+
     def find_list_of_next_available_ips(
         self, address_block="", subnet="", number_of_addresses_returned="all", ping=True
     ):
@@ -898,24 +1359,17 @@ class Eman:
         :return:
         """
 
-        ips = (
-            self.find_next_available(
-                address_block=address_block,
-                subnet=subnet,
-                number_of_blocks_or_addresses_returned=number_of_addresses_returned,
-            )
-            .replace(" ", "")
-            .split(",")
+        command = self._find_next_available_command(
+            address_block=address_block,
+            subnet=subnet,
+            number_of_blocks_or_addresses_returned=number_of_addresses_returned,
         )
+        result = self.send_command(command=command)
+        ips = [str(ip) for ip in self._parse_next_available(result, as_list=True)]
 
         if ping:
-            ip_list = []
-
-            for ip in ips:
-                if self.ping_ip(ip):
-                    ip_list.append(ip)
-
-            return ip_list
+            active = self.prober.sweep(ips)
+            return [ip for ip in ips if ip not in active]
 
         return ips
 
@@ -934,14 +1388,7 @@ class Eman:
         :return: A list of available ipaddresses.
         """
 
-        command = f"-f=next-avail -s={subnet} -t=I -r=all -comma"
-        LOGGER.info(command)
-
-        result = self.send_command(command)
-
-        LOGGER.info("find_next_ip - Eman Return: %s", result)
-
-        ipblock = result.split(",")
+        ipblock = [str(ip) for ip in self._available_ips(subnet)]
 
         if "all" in iprange:
             return ipblock
@@ -950,64 +1397,83 @@ class Eman:
             LOGGER.info("findnextip: Not enough ip's available")
             return "Not enough ip's available"
 
+        if ping is not True:
+            ips = ipblock[: int(iprange)]
+            LOGGER.info("find_next_ip: %s", ips)
+            return ips
+
+        # sweep one window of candidates at a time until enough are quiet
         ips = []
-        for ip in ipblock:
-            if ping is True:
-                active = self.ping_ip(ip)
-                if active is False:
-                    ips.append(ip)
-                    if len(ips) >= int(iprange):
-                        LOGGER.info("find_next_ip: %s", ips)
-                        return ips
-            else:
-                ips.append(ip)
-                if len(ips) >= int(iprange):
-                    LOGGER.info("find_next_ip: %s", ips)
-                    return ips
+        window = max(int(iprange), self.prober.concurrency)
+        for start in range(0, len(ipblock), window):
+            candidates = ipblock[start : start + window]
+            active = self.prober.sweep(candidates)
+            ips.extend(ip for ip in candidates if ip not in active)
+            if len(ips) >= int(iprange):
+                ips = ips[: int(iprange)]
+                LOGGER.info("find_next_ip: %s", ips)
+                return ips
 
         return ips
 
-    def get_range(self, subnet, ip_range):
+    def _available_ips(self, subnet):
+        """
+        :return: (list) every available address of the subnet as ipaddress
+        objects, lowest first
+        """
+        command = f"-f=next-avail -s={subnet} -t=I -r=all -comma"
+        LOGGER.info(command)
+
+        result = self.send_command(command)
+
+        LOGGER.info("find_next_ip - Eman Return: %s", result)
+
+        return self._parse_available(result)
+
+    def get_range(self, subnet, ip_range, highest=True):
         """
         Finds and returns a range of congruent ip addresses
 
         :param subnet:
         :param ip_range: Number of ip addresses
+        :param highest: True for the highest block of free addresses in the
+        subnet, False for the lowest.
 
-        :return: range based on requested ip addresses
-        """
-
-        ips = self.find_next_ip(subnet, "all", False)
-        LOGGER.info("getrange - available ip's: %s", ips)
-        ips.reverse()
-        ipgrouping = []
-        count = len(ips)
-        base = 0
-        max_ip = ip_range
-        LOGGER.info("IP Count and Range: %s, %s", count, ip_range)
-
-        while count > int(ip_range):
-            iplist = ips[int(base) : int(max_ip)]
-            LOGGER.info("IP List: %s", iplist)
-            for ip in iplist:
-                ipgrouping.append(ip.rsplit(".")[-1])
-            ipgrouping.reverse()
-            itr = (int(x) for x in ipgrouping)
-            first = next(itr)
-            consecutive = all(a == b for a, b in enumerate(itr, first + 1))
-
-            if consecutive is True:
-                # return range 1,range 2
-                return iplist[int(ip_range) - 1], iplist[0]
-
-            ipgrouping = []
-            base = base + 1
-            max_ip = int(max_ip) + 1
-            count = int(count) - 1
+        :return: range based on requested ip addresses as (low, high), or (0, 0)
+        if there are not enough consecutive free addresses
+        """
+
+        ips = self._available_ips(subnet)
+        LOGGER.info("getrange - available ip's: %s", len(ips))
+
+        ranges = find_contiguous_ranges(ips, ip_range, highest=highest)
+        if ranges:
+            return ranges[0]
 
         LOGGER.info("get_range: No congruent ip addresses in the given range")
         return 0, 0
 
+    def get_ranges(self, subnet, ip_range, number_of_ranges, highest=True):
+        """
+        Finds several non-overlapping ranges of congruent ip addresses with a
+        single lookup.
+
+        :param subnet:
+        :param ip_range: Number of ip addresses in each range
+        :param number_of_ranges: Number of ranges wanted
+        :param highest: True to start from the top of the subnet, False from the bottom.
+
+        :return: list of (low, high), may be shorter than number_of_ranges
+        """
+
+        ips = self._available_ips(subnet)
+        LOGGER.info("getranges - available ip's: %s", len(ips))
+
+        return find_contiguous_ranges(
+            ips, ip_range, number_of_ranges=number_of_ranges, highest=highest
+        )
+
+    @cached
     def get_scopes_by_subnet(self, subnet):
         """
         Function to return available scopes of a specified subnet.
@@ -1021,24 +1487,43 @@ class Eman:
         LOGGER.info(command)
 
         result = self.send_command(command)
+
+        return self._parse_scopes(result)
+
+    @staticmethod
+    def _parse_scopes(result):
+        """
+        :param result: eman output of a scope-info -details
+        :return: {'Scope Name1': ..., 'Range1': ..., 'Policy1': ...} for every
+        scope found, each detail line of the nth scope as '<label>n'
+        """
         info = result.replace("\n", ",").replace(",,", ",").split(",")
         scope = {}
         count = 0
+        key = ""
         for line in info:
             if "Scope Name" in line:
                 count += 1
                 key, value = line.split(":")
                 key = key + str(count)
                 scope.update({key: value})
-            if "Range" in line:
+            elif "Range" in line:
                 key, value = line.split(":")
                 key = key + str(count)
                 scope.update({key: value})
+            elif ":" in line and count:
+                label, value = line.split(":", 1)
+                key = label.strip() + str(count)
+                scope.update({key: value})
+            elif line.strip() and key:
+                # the rest of a comma separated value, e.g. selection tags
+                scope[key] += "," + line.strip()
 
         LOGGER.info("get_scopes_by_subnet: %s", scope)
 
         return scope
 
+    @invalidates(*SCOPE_READS)
     def add_scope(
         self,
         scope_name="",
@@ -1085,6 +1570,60 @@ class Eman:
         :return:
         """
 
+        command = self._add_scope_command(
+            scope_name=scope_name,
+            description=description,
+            subnet=subnet,
+            ranges=ranges,
+            policy=policy,
+            dhcpserver=dhcpserver,
+            status=status,
+            type=type,
+            pingbeforeoffer=pingbeforeoffer,
+            failoverbackuppercentage=failoverbackuppercentage,
+            trend=trend,
+            alertpercentused=alertpercentused,
+            selectiontags=selectiontags,
+            defaultrouter=defaultrouter,
+            callmanager=callmanager,
+            primaryscope=primaryscope,
+            addinterfaces=addinterfaces,
+            ddnsenabled=ddnsenabled,
+            ddnsdomain=ddnsdomain,
+        )
+
+        LOGGER.info(command)
+
+        try:
+            result = self.send_command(command)
+            LOGGER.info("scope-add: %s", result)
+            return result
+        except Exception as error:
+            LOGGER.info(error)
+
+    @classmethod
+    def _add_scope_command(
+        cls,
+        scope_name="",
+        description="",
+        subnet="",
+        ranges="",
+        policy="",
+        dhcpserver="",
+        status="Active",
+        type="Primary",
+        pingbeforeoffer="N",
+        failoverbackuppercentage="5",
+        trend="Y",
+        alertpercentused="95",
+        selectiontags="OtherDevices",
+        defaultrouter="",
+        callmanager="",
+        primaryscope="",
+        addinterfaces="",
+        ddnsenabled="N",
+        ddnsdomain="",
+    ):
         # if selectiontags != "OtherDevices":
         #
 
@@ -1111,17 +1650,9 @@ class Eman:
             "DdnsDomain": ddnsdomain,
         }
 
-        command = self._generate_command(**flags)
-
-        LOGGER.info(command)
-
-        try:
-            result = self.send_command(command)
-            LOGGER.info("scope-add: %s", result)
-            return result
-        except Exception as error:
-            LOGGER.info(error)
+        return cls._generate_command(**flags)
 
+    @invalidates(*SCOPE_READS, *INTERFACE_READS, by_key=False)
     def del_scope(self, scope_name, Delete_interfaces="Yes"):
         """
 
@@ -1129,14 +1660,7 @@ class Eman:
         :param Delete_interfaces: Yes or No (Default is Yes)
         :return:
         """
-        if "Yes" in Delete_interfaces:
-            function = "scope-del -DI -q"
-        else:
-            function = "scope-del"
-
-        flags = {"function": function, "Name": f'"{scope_name}"'}
-
-        command = self._generate_command(**flags)
+        command = self._del_scope_command(scope_name, Delete_interfaces)
 
         LOGGER.info(command)
 
@@ -1148,33 +1672,82 @@ class Eman:
             LOGGER.info(error)
             return error
 
+    @classmethod
+    def _del_scope_command(cls, scope_name, Delete_interfaces="Yes"):
+        if "Yes" in Delete_interfaces:
+            function = "scope-del -DI -q"
+        else:
+            function = "scope-del"
+
+        flags = {"function": function, "Name": f'"{scope_name}"'}
+
+        return cls._generate_command(**flags)
+
+    @invalidates(*SCOPE_READS, by_key=False)
     def mod_scope(
         self,
         scope_name="",
-        callmanager="",
+        description="",
+        ranges="",
         policy="",
+        dhcpserver="",
+        status="",
+        type="",
+        pingbeforeoffer="",
+        failoverbackuppercentage="",
+        trend="",
+        alertpercentused="",
+        selectiontags="",
+        defaultrouter="",
+        callmanager="",
+        primaryscope="",
         ddnsenabled="",
         ddnsdomain="",
-        selectiontags="",
     ):
         """
+        Changes the given fields of a scope, fields left empty are not sent and
+        keep their value in eman. The fields are those of add_scope.
 
-        :param name:
+        :param scope_name: Name of scope to modify
+        :param description:
+        :param ranges: (e.g. '10.0.0.10:10.0.0.14')
         :param policy:
+        :param dhcpserver:
+        :param status:
+        :param type:
+        :param pingbeforeoffer:
+        :param failoverbackuppercentage:
+        :param trend:
+        :param alertpercentused:
+        :param selectiontags: a tag, or a tuple of tags
+        (e.g. ('IPPhones', 'OtherDevices'))
+        :param defaultrouter:
         :param callmanager:
+        :param primaryscope:
         :param ddnsenabled:
         :param ddnsdomain:
-        :param selectiontags:
         :return:
         """
 
-        flags = {
-            "function": "scope-mod",
-            "name": f'"{scope_name}"',
-            "SelectionTags": selectiontags,
-        }
-
-        command = self._generate_command(**flags)
+        command = self._mod_scope_command(
+            scope_name=scope_name,
+            description=description,
+            ranges=ranges,
+            policy=policy,
+            dhcpserver=dhcpserver,
+            status=status,
+            type=type,
+            pingbeforeoffer=pingbeforeoffer,
+            failoverbackuppercentage=failoverbackuppercentage,
+            trend=trend,
+            alertpercentused=alertpercentused,
+            selectiontags=selectiontags,
+            defaultrouter=defaultrouter,
+            callmanager=callmanager,
+            primaryscope=primaryscope,
+            ddnsenabled=ddnsenabled,
+            ddnsdomain=ddnsdomain,
+        )
 
         LOGGER.info(command)
 
@@ -1185,6 +1758,95 @@ class Eman:
         except Exception as error:
             LOGGER.info(error)
 
+    @invalidates(*SCOPE_READS, by_key=False)
+    def mod_scopes_bulk(self, updates, workers=6):
+        """
+        Modifies several scopes together. The scope-mods go out in eman-am
+        batch requests if the transport has a batch mode, otherwise up to
+        workers mod_scope calls run at once.
+
+        e.g.
+        am.mod_scopes_bulk([
+            ("host-a-cvo-vEdge100WM", dict(policy="San Jose Wireless LAN")),
+            ("host-b-cvo-vEdge100WM", dict(selectiontags=("IPPhones", "OtherDevices"))),
+        ])
+
+        :param updates: list of (scope_name, fields), fields being any other
+        mod_scope parameter
+        :param workers: (int) mod_scope calls in flight at once
+        :return: (list) ScopeResult(name, result, error) per scope, in the
+        order given. error is None if the scope was modified.
+        """
+        if not updates:
+            return []
+
+        if getattr(self.transport, "run_batch", None) is not None:
+            commands = [
+                self._mod_scope_command(name, **fields) for name, fields in updates
+            ]
+            LOGGER.info("mod_scopes_bulk: batching %s scopes", len(commands))
+            results = self._send_batch(commands)
+        else:
+
+            def modify(update):
+                name, fields = update
+                return self.mod_scope(scope_name=name, **fields)
+
+            workers = max(1, min(workers, len(updates)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(modify, updates))
+
+        scopes = []
+        for (name, fields), result in zip(updates, results):
+            LOGGER.info("mod_scope %s: %s", name, result)
+            scopes.append(scope_result(name, result))
+        return scopes
+
+    @classmethod
+    def _mod_scope_command(
+        cls,
+        scope_name="",
+        description="",
+        ranges="",
+        policy="",
+        dhcpserver="",
+        status="",
+        type="",
+        pingbeforeoffer="",
+        failoverbackuppercentage="",
+        trend="",
+        alertpercentused="",
+        selectiontags="",
+        defaultrouter="",
+        callmanager="",
+        primaryscope="",
+        ddnsenabled="",
+        ddnsdomain="",
+    ):
+        # quoted like scope-add, but only when given so empty fields are left out
+        flags = {
+            "function": "scope-mod",
+            "name": f'"{scope_name}"',
+            "Descr": quoted(description),
+            "R": quoted(ranges),
+            "Policy": quoted(policy),
+            "DhcpServer": quoted(dhcpserver),
+            "Status": status,
+            "Type": type,
+            "PingBeforeOffer": pingbeforeoffer,
+            "FailoverBackupPercentage": failoverbackuppercentage,
+            "Trend": trend,
+            "AlertPercentUsed": alertpercentused,
+            "SelectionTags": selectiontags,
+            "DefaultRouter": defaultrouter,
+            "CallManager": quoted(callmanager),
+            "PrimaryScope": primaryscope,
+            "DdnsEnabled": ddnsenabled,
+            "DdnsDomain": ddnsdomain,
+        }
+
+        return cls._generate_command(**flags)
+
     def ping_ip(self, address):
         """
         Function to ping a given ipaddress and return true or false.
@@ -1194,17 +1856,9 @@ class Eman:
         :return: True/False
         """
 
-        command = "ping -c 1 " + address
-
-        result = self.send_command(command)
-
-        if "0 packets received" in result:
-            active = False
-        else:
-            active = True
-
-        return active
+        return address in self.prober.sweep([address])
 
+    @invalidates(*INTERFACE_READS)
     def rename_interface(self, oldname, newname):
         """
         Function to rename a specified interface within address management.
@@ -1225,6 +1879,128 @@ class Eman:
         return result
 
 
+class EmanBatch:
+    """
+    Collects commands that do not depend on each other's results and sends them
+    to eman in as few batch requests as possible.
+
+    e.g.
+    batch = am.batch()
+    batch.del_scope("host-a", key="host-a")
+    batch.add_interface("host-a-ip1", ip="10.0.0.2", key="host-a")
+    for key, command, result in batch.flush():
+        ...
+
+    Attributes:
+        eman: Eman instance used to send the batch
+        queued: list of (key, command) waiting to be sent
+    """
+
+    def __init__(self, eman):
+        self.eman = eman
+        self.queued = []
+
+    def __len__(self):
+        return len(self.queued)
+
+    def queue(self, command, key=""):
+        """
+        :param command: (str) command string from Eman._generate_command
+        :param key: anything that identifies who the command belongs to (e.g. hostname)
+        """
+        self.queued.append((key, command))
+
+    def del_scope(self, scope_name, Delete_interfaces="Yes", key=""):
+        self.queue(Eman._del_scope_command(scope_name, Delete_interfaces), key)
+
+    def del_subnet(self, subnet, key=""):
+        self.queue(Eman._del_subnet_command(subnet), key)
+
+    def add_subnet(self, subnet, key="", **options):
+        """
+        Queues a subnet-add of a given subnet. Takes the same options as
+        Eman.add_subnet, except that the next available subnet of an address
+        block can not be batched.
+        """
+        self.queue(Eman._add_subnet_command(subnet, **options), key)
+
+    def mod_scope(self, scope_name, key="", **fields):
+        """Queues a scope-mod. Takes the same fields as Eman.mod_scope."""
+        self.queue(Eman._mod_scope_command(scope_name, **fields), key)
+
+    def add_interface(self, interface_name, key="", **options):
+        """
+        Queues an int-add. Takes the same options as Eman.add_interface, except
+        that ip is required because the next available lookup can not be batched.
+        """
+        if not options.get("ip"):
+            raise ValueError(f"{interface_name}: ip is required for a batched int-add")
+        self.queue(Eman._add_interface_command(interface_name, **options), key)
+
+    def flush(self):
+        """
+        Sends everything queued and empties the queue.
+
+        :return: (list) BatchResult(key, command, result) in the order queued
+        """
+        queued, self.queued = self.queued, []
+        results = self.eman.send_batch([command for __key, command in queued])
+        return [
+            BatchResult(key, command, result)
+            for (key, command), result in zip(queued, results)
+        ]
+
+
+BatchResult = collections.namedtuple("BatchResult", ["key", "command", "result"])
+
+InterfaceResult = collections.namedtuple(
+    "InterfaceResult", ["name", "ip", "result", "error"]
+)
+
+ScopeResult = collections.namedtuple("ScopeResult", ["name", "result", "error"])
+
+# fields of Eman.mod_scope, i.e. what a bulk scope update may change
+SCOPE_FIELDS = (
+    "description",
+    "ranges",
+    "policy",
+    "dhcpserver",
+    "status",
+    "type",
+    "pingbeforeoffer",
+    "failoverbackuppercentage",
+    "trend",
+    "alertpercentused",
+    "selectiontags",
+    "defaultrouter",
+    "callmanager",
+    "primaryscope",
+    "ddnsenabled",
+    "ddnsdomain",
+)
+
+
+def scope_result(name, result):
+    """
+    :param name: scope name
+    :param result: what mod_scope or a batched scope-mod returned, None if
+    the command raised
+    :return: ScopeResult, with the eman output as error if it reports one
+    """
+    if result is None:
+        return ScopeResult(name, None, "no result from eman, see the eman log")
+    if "ERROR" in str(result):
+        return ScopeResult(name, None, str(result))
+    return ScopeResult(name, result, None)
+
+
+def quoted(value):
+    """
+    :return: value in double quotes for eman, "" if value is empty
+    """
+    return f'"{value}"' if value else ""
+
+
 def get_gateway(subnet):
     """
     Function which returns the gateway of a given subnet.
@@ -1239,6 +2015,61 @@ def get_gateway(subnet):
     return str(gateway)
 
 
+def find_contiguous_ranges(ips, ip_range, number_of_ranges=1, highest=True):
+    """
+    Single pass run-length scan for blocks of consecutive addresses. Works on
+    integer addresses, so runs crossing a /24 boundary are handled and IPv6
+    lists work too. eman returns the addresses sorted, which keeps the sort
+    linear.
+
+    e.g. find_contiguous_ranges(['10.0.0.2', '10.0.0.3', '10.0.0.5', '10.0.0.6'], 2)
+    returns [('10.0.0.5', '10.0.0.6')]
+
+    :param ips: list of available ip addresses, as strings (e.g. from
+    find_next_ip) or ipaddress objects (e.g. from parse_ip_list). Entries that
+    are not addresses, like an eman ERROR, are ignored.
+    :param ip_range: Number of ip addresses in each range
+    :param number_of_ranges: Number of ranges to return at most
+    :param highest: True to return the highest blocks first, False the lowest.
+    :return: list of (low, high) address strings
+    """
+    size = int(ip_range)
+    numbers = set()
+    address_class = ipaddress.IPv4Address
+    for ip in ips:
+        if not isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+            try:
+                ip = ipaddress.ip_address(str(ip).strip())
+            except ValueError:
+                continue
+        numbers.add(int(ip))
+        address_class = type(ip)
+    if size < 1 or not numbers:
+        return []
+
+    step = -1 if highest else 1
+    ranges = []
+    run_start = previous = None
+    run_length = 0
+    for number in sorted(numbers, reverse=highest):
+        if previous is not None and number - previous == step:
+            run_length += 1
+        else:
+            run_start = number
+            run_length = 1
+        previous = number
+
+        if run_length == size:
+            low, high = sorted((run_start, number))
+            ranges.append((str(address_class(low)), str(address_class(high))))
+            if len(ranges) >= int(number_of_ranges):
+                break
+            # the next block must not overlap this one
+            previous = None
+
+    return ranges
+
+
 def get_dhcp_add(local):
     """
     Function to provide a DHCP name based on a provided local.
@@ -1280,34 +2111,74 @@ def get_dhcp_add(local):
     return dhcpsrv
 
 
+def scan_ips(string):
+    """
+    Finds every IPv4 and IPv6 address and prefix in a string in one pass.
+
+    e.g. list(scan_ips('Successfully added Subnet 10.34.33.16/29'))
+    returns [('10.34.33.16/29', IPv4Address('10.34.33.16'), 29)]
+
+    :param string: (str) the string to search
+    :return: generator of (text as found, ipaddress address, prefix length
+    or None), in the order they appear
+    """
+    for match in IP_PATTERN.finditer(string):
+        address, prefix = match.groups()
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            continue
+        if prefix is not None:
+            prefix = int(prefix)
+            if prefix > ip.max_prefixlen:
+                continue
+        yield match.group(), ip, prefix
+
+
+def parse_ip_list(string, as_int=False):
+    """
+    Parses a -comma list of addresses or subnets (e.g. the output of
+    next-avail -r=all -comma). Entries that are not addresses are skipped.
+
+    e.g. parse_ip_list('10.0.0.2, 10.0.0.3') returns
+    [IPv4Address('10.0.0.2'), IPv4Address('10.0.0.3')]
+
+    :param string: (str) comma and/or whitespace separated addresses
+    :param as_int: (bool) return the addresses as integers
+    :return: (list) ipaddress addresses, networks for entries with a prefix,
+    or their integer (network) addresses with as_int
+    """
+    ips = []
+    for entry in SEPARATOR_PATTERN.split(string):
+        try:
+            if "/" in entry:
+                ip = ipaddress.ip_network(entry, strict=False)
+                ips.append(int(ip.network_address) if as_int else ip)
+            else:
+                ip = ipaddress.ip_address(entry)
+                ips.append(int(ip) if as_int else ip)
+        except ValueError:
+            continue
+    return ips
+
+
+def _find_ip(string, version, with_prefix):
+    for text, ip, prefix in scan_ips(string):
+        if ip.version == version and (prefix is not None) == with_prefix:
+            return text
+    return None
+
+
 def find_ipv6_with_subnet(string):
     """
     Find and return IPv6 address with subnet inside a string.
     This function will only return an ipv6 address with a subnet
 
-
-
     :param string: (str) The string to search for ipv6 with subnet
     (i.e. "Successfully added Subnet 2001:420:30a:200::a10/127")
     :return: (str) the found ipv6 address with subnet (i.e. '2001:420:30a:200::a10/127')
     """
-    ip = re.search(
-        r"(([0-9a-fA-F]{1,4}:){7,7}[0-9a-fA-F]{1,4}|([0-9a-fA-F]{1,4}:){1,7}:|"
-        r"([0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}|([0-9a-fA-F]{1,4}:){1,5}"
-        r"(:[0-9a-fA-F]{1,4}){1,2}|([0-9a-fA-F]{1,4}:){1,4}(:[0-9a-fA-F]{1,4}){1,3}|"
-        r"([0-9a-fA-F]{1,4}:){1,3}(:[0-9a-fA-F]{1,4}){1,4}|([0-9a-fA-F]{1,4}:){1,2}"
-        r"(:[0-9a-fA-F]{1,4}){1,5}|[0-9a-fA-F]{1,4}:((:[0-9a-fA-F]{1,4}){1,6})|:"
-        r"((:[0-9a-fA-F]{1,4}){1,7}|:)|fe80:(:[0-9a-fA-F]{0,4}){0,4}%[0-9a-zA-Z]{1,}|"
-        r"::(ffff(:0{1,4}){0,1}:){0,1}((25[0-5]|(2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}"
-        r"(25[0-5]|(2[0-4]|1{0,1}[0-9]){0,1}[0-9])|([0-9a-fA-F]{1,4}:){1,4}:((25[0-5]|"
-        r"(2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}(25[0-5]|(2[0-4]|1{0,1}[0-9]){0,1}[0-9]))/"
-        r"([0-9])([0-9])([0-9])?",
-        string,
-    )
-    if ip:
-        return ip.group()
-
-    return None
+    return _find_ip(string, 6, True)
 
 
 def find_ipv6_without_subnet(string):
@@ -1315,30 +2186,11 @@ def find_ipv6_without_subnet(string):
     Find and resturn IPv6 address without subnet inside a string
     This function will only return an ipv6address that does not have a subnet
 
-
     :param string: (str) The string to search for ipv6 with subnet(i.e.
     "Successfully added interface 2001:420:30a:200::a10")
     :return: (str) the found ipv6 address with subnet (i.e. '2001:420:30a:200::a10')
     """
-    ip = re.search(
-        r"(([0-9a-fA-F]{1,4}:){7,7}[0-9a-fA-F]{1,4}|([0-9a-fA-F]{1,4}:){1,7}:"
-        r"|([0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}|"
-        r"([0-9a-fA-F]{1,4}:){1,5}(:[0-9a-fA-F]{1,4}){1,2}|"
-        r"([0-9a-fA-F]{1,4}:){1,4}(:[0-9a-fA-F]{1,4}){1,3}|([0-9a-fA-F]"
-        r"{1,4}:){1,3}(:[0-9a-fA-F]{1,4}){1,4}|([0-9a-fA-F]{1,4}:){1,2}"
-        r"(:[0-9a-fA-F]{1,4}){1,5}|[0-9a-fA-F]{1,4}:((:[0-9a-fA-F]"
-        r"{1,4}){1,6})|:((:[0-9a-fA-F]{1,4}){1,7}|:)|fe80:(:[0-9a-fA-F]"
-        r"{0,4}){0,4}%[0-9a-zA-Z]{1,}|::(ffff(:0{1,4}){0,1}:){0,1}"
-        r"((25[0-5]|(2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}(25[0-5]|(2[0-4]|1{0,1}"
-        r"[0-9]){0,1}[0-9])|([0-9a-fA-F]{1,4}:){1,4}:"
-        r"((25[0-5]|(2[0-4]|1{0,1}[0-9]){0,1}[0-9])\.){3,3}(25[0-5]|(2[0-4]|1{0,1}"
-        r"[0-9]){0,1}[0-9]))",
-        string,
-    )
-    if ip:
-        return ip.group()
-
-    return None
+    return _find_ip(string, 6, False)
 
 
 def find_ipv4_with_subnet(string):
@@ -1346,17 +2198,10 @@ def find_ipv4_with_subnet(string):
     Find and return IPv4 address with subnet inside a string.
     This function will only return an ipv4 address with a subnet
 
-
-
     :param string: (str) The string to search for ipv6 with subnet(i.e. "Successfully added Subnet 10.34.33.20/30")
     :return: (str) the found ipv6 address with subnet (i.e. '10.34.33.20/30')
     """
-    ip = re.search(r"([0-9]{1,3}\.){3}[0-9]{1,3}/([0-9])([0-9])?", string)
-
-    if ip:
-        return ip.group()
-
-    return None
+    return _find_ip(string, 4, True)
 
 
 def find_ipv4_without_subnet(string):
@@ -1367,47 +2212,32 @@ def find_ipv4_without_subnet(string):
     :param string: (str) The string to search for ipv6 with subnet(i.e. "Successfully added interface 10.34.33.20")
     :return: (str) the found ipv6 address with subnet (i.e. '10.34.33.20')
     """
-    ip = re.search(r"([0-9]{1,3}\.){3}[0-9][0-9]?", string)
-
-    if ip:
-        return ip.group()
-
-    return None
+    return _find_ip(string, 4, False)
 
 
 def get_ip_from_string(string):
     """
     Will find and return an ipv4 address w/ subnet, ipv4 address w/o subnet, ipv6 address w/ subnet, or
-    ipv6 address w/o subnet.
+    ipv6 address w/o subnet, preferred in that order. The string is scanned once.
 
     if string = 'Successfully added Subnet 10.34.33.20/30' return '10.34.33.20/30'
     if string = 'Successfully added interface 10.34.33.20' return '10.34.33.20'
     if string ='Successfully added Subnet 2001:420:30a:200::a10/57' return '2001:420:30a:200::a10/57'
     if string = 'Successfully added interface 2001:420:30a:200::a10' return '2001:420:30a:200::a10'
+    if string = 'Subnet:10.0.0.8/29 found' return '10.0.0.8/29'
 
     :param string: (str) the string to search for ipv4 w/ or w/o subnet or ipv6 w/ or w/o subnet
     :return: (str) ipv4 address w/ or w/o subnet or ipv6 address w/ or w/o subnet
     """
-    ip = find_ipv4_with_subnet(string)
-    if ip:
-        return ip
+    best = None
+    for text, ip, prefix in scan_ips(string):
+        rank = (ip.version == 6) * 2 + (prefix is None)
+        if rank == 0:
+            return text
+        if best is None or rank < best[0]:
+            best = (rank, text)
 
-    ip = find_ipv4_without_subnet(string)
-
-    if ip:
-        return ip
-
-    ip = find_ipv6_with_subnet(string)
-
-    if ip:
-        return ip
-
-    ip = find_ipv6_without_subnet(string)
-
-    if ip:
-        return ip
-
-    return None
+    return best[1] if best else None
 
 
 if __name__ == "__main__":
@@ -1461,8 +2291,8 @@ if __name__ == "__main__":
         "jvanhave-cvo-vEdge100WM",
         "kvassall-cvo-vEdge100WM",
     )
-    for i in scopes:
-        result = b.mod_scope(scope_name=i, selectiontags=("IPPhones", "OtherDevices"))
+    tags = {"selectiontags": ("IPPhones", "OtherDevices")}
+    for result in b.mod_scopes_bulk([(i, tags) for i in scopes]):
         # result = b.del_scope('rmassing-viptela-cvo')
         print(result)
     print("\n++++++++++++++++++")
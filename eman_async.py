@@ -0,0 +1,827 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import asyncio
+import ipaddress
+import os
+import urllib.parse
+
+from eman import (
+    LOGGER,
+    LOGPATH,
+    Eman,
+    InterfaceResult,
+    UnableToFindError,
+    UnableToReserveError,
+    find_contiguous_ranges,
+    get_dhcp_add,
+    get_gateway,
+    scope_result,
+)
+from logging_config import configure_logger
+from metrics import batch_outcome, command_function, command_outcome
+from probe import Prober
+from retry import RetryPolicy
+from eman_transport import (
+    CGI_PATH,
+    DEFAULT_SERVER,
+    DEFAULT_TIMEOUT,
+    PerlTransport,
+    batch_bodies,
+    batch_time,
+    cli_url,
+    encode_args,
+    kill_process_group,
+    request_headers,
+    split_command,
+    ssl_context,
+    timeout_error,
+    write_batch_file,
+)
+
+
+class AsyncPerlTransport:
+    """
+    Runs ``perl eman-am.pl`` per command as an asyncio subprocess, at most
+    ``size`` at a time. A call running past ``timeout`` seconds is killed, a
+    batch is allowed ``batch_timeout`` (default ``timeout``) per BATCH_SIZE
+    commands.
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        size=16,
+        script="",
+        timeout=DEFAULT_TIMEOUT,
+        batch_timeout=None,
+    ):
+        self.perl = PerlTransport(username, password, script=script)
+        self.size = size
+        self.timeout = timeout
+        self.batch_timeout = timeout if batch_timeout is None else batch_timeout
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def run(self, command, timeout=None):
+        """
+        :param command: command that will be sent to eman
+        :param timeout: seconds this call may take, self.timeout if not given
+        :return: (output, error) as stripped strings
+        """
+        if timeout is None:
+            timeout = self.timeout
+        env = dict(os.environ, PERL_LWP_SSL_VERIFY_HOSTNAME="0")
+        async with self._semaphore:
+            process = await asyncio.create_subprocess_shell(
+                self.perl.command_line(command),
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=env,
+                start_new_session=True,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                kill_process_group(process)
+                await process.wait()
+                return "", timeout_error(timeout)
+        return (
+            stdout.decode(errors="replace").strip(),
+            stderr.decode(errors="replace").strip(),
+        )
+
+    async def run_batch(self, commands):
+        """
+        :param commands: (list) command strings
+        :return: (output, error) for the whole batch
+        """
+        batch_file = write_batch_file(commands)
+        try:
+            return await self.run(
+                f"-batch={batch_file}", batch_time(self.batch_timeout, commands)
+            )
+        finally:
+            os.unlink(batch_file)
+
+    async def close(self):
+        """Nothing to release, every command runs in its own process."""
+
+
+class AsyncHttpTransport:
+    """
+    Posts commands to cli.pcgi over asyncio streams, keeping idle
+    connections open for reuse. At most ``size`` requests are in flight.
+    Each request may wait ``timeout`` seconds for eman's answer, a batch
+    request of BATCH_SIZE commands ``batch_timeout`` (default ``timeout``).
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        server=DEFAULT_SERVER,
+        url="",
+        size=100,
+        timeout=DEFAULT_TIMEOUT,
+        verify=False,
+        batch_timeout=None,
+    ):
+        self.username = username
+        self.password = password
+        self.url = url or cli_url(server)
+        self.size = size
+        self.timeout = timeout
+        self.batch_timeout = timeout if batch_timeout is None else batch_timeout
+
+        parsed = urllib.parse.urlsplit(self.url)
+        self._ssl = ssl_context(verify) if parsed.scheme == "https" else None
+        self._host = parsed.hostname
+        self._port = parsed.port or (443 if self._ssl else 80)
+        self._path = parsed.path or CGI_PATH
+        self._headers = request_headers(username, password)
+        self._headers["Host"] = parsed.netloc
+
+        self._semaphore = asyncio.Semaphore(size)
+        self._idle = []
+
+    async def _connect(self):
+        return await asyncio.open_connection(self._host, self._port, ssl=self._ssl)
+
+    @staticmethod
+    def _close(connection):
+        connection[1].close()
+
+    @staticmethod
+    def _dropped(connection):
+        """
+        :return: True if the server closed an idle connection
+        """
+        reader, writer = connection
+        return reader.at_eof() or writer.is_closing()
+
+    async def _send(self, connection, body):
+        __reader, writer = connection
+        content = body.encode()
+        head = f"POST {self._path} HTTP/1.1\r\n"
+        for name, value in self._headers.items():
+            head += f"{name}: {value}\r\n"
+        head += f"Content-Length: {len(content)}\r\n\r\n"
+        writer.write(head.encode() + content)
+        await writer.drain()
+
+    async def _reuse(self, body):
+        """
+        Sends body on an idle keep-alive connection, if one is left open.
+
+        :param body: (str) form-urlencoded body
+        :return: the connection body was sent on, or None if there was no
+        idle connection or sending failed. A request that could not be sent
+        never reached eman, so it is safe to send it on a new connection.
+        """
+        while self._idle:
+            connection = self._idle.pop()
+            if self._dropped(connection):
+                self._close(connection)
+                continue
+            try:
+                await asyncio.wait_for(self._send(connection, body), self.timeout)
+            except ConnectionError:
+                self._close(connection)
+                return None
+            except BaseException:
+                self._close(connection)
+                raise
+            return connection
+        return None
+
+    async def _receive(self, connection):
+        reader, __writer = connection
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by server")
+        __version, status, reason = status_line.decode().rstrip("\r\n").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().rstrip("\r\n")
+            if not line:
+                break
+            name, __sep, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            data = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                data += await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            data = await reader.readexactly(int(headers["content-length"]))
+        else:
+            data = await reader.read()
+            headers["connection"] = "close"
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        return int(status), reason, data, keep_alive
+
+    async def post(self, body, timeout=None):
+        """
+        Only sends body a second time when it could not be sent on an idle
+        keep-alive connection, see HttpTransport.post.
+
+        :param body: (str) form-urlencoded body
+        :param timeout: seconds to wait for eman's answer, self.timeout if not
+        given
+        :return: (output, error) as stripped strings
+        """
+        async with self._semaphore:
+            connection = None
+            try:
+                connection = await self._reuse(body)
+                if connection is None:
+                    connection = await asyncio.wait_for(self._connect(), self.timeout)
+                    await asyncio.wait_for(self._send(connection, body), self.timeout)
+                status, reason, data, keep_alive = await asyncio.wait_for(
+                    self._receive(connection),
+                    self.timeout if timeout is None else timeout,
+                )
+            except (
+                OSError,
+                asyncio.IncompleteReadError,
+                asyncio.TimeoutError,
+                ValueError,
+            ) as error:
+                if connection is not None:
+                    self._close(connection)
+                return "", f"ERROR:{str(error) or 'timeout'}"
+
+            if keep_alive:
+                self._idle.append(connection)
+            else:
+                self._close(connection)
+
+        if 200 <= status < 300:
+            return data.decode(errors="replace").strip(), ""
+        return "", f"ERROR:{reason}"
+
+    async def run(self, command):
+        """
+        :param command: command that will be sent to eman
+        :return: (output, error) as stripped strings
+        """
+        return await self.post(encode_args(split_command(command)))
+
+    async def run_batch(self, commands):
+        """
+        :param commands: (list) command strings
+        :return: (output, error) for the whole batch
+        """
+        outputs = []
+        errors = []
+        for body in batch_bodies(commands):
+            output, error = await self.post(body, self.batch_timeout)
+            if output:
+                outputs.append(output)
+            if error:
+                errors.append(error)
+        return "\n".join(outputs), "\n".join(errors)
+
+    async def close(self):
+        """Closes every idle connection."""
+        while self._idle:
+            self._close(self._idle.pop())
+
+
+ASYNC_TRANSPORTS = {
+    "perl": AsyncPerlTransport,
+    "http": AsyncHttpTransport,
+}
+
+
+# pylint: disable-msg=R0904
+class AsyncEman:
+    """
+    Awaitable counterpart of Eman. Commands are built and results parsed the
+    same way, only sending is non-blocking, so many operations can be in
+    flight on one event loop.
+
+    e.g.
+    async with AsyncEman(USERNAME, PASSWORD) as am:
+        subnets = await asyncio.gather(
+            *(am.add_subnet(address_block=block, prefix="29") for i in range(10))
+        )
+
+    Attributes:
+        username: User with rights to make changes in Eman-am or eman-cli
+        password: Password for expected user
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        transport="http",
+        prober=None,
+        metrics=None,
+        retry=None,
+        **transport_options,
+    ):
+        """
+        :param transport: (str) 'http' (default) or 'perl', or a transport
+        instance with an async run(command) method.
+        :param prober: (probe.Prober) used when ping=True, runs off the event loop
+        :param metrics: (metrics.Metrics) times every command, see Eman
+        :param retry: (retry.RetryPolicy) retries transient failures, see Eman
+        :param transport_options: passed to the transport (e.g. size=50)
+        """
+        configure_logger("eman", LOGPATH)
+        self.username = username
+        self.password = password
+        if isinstance(transport, str):
+            try:
+                transport = ASYNC_TRANSPORTS[transport](
+                    username, password, **transport_options
+                )
+            except KeyError:
+                raise ValueError(
+                    f"Unknown transport {transport!r}, "
+                    f"expected one of {sorted(ASYNC_TRANSPORTS)}"
+                )
+        self.transport = transport
+        self.prober = prober or Prober()
+        self.metrics = metrics
+        if retry is True:
+            retry = RetryPolicy()
+        self.retry = retry or None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.transport.close()
+
+    async def send_command(self, command):
+        """Awaitable Eman.send_command."""
+        LOGGER.debug(f"command: {command}")
+
+        if self.retry is None:
+            output, error = await self._run(command)
+        else:
+            output, error = await self.retry.call_async(
+                lambda: self._run(command), command
+            )
+        return Eman._handle_output(command, output, error)
+
+    async def _run(self, command):
+        if self.metrics is None:
+            return await self.transport.run(command)
+        with self.metrics.timer(
+            "eman_command_seconds", function=command_function(command)
+        ) as labels:
+            output, error = await self.transport.run(command)
+            labels["outcome"] = command_outcome(output, error)
+        return output, error
+
+    async def send_batch(self, commands):
+        """Awaitable Eman.send_batch."""
+        if not commands:
+            return []
+
+        run_batch = getattr(self.transport, "run_batch", None)
+        if run_batch is not None:
+
+            async def send():
+                if self.metrics is None:
+                    return await run_batch(commands)
+                with self.metrics.timer("eman_batch_seconds") as labels:
+                    output, error = await run_batch(commands)
+                    labels["outcome"] = batch_outcome(output, error)
+                return output, error
+
+            if self.retry is None:
+                output, error = await send()
+            else:
+                output, error = await self.retry.call_async(
+                    send, f"batch of {len(commands)}"
+                )
+            return Eman._split_batch(commands, output, error)
+        return list(
+            await asyncio.gather(*(self.send_command(command) for command in commands))
+        )
+
+    async def add_address_block(self, address_block, **options):
+        """Awaitable Eman.add_address_block, takes the same options."""
+        command = Eman._add_address_block_command(address_block, **options)
+
+        result = await self.send_command(command=command)
+
+        LOGGER.info("add_address_block: %s", result)
+        if "ERROR" in result:
+            raise UnableToReserveError(result)
+        return result
+
+    async def add_subnet(self, address_block="", subnet="", prefix="", **options):
+        """Awaitable Eman.add_subnet, takes the same options."""
+        if address_block and not subnet:
+            try:
+                if not prefix:
+                    prefix = "126"
+                subnet = await self.find_next_available(
+                    address_block=address_block,
+                    search_type="S",
+                    subnet_prefix_length=prefix,
+                )
+            except UnableToFindError as error:
+                raise UnableToReserveError(error)
+
+        command = Eman._add_subnet_command(subnet, **options)
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("add_subnet: %s", result)
+        return Eman._added_ip(result)
+
+    async def add_interface(self, interface_name, ip="", subnet="", **options):
+        """Awaitable Eman.add_interface, takes the same options."""
+        if not ip and subnet:
+            LOGGER.info(
+                "%s - No ipaddress was provided. getting next available "
+                "ipaddress based on subnet.",
+                interface_name,
+            )
+            try:
+                ip = (
+                    await self.find_list_of_next_available_ips(
+                        subnet=subnet, number_of_addresses_returned="1"
+                    )
+                )[0]
+            except UnableToFindError as error:
+                raise UnableToReserveError(error)
+
+        command = Eman._add_interface_command(interface_name, ip=ip, **options)
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("add_interface: %s", result)
+        return Eman._added_ip(result)
+
+    async def add_interfaces_bulk(self, interfaces, batch=False):
+        """Awaitable Eman.add_interfaces_bulk, all non-batched adds run at once."""
+        results = [None] * len(interfaces)
+
+        batched = []
+        if batch and getattr(self.transport, "run_batch", None) is not None:
+            batched = [index for index, record in enumerate(interfaces) if record[1]]
+        if batched:
+            commands = [
+                Eman._add_interface_command(name, ip=ip, **options)
+                for name, ip, options in (interfaces[index] for index in batched)
+            ]
+            for index, result in zip(batched, await self.send_batch(commands)):
+                name, ip, options = interfaces[index]
+                LOGGER.info("add_interface: %s", result)
+                try:
+                    added = Eman._added_ip(result)
+                    results[index] = InterfaceResult(name, ip, added, None)
+                except UnableToReserveError as error:
+                    results[index] = InterfaceResult(name, ip, None, str(error))
+
+        async def add(index):
+            name, ip, options = interfaces[index]
+            try:
+                added = await self.add_interface(name, ip=ip, **options)
+                return InterfaceResult(name, ip, added, None)
+            except Exception as error:
+                LOGGER.info("add_interface %s: %s", name, error)
+                return InterfaceResult(name, ip, None, str(error))
+
+        remaining = [index for index, result in enumerate(results) if result is None]
+        added = await asyncio.gather(*(add(index) for index in remaining))
+        for index, result in zip(remaining, added):
+            results[index] = result
+        return results
+
+    async def add_next_ip(self, hostname, subnet, multihomed):
+        """Awaitable Eman.add_next_ip."""
+        multihomed = "Y" if multihomed is True else "N"
+
+        command = f"-f=add-nextavail -n={hostname} -s={subnet} -Ct1={self.username} \
+            -m={multihomed}"
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("add_next_ip: %s", result)
+        return result
+
+    async def alias_add(self, alias, interface):
+        """Awaitable Eman.alias_add."""
+        result = await self.send_command(f"-f=alias-add -a={alias} -i={interface}")
+        LOGGER.info("alias_add: %s", result)
+        return result
+
+    async def alias_delete(self, alias):
+        """Awaitable Eman.alias_delete."""
+        result = await self.send_command(f"-f=alias-del -a={alias}")
+        LOGGER.info("alias_delete: %s", result)
+        return result
+
+    async def alias_mod(self, oldalias, newalias):
+        """Awaitable Eman.alias_mod."""
+        result = await self.send_command(f"-f=alias-mod -oa={oldalias} -a={newalias}")
+        LOGGER.info("alias_mod: %s", result)
+        return result
+
+    async def create_scope(self, name, descrip, subnet, iprange, policy, local):
+        """Awaitable Eman.create_scope."""
+        lowrange, highrange = await self.get_range(subnet, iprange)
+        LOGGER.info("Collected Ranges: %s, %s", lowrange, highrange)
+
+        if lowrange == 0:
+            return (
+                "There are not enough consecutive ip's within this subnet to meet "
+                "your requirements. Please reduce your range and try again."
+            )
+
+        defroute = get_gateway(subnet)
+        dhcp = get_dhcp_add(local.lower())
+
+        command = f"-f=scope-add -N={name} -D={descrip} -sn={subnet} \
+        -R='{lowrange}:{highrange}' -P={policy} -DS='{dhcp}' -DR='{defroute}' -Tr='N'"
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("create_scope: %s", result)
+        return result
+
+    async def del_address_block(self, address_block):
+        """Awaitable Eman.del_address_block."""
+        address_block_ip = ipaddress.ip_interface(address_block)
+
+        result = await self.send_command(
+            f"-f=address-block-del -AddressBlock={address_block_ip}"
+        )
+
+        LOGGER.info("del_address_block: %s", result)
+        return result
+
+    async def del_interface(self, ip="", interface_name=""):
+        """Awaitable Eman.del_interface."""
+        if ip and not interface_name:
+            interface = (
+                await self.find_interfaces(ip=ip, number_of_interfaces_to_return="1")
+            )[0]
+            interface_name = interface.split(":")[1]
+
+        elif interface_name and not ip:
+            interface = (
+                await self.find_interfaces(
+                    interface_name=interface_name, number_of_interfaces_to_return="1"
+                )
+            )[0]
+            ip = interface.split(":")[1]
+
+        flags = {"function": "int-del", "ipaddress": ip, "name": interface_name}
+
+        result = await self.send_command(Eman._generate_command(**flags))
+
+        LOGGER.info("del_interface: %s", result)
+        return result
+
+    async def del_subnet(self, subnet):
+        """Awaitable Eman.del_subnet."""
+        command = Eman._del_subnet_command(subnet)
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("delsubnet: %s", result)
+        return result
+
+    async def find_subnets_free(self, address_block):
+        """Awaitable Eman.find_subnets_free."""
+        address_block_ip = ipaddress.ip_interface(address_block)
+        return await self.send_command(
+            f"-f=subnets-free -addressblock={address_block_ip.ip}"
+        )
+
+    async def find_helpers(self, local):
+        """Awaitable Eman.find_helpers."""
+        result = await self.send_command(f"-f=int-find -n=dhcp-{local}* -r=2")
+
+        LOGGER.info("findhelpers: %s", result)
+
+        if "ERROR" in str(result):
+            return f"No dhcp helpers were found for {local}."
+        return result
+
+    async def find_interfaces(self, return_as_dictionary=False, **options):
+        """Awaitable Eman.find_interfaces, takes the same options."""
+        command = Eman._find_interfaces_command(**options)
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        return Eman._parse_interfaces(result, return_as_dictionary)
+
+    async def find_interface(self, interface):
+        """Awaitable Eman.find_interface."""
+        if "." in interface:
+            command = f"-f=int-find -i={interface}"
+        else:
+            command = f"-f=int-find -n={interface}"
+
+        result = await self.send_command(command)
+
+        if "ERROR" in str(result):
+            LOGGER.info("%s was not found.", interface)
+            return f"{interface} was not found."
+
+        LOGGER.info("find_inetrface: %s", result)
+        return result
+
+    async def find_next_available(self, **options):
+        """Awaitable Eman.find_next_available, takes the same options."""
+        command = Eman._find_next_available_command(**options)
+
+        result = await self.send_command(command=command)
+
+        return Eman._parse_next_available(result)
+
+    async def find_list_of_next_available_ips(
+        self, address_block="", subnet="", number_of_addresses_returned="all", ping=True
+    ):
+        """Awaitable Eman.find_list_of_next_available_ips."""
+        command = Eman._find_next_available_command(
+            address_block=address_block,
+            subnet=subnet,
+            number_of_blocks_or_addresses_returned=number_of_addresses_returned,
+        )
+        result = await self.send_command(command=command)
+        ips = [str(ip) for ip in Eman._parse_next_available(result, as_list=True)]
+
+        if ping:
+            active = await asyncio.to_thread(self.prober.sweep, ips)
+            return [ip for ip in ips if ip not in active]
+
+        return ips
+
+    async def find_next_ip(self, subnet, iprange, ping):
+        """Awaitable Eman.find_next_ip."""
+        ipblock = [str(ip) for ip in await self._available_ips(subnet)]
+
+        if "all" in iprange:
+            return ipblock
+
+        if len(ipblock) < int(iprange):
+            LOGGER.info("findnextip: Not enough ip's available")
+            return "Not enough ip's available"
+
+        if ping is not True:
+            ips = ipblock[: int(iprange)]
+            LOGGER.info("find_next_ip: %s", ips)
+            return ips
+
+        ips = []
+        window = max(int(iprange), self.prober.concurrency)
+        for start in range(0, len(ipblock), window):
+            candidates = ipblock[start : start + window]
+            active = await asyncio.to_thread(self.prober.sweep, candidates)
+            ips.extend(ip for ip in candidates if ip not in active)
+            if len(ips) >= int(iprange):
+                ips = ips[: int(iprange)]
+                break
+
+        LOGGER.info("find_next_ip: %s", ips)
+        return ips
+
+    async def _available_ips(self, subnet):
+        """Awaitable Eman._available_ips."""
+        command = f"-f=next-avail -s={subnet} -t=I -r=all -comma"
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("find_next_ip - Eman Return: %s", result)
+
+        return Eman._parse_available(result)
+
+    async def get_range(self, subnet, ip_range, highest=True):
+        """Awaitable Eman.get_range."""
+        ranges = await self.get_ranges(subnet, ip_range, 1, highest=highest)
+        if ranges:
+            return ranges[0]
+
+        LOGGER.info("get_range: No congruent ip addresses in the given range")
+        return 0, 0
+
+    async def get_ranges(self, subnet, ip_range, number_of_ranges, highest=True):
+        """Awaitable Eman.get_ranges."""
+        ips = await self._available_ips(subnet)
+        return find_contiguous_ranges(
+            ips, ip_range, number_of_ranges=number_of_ranges, highest=highest
+        )
+
+    async def get_scopes_by_subnet(self, subnet):
+        """Awaitable Eman.get_scopes_by_subnet."""
+        command = f"-f=scope-info -details -s={subnet}"
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        return Eman._parse_scopes(result)
+
+    async def add_scope(self, **options):
+        """Awaitable Eman.add_scope, takes the same options."""
+        command = Eman._add_scope_command(**options)
+        LOGGER.info(command)
+
+        try:
+            result = await self.send_command(command)
+            LOGGER.info("scope-add: %s", result)
+            return result
+        except Exception as error:
+            LOGGER.info(error)
+
+    async def del_scope(self, scope_name, Delete_interfaces="Yes"):
+        """Awaitable Eman.del_scope."""
+        command = Eman._del_scope_command(scope_name, Delete_interfaces)
+        LOGGER.info(command)
+
+        try:
+            result = await self.send_command(command)
+            LOGGER.info("scope-del: %s", result)
+            return result
+        except Exception as error:
+            LOGGER.info(error)
+            return error
+
+    async def mod_scope(self, **options):
+        """Awaitable Eman.mod_scope, takes the same options."""
+        command = Eman._mod_scope_command(**options)
+        LOGGER.info(command)
+
+        try:
+            result = await self.send_command(command)
+            LOGGER.info("mod_scope: %s", result)
+            return result
+        except Exception as error:
+            LOGGER.info(error)
+
+    async def mod_scopes_bulk(self, updates):
+        """Awaitable Eman.mod_scopes_bulk, without batch mode all mods run at once."""
+        if not updates:
+            return []
+
+        if getattr(self.transport, "run_batch", None) is not None:
+            commands = [
+                Eman._mod_scope_command(name, **fields) for name, fields in updates
+            ]
+            results = await self.send_batch(commands)
+        else:
+            results = await asyncio.gather(
+                *(self.mod_scope(scope_name=name, **fields) for name, fields in updates)
+            )
+
+        scopes = []
+        for (name, fields), result in zip(updates, results):
+            LOGGER.info("mod_scope %s: %s", name, result)
+            scopes.append(scope_result(name, result))
+        return scopes
+
+    async def ping_ip(self, address):
+        """Awaitable Eman.ping_ip."""
+        return address in await asyncio.to_thread(self.prober.sweep, [address])
+
+    async def rename_interface(self, oldname, newname):
+        """Awaitable Eman.rename_interface."""
+        command = f"-f=int-ren -on={oldname} -nn={newname}"
+        LOGGER.info(command)
+
+        result = await self.send_command(command)
+
+        LOGGER.info("rename_interface: %s", result)
+        return result
@@ -0,0 +1,225 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import collections
+import copy
+import fnmatch
+import functools
+import ipaddress
+import shlex
+import threading
+import time
+
+# seconds a read result stays valid, per Eman method
+DEFAULT_TTLS = {
+    "find_interface": 60,
+    "find_interfaces": 60,
+    "find_helpers": 3600,
+    "get_scopes_by_subnet": 60,
+    "find_subnets_free": 30,
+}
+
+
+class EmanCache:
+    """
+    LRU cache with a per-method time to live for read-only eman lookups.
+
+    Attributes:
+        ttls: {method name: seconds}, methods not listed are not cached
+        maxsize: number of results kept before the least recently used is dropped
+    """
+
+    def __init__(self, ttls=None, maxsize=1024):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key: (method name, arguments)
+        :return: (hit, value)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, copy.copy(entry[1])
+
+    def put(self, key, value):
+        ttl = self.ttls.get(key[0])
+        if not ttl:
+            return
+        terms = cache_terms((key[1], [value for name, value in key[2]]))
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, copy.copy(value), terms)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *methods, terms=None):
+        """
+        Drops cached results of the given methods, or of every method if none
+        are given.
+
+        :param terms: (names, networks) a write touched, see cache_terms. Only
+        the results looked up by one of them are dropped, None drops them all.
+        """
+        with self._lock:
+            if not methods and terms is None:
+                self._entries.clear()
+                return
+            for key in [
+                key
+                for key, entry in self._entries.items()
+                if (not methods or key[0] in methods)
+                and (terms is None or affected(entry[2], terms))
+            ]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cache_terms(values):
+    """
+    Collects what a call looks up or changes from its arguments: every
+    string in values (nested in lists, tuples and dicts), command strings
+    split into their flag values. ranges like 'a:b' give both addresses.
+
+    e.g. cache_terms((("host-a.cisco.com", "10.0.0.9"), {}))
+    returns ({'host-a'}, {IPv4Network('10.0.0.9/32')})
+
+    :return: (names, networks) names as lowercase short names, addresses
+    and subnets as ipaddress networks
+    """
+    names, networks = set(), set()
+    pending = [values]
+    while pending:
+        value = pending.pop()
+        if isinstance(value, dict):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple, set)):
+            pending.extend(value)
+        elif isinstance(value, str):
+            value = value.strip()
+            if value.startswith("-") and "=" in value:
+                try:
+                    args = shlex.split(value)
+                except ValueError:
+                    args = value.split()
+                pending.extend(arg.partition("=")[2].split(",") for arg in args)
+                continue
+            value = value.strip("'\"")
+            if not value:
+                continue
+            try:
+                networks.add(ipaddress.ip_network(value, strict=False))
+                continue
+            except ValueError:
+                pass
+            first, colon, last = value.partition(":")
+            if colon and "." in first:
+                # a v4 range 'first:last'; v6 addresses parsed above
+                pending.extend((first, last))
+                continue
+            names.add(value.lower().split(".")[0])
+    return names, networks
+
+
+def affected(entry, write):
+    """
+    :param entry: cache_terms of a cached lookup
+    :param write: cache_terms of a write
+    :return: True if the write may change the lookup's result: they share a
+    name (a lookup name may be a * pattern) or an address range, or the
+    write says nothing about the kind of term the lookup is by.
+    """
+    names, networks = entry
+    write_names, write_networks = write
+    if not names and not networks:
+        return True
+    if names and not write_names or networks and not write_networks:
+        return True
+    for name in names:
+        if name in write_names or (
+            "*" in name and fnmatch.filter(write_names, name)
+        ):
+            return True
+    return any(
+        network.overlaps(changed)
+        for network in networks
+        for changed in write_networks
+        if network.version == changed.version
+    )
+
+
+def cached(func):
+    """
+    Caches the result of an Eman read method in self.cache, if the instance has
+    one. Results containing an eman ERROR are not cached.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if self.cache is None:
+            return func(self, *args, **kwargs)
+
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        hit, value = self.cache.get(key)
+        if hit:
+            return value
+
+        value = func(self, *args, **kwargs)
+        if not (isinstance(value, str) and "ERROR" in value):
+            self.cache.put(key, value)
+        return value
+
+    return wrapper
+
+
+def invalidates(*methods, by_key=True):
+    """
+    Marks an Eman write method: once it ran, the cached results of the given
+    read methods (every method if none are given) that it may have changed
+    are dropped. Those are the results looked up by a hostname, address or
+    subnet the write was called with, see affected.
+
+    :param by_key: False to drop every cached result of the methods, for
+    writes that change more than their arguments name (e.g. deleting a scope
+    also deletes its interfaces)
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                if self.cache is not None:
+                    terms = cache_terms((args, kwargs)) if by_key else None
+                    self.cache.invalidate(*methods, terms=terms)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,494 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import bisect
+import fnmatch
+import ipaddress
+import random
+import threading
+import time
+
+import constants
+from eman_transport import BATCH_SIZE, split_command, timeout_error
+
+DOMAIN = "cisco.com"
+
+# short switches eman-am.pl accepts for the long ones
+ALIASES = {
+    "f": "function",
+    "s": "subnet",
+    "sn": "subnet",
+    "n": "name",
+    "N": "name",
+    "i": "ipaddress",
+    "r": "return",
+    "t": "type",
+    "D": "descr",
+    "R": "ranges",
+    "on": "oldname",
+    "nn": "newname",
+}
+
+
+class SimulatedError(Exception):
+    """Exception raised by an EmanSimulator function, printed as an eman ERROR"""
+
+
+def parse_args(command):
+    """
+    :param command: (str) command string from Eman._generate_command
+    :return: (dict) {switch: value}, switches without a value map to True.
+    Short switches are expanded (see ALIASES) and long ones are lower case.
+    If a switch is given twice the first one counts, so the -Function of a
+    subnet-add does not replace -function.
+    """
+    flags = {}
+    for arg in split_command(command):
+        if not arg.startswith("-"):
+            continue
+        switch, sep, value = arg[1:].partition("=")
+        switch = ALIASES.get(switch, switch).lower()
+        flags.setdefault(switch, value.strip("\"'") if sep else True)
+    return flags
+
+
+def fqdn(name):
+    name = name.strip().lower()
+    return name if "." in name else f"{name}.{DOMAIN}"
+
+
+class EmanSimulator:
+    """
+    In-memory stand in for the address management server. It keeps address
+    blocks, subnets, interfaces and scopes and answers the eman-am functions
+    Eman uses (subnet-add/-del, subnets-free, next-avail, int-add/-del/-find,
+    scope-add/-del/-mod/-info) with the same kind of output, so Eman and
+    UserOnboard can run offline.
+
+    Several SimulatorTransport instances may share one simulator.
+
+    Attributes:
+        latency: seconds every request takes, or (min, max) for a random delay
+        error_rate: chance (0-1) that a request fails as if the server was
+            overloaded (ERROR:Service Unavailable, which is retryable)
+        errors: {function: chance} overriding error_rate per function
+    """
+
+    def __init__(
+        self, address_blocks=None, latency=0.0, error_rate=0.0, errors=None, seed=None
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = errors or {}
+        self.random = random.Random(seed)
+        self.blocks = []
+        self.subnets = {}
+        self._starts = []
+        self._ends = []
+        self._networks = []
+        self._scopes_by_subnet = {}
+        self._cursors = {}
+        self.interfaces = {}
+        self.names = {}
+        self.scopes = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        for address_block in address_blocks or constants.regionsab.values():
+            self.add_block(address_block)
+
+    def add_block(self, address_block):
+        network = ipaddress.ip_network(address_block, strict=False)
+        if network not in self.blocks:
+            self.blocks.append(network)
+        return network
+
+    def delay(self, timeout=None):
+        """
+        Sleeps for the latency of one request, at most timeout seconds.
+
+        :return: (bool) True if the request ran out of time
+        """
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            return True
+        if latency:
+            time.sleep(latency)
+        return False
+
+    def fails(self, function=""):
+        """
+        :return: (bool) True if an injected failure should hit this request
+        """
+        rate = self.errors.get(function, self.error_rate)
+        with self._lock:
+            return bool(rate) and self.random.random() < rate
+
+    def handle(self, command, inject=True):
+        """
+        Runs one command against the simulated state.
+
+        :param command: (str) command string from Eman._generate_command
+        :param inject: False to skip error injection (see SimulatorTransport.run_batch)
+        :return: (output, error) as eman-am.pl would print them
+        """
+        flags = parse_args(command)
+        function = str(flags.get("function", ""))
+        if inject and self.fails(function):
+            # what eman-am.pl prints for an overloaded server
+            return "", "ERROR:Service Unavailable"
+        with self._lock:
+            self.requests += 1
+            handler = getattr(self, "_" + function.replace("-", "_"), None)
+            if handler is None:
+                return "", f"ERROR: Unknown function {function!r}"
+            try:
+                return handler(flags), ""
+            except SimulatedError as error:
+                return "", f"ERROR: {error}"
+            except ValueError as error:
+                return "", f"ERROR: Invalid argument: {error}"
+
+    # state helpers
+
+    def _block_of(self, network):
+        for block in self.blocks:
+            if network.version == block.version and network.subnet_of(block):
+                return block
+        return None
+
+    def _overlap(self, start, end):
+        """:return: index of a subnet overlapping [start, end], or None"""
+        index = bisect.bisect_right(self._starts, end) - 1
+        if index >= 0 and self._ends[index] >= start:
+            return index
+        return None
+
+    def _subnet_of_ip(self, ip):
+        index = self._overlap(int(ip), int(ip))
+        if index is None:
+            return None
+        return self._networks[index]
+
+    def _interfaces_in(self, network):
+        if network.num_addresses <= 4096:
+            addresses = (str(ip) for ip in network)
+            return [
+                (ip, self.interfaces[ip]) for ip in addresses if ip in self.interfaces
+            ]
+        return [
+            (ip, name)
+            for ip, name in self.interfaces.items()
+            if ipaddress.ip_address(ip) in network
+        ]
+
+    def _free_subnets(self, block, length, count):
+        key = (block, length)
+        size = 2 ** (block.max_prefixlen - length)
+        candidate = max(int(block.network_address), self._cursors.get(key, 0))
+        last = int(block.broadcast_address)
+        found = []
+        while candidate + size - 1 <= last and len(found) < count:
+            index = self._overlap(candidate, candidate + size - 1)
+            if index is None:
+                if not found:
+                    self._cursors[key] = candidate
+                found.append(ipaddress.ip_network((candidate, length)))
+                candidate += size
+            else:
+                # skip past the used subnet, aligned to the wanted size
+                candidate = -(-(self._ends[index] + 1) // size) * size
+        return found
+
+    # eman-am functions
+
+    def _address_block_add(self, flags):
+        block = self.add_block(flags["addressblock"])
+        return f"Successfully added Address Block {block}"
+
+    def _subnet_add(self, flags):
+        network = ipaddress.ip_network(flags["subnet"])
+        if self._block_of(network) is None:
+            raise SimulatedError(f"{network} is not in any address block")
+        start, end = int(network.network_address), int(network.broadcast_address)
+        if self._overlap(start, end) is not None:
+            raise SimulatedError(f"Subnet {network} overlaps an existing subnet")
+        index = bisect.bisect_left(self._starts, start)
+        self._starts.insert(index, start)
+        self._ends.insert(index, end)
+        self._networks.insert(index, network)
+        self.subnets[network] = {"descr": flags.get("descr", "")}
+        return f"Successfully added Subnet {network}"
+
+    def _subnet_del(self, flags):
+        network = ipaddress.ip_network(flags["subnet"])
+        if network not in self.subnets:
+            raise SimulatedError(f"No subnet found for {network}")
+        for ip, name in self._interfaces_in(network):
+            del self.interfaces[ip]
+            self.names.pop(name, None)
+        for scope in self._scopes_by_subnet.pop(network, ()):
+            del self.scopes[scope]
+        del self.subnets[network]
+        index = self._starts.index(int(network.network_address))
+        del self._starts[index]
+        del self._ends[index]
+        del self._networks[index]
+        block = self._block_of(network)
+        for key in [key for key in self._cursors if key[0] == block]:
+            self._cursors[key] = min(self._cursors[key], int(network.network_address))
+        return f"Successfully deleted Subnet {network}"
+
+    def _subnets_free(self, flags):
+        address = ipaddress.ip_address(str(flags["addressblock"]).split("/")[0])
+        block = next((block for block in self.blocks if address in block), None)
+        if block is None:
+            raise SimulatedError(f"No address block found for {address}")
+        free = [block]
+        for network in self.subnets:
+            if not network.subnet_of(block):
+                continue
+            remaining = []
+            for space in free:
+                if network.subnet_of(space):
+                    remaining.extend(space.address_exclude(network))
+                else:
+                    remaining.append(space)
+            free = remaining
+        if not free:
+            raise SimulatedError(f"No free space in {block}")
+        return "\n".join(str(space) for space in sorted(free))
+
+    def _next_avail(self, flags):
+        count = flags.get("return", "1")
+        count = float("inf") if count == "all" else int(count)
+        separator = "," if flags.get("comma") else "\n"
+        if str(flags.get("type", "I")).upper() == "S":
+            block = self._block_of(
+                ipaddress.ip_network(flags["addressblock"], strict=False)
+            )
+            if block is None:
+                raise SimulatedError(f"No address block for {flags['addressblock']}")
+            length = int(flags.get("length", 30))
+            found = self._free_subnets(block, length, count)
+        else:
+            network = ipaddress.ip_network(flags["subnet"], strict=False)
+            if network not in self.subnets:
+                raise SimulatedError(f"No subnet found for {network}")
+            found = []
+            for ip in network.hosts():
+                if len(found) >= count:
+                    break
+                if str(ip) not in self.interfaces:
+                    found.append(ip)
+        if not found:
+            raise SimulatedError("No available addresses found")
+        return separator.join(str(item) for item in found)
+
+    def _int_add(self, flags):
+        ip = str(ipaddress.ip_address(flags["ipaddress"]))
+        name = fqdn(flags["name"])
+        if self._subnet_of_ip(ipaddress.ip_address(ip)) is None:
+            raise SimulatedError(f"{ip} is not in any subnet")
+        if ip in self.interfaces:
+            raise SimulatedError(f"{ip} is already used by {self.interfaces[ip]}")
+        if name in self.names:
+            raise SimulatedError(f"{name} already exists")
+        self.interfaces[ip] = name
+        self.names[name] = ip
+        return f"Successfully added interface {ip} ({name})"
+
+    def _int_del(self, flags):
+        ip = flags.get("ipaddress") or self.names.get(fqdn(flags.get("name", "")))
+        if not ip or ip not in self.interfaces:
+            raise SimulatedError(
+                f"No interface found for {flags.get('name') or flags.get('ipaddress')}."
+            )
+        name = self.interfaces.pop(ip)
+        self.names.pop(name, None)
+        return f"Successfully deleted Interface {name}."
+
+    def _int_ren(self, flags):
+        old, new = fqdn(flags["oldname"]), fqdn(flags["newname"])
+        if old not in self.names:
+            raise SimulatedError(f"No interface found for {old}.")
+        ip = self.names.pop(old)
+        self.interfaces[ip] = new
+        self.names[new] = ip
+        return f"Successfully renamed Interface {old} to {new}."
+
+    def _int_find(self, flags):
+        if flags.get("ipaddress"):
+            ip = str(ipaddress.ip_address(flags["ipaddress"]))
+            found = [(ip, self.interfaces[ip])] if ip in self.interfaces else []
+        elif flags.get("subnet") or flags.get("addressblock"):
+            network = ipaddress.ip_network(
+                flags.get("subnet") or flags["addressblock"], strict=False
+            )
+            found = self._interfaces_in(network)
+        else:
+            pattern = fqdn(str(flags.get("name", "*")))
+            found = [
+                (ip, name)
+                for name, ip in self.names.items()
+                if fnmatch.fnmatchcase(name, pattern)
+            ]
+        count = flags.get("return", "all")
+        if count != "all":
+            found = found[: int(count)]
+        if not found:
+            raise SimulatedError("No interfaces found")
+        if flags.get("comma"):
+            return ",".join(f"{ip}:{name}" for ip, name in found)
+        if flags.get("ipaddress"):
+            return "\n".join(f"{ip}:{name}" for ip, name in found)
+        return "\n".join(f"{name}:{ip}" for ip, name in found)
+
+    def _scope_add(self, flags):
+        name = flags["name"]
+        if name in self.scopes:
+            raise SimulatedError(f"Scope {name} already exists")
+        network = ipaddress.ip_network(flags["subnet"], strict=False)
+        if network not in self.subnets:
+            raise SimulatedError(f"No subnet found for {network}")
+        first, last = (
+            ipaddress.ip_address(ip) for ip in str(flags["ranges"]).split(":")
+        )
+        if first not in network or last not in network or first > last:
+            raise SimulatedError(f"Range {first}-{last} is not in {network}")
+        scope = {
+            key: value
+            for key, value in flags.items()
+            if key not in ("function", "name", "subnet", "ranges")
+        }
+        scope.update(subnet=network, range=(first, last))
+        self.scopes[name] = scope
+        self._scopes_by_subnet.setdefault(network, set()).add(name)
+        return f"Successfully added scope {name}"
+
+    def _scope_del(self, flags):
+        name = flags["name"]
+        scope = self.scopes.pop(name, None)
+        if scope is None:
+            raise SimulatedError(f"No scope found for {name}")
+        self._scopes_by_subnet[scope["subnet"]].discard(name)
+        if flags.get("di"):
+            first, last = scope["range"]
+            for ip, interface in self._interfaces_in(scope["subnet"]):
+                if first <= ipaddress.ip_address(ip) <= last:
+                    del self.interfaces[ip]
+                    self.names.pop(interface, None)
+        return f"Successfully deleted scope {name}"
+
+    def _scope_mod(self, flags):
+        name = flags["name"]
+        if name not in self.scopes:
+            raise SimulatedError(f"No scope found for {name}")
+        self.scopes[name].update(
+            (key, value)
+            for key, value in flags.items()
+            if key not in ("function", "name")
+        )
+        return f"Successfully modified scope {name}"
+
+    def _scope_info(self, flags):
+        network = ipaddress.ip_network(flags["subnet"], strict=False)
+        lines = []
+        for name in sorted(self._scopes_by_subnet.get(network, ())):
+            scope = self.scopes[name]
+            first, last = scope["range"]
+            lines += [
+                f"Scope Name: {name}",
+                f"Range: {first}-{last}",
+                f"Policy: {scope.get('policy', '')}",
+                f"Default Router: {scope.get('defaultrouter', '')}",
+                "",
+            ]
+        if not lines:
+            raise SimulatedError(f"No scopes found in {network}")
+        return "\n".join(lines)
+
+
+class SimulatorTransport:
+    """
+    Transport answering from an EmanSimulator instead of the eman server. Use
+    it like any other transport:
+
+    am = Eman("user", "password", transport="simulator", latency=0.05)
+
+    or share one simulator between several clients:
+
+    simulator = EmanSimulator(address_blocks=["10.0.0.0/16"], error_rate=0.01)
+    am = Eman("user", "password", transport=SimulatorTransport(simulator=simulator))
+
+    Attributes:
+        simulator: the EmanSimulator the commands run against
+        timeout: seconds a request may take, None for no limit. Requests whose
+            latency is longer fail the way a timed out eman-am.pl call does.
+        batch_timeout: seconds each batch request of BATCH_SIZE commands may
+            take, timeout if not given
+        batch_reply: how run_batch answers, 'lines' with one line per command,
+            'raw' with each command's output as eman prints it (some take
+            several lines), 'short' with the last line of the reply missing
+    """
+
+    def __init__(
+        self,
+        username="",
+        password="",
+        simulator=None,
+        timeout=None,
+        batch_reply="lines",
+        batch_timeout=None,
+        **options,
+    ):
+        """
+        :param simulator: EmanSimulator to use, a new one is made if not given
+        :param options: passed to the new EmanSimulator (e.g. latency, error_rate)
+        """
+        self.simulator = simulator or EmanSimulator(**options)
+        self.timeout = timeout
+        self.batch_timeout = timeout if batch_timeout is None else batch_timeout
+        self.batch_reply = batch_reply
+
+    def run(self, command):
+        if self.simulator.delay(self.timeout):
+            return "", timeout_error(self.timeout)
+        return self.simulator.handle(command)
+
+    def run_batch(self, commands):
+        lines = []
+        for start in range(0, len(commands), BATCH_SIZE):
+            # one request per BATCH_SIZE commands, as eman-am.pl -batch posts
+            # them, and an injected failure fails the whole request
+            if self.simulator.delay(self.batch_timeout):
+                return "", timeout_error(self.batch_timeout)
+            if self.simulator.fails():
+                return "", "ERROR:Service Unavailable"
+            for command in commands[start : start + BATCH_SIZE]:
+                output, error = self.simulator.handle(command, inject=False)
+                if self.batch_reply == "raw":
+                    lines.append(output or error)
+                else:
+                    lines.append(" ".join((output or error).split("\n")))
+        if self.batch_reply == "short":
+            lines = lines[:-1]
+        return "\n".join(lines), ""
+
+    def close(self):
+        pass
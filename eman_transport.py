@@ -0,0 +1,687 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import base64
+import http.client
+import math
+import os
+import queue
+import selectors
+import shlex
+import signal
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.parse
+
+PROMPT = b"AM> "
+DEFAULT_SERVER = "am.cisco.com"
+CGI_PATH = "/cli.pcgi"
+USER_AGENT = "EMAN AM CLI/1.51 (Python)"
+# eman-am.pl posts batch files in chunks of this many commands
+BATCH_SIZE = 250
+# seconds one eman call may take before it is given up on
+DEFAULT_TIMEOUT = 120
+
+
+def find_perl_script():
+    """
+    Locates eman-am.pl, either next to this file or in the am_wrapper checkout.
+
+    :return: (str) path to eman-am.pl
+    """
+    perl_script_location = (
+        os.path.dirname(os.path.realpath(__file__)) + "/eman-am.pl"
+    )
+    if not os.path.exists(perl_script_location):
+        perl_script_location = os.path.relpath(
+            "../am_wrapper/am_wrapper/eman-am.pl", os.curdir
+        )
+    return perl_script_location
+
+
+def split_command(command):
+    """
+    Splits a command string into the argument list eman-am.pl would see in
+    command line mode: shell quoting is removed and values containing spaces
+    are re-quoted the same way eman-am.pl does it before sending.
+
+    :param command: (str) command string (e.g. '-function=scope-del -Name="a b"')
+    :return: (list) arguments (e.g. ['-function=scope-del', '-Name="a b"'])
+    """
+    args = []
+    for arg in shlex.split(command):
+        switch, sep, value = arg.partition("=")
+        if sep and " " in value:
+            vals = []
+            for val in value.split(","):
+                if " " in val:
+                    val = f'"{val}"'
+                vals.append(val)
+            arg = f"{switch}={','.join(vals)}"
+        args.append(arg)
+    return args
+
+
+def batch_line(command):
+    """
+    :param command: (str) command string
+    :return: (str) the command as a single eman-am batch/interactive line
+    """
+    return " ".join(split_command(command))
+
+
+def write_batch_file(commands):
+    """
+    :param commands: (list) command strings
+    :return: (str) path of a temporary eman-am batch file, the caller removes it
+    """
+    with tempfile.NamedTemporaryFile(
+        "w", prefix="eman-batch-", suffix=".txt", delete=False
+    ) as batch_file:
+        for command in commands:
+            batch_file.write(batch_line(command) + "\n")
+    return batch_file.name
+
+
+def batch_bodies(commands):
+    """
+    Builds the form bodies eman-am.pl -batch posts, BATCH_SIZE commands each.
+
+    :param commands: (list) command strings
+    :return: generator of form-urlencoded bodies
+    """
+    for start in range(0, len(commands), BATCH_SIZE):
+        body = ""
+        for count, command in enumerate(commands[start : start + BATCH_SIZE]):
+            line = urllib.parse.quote(batch_line(command), safe="_.-")
+            body += f"&-ARGS{count or ''}={line}"
+        yield body + "&-batch=1"
+
+
+def batch_time(timeout, commands):
+    """
+    :param timeout: seconds one batch request of up to BATCH_SIZE commands may
+    take, None for no limit
+    :param commands: (list) command strings of the batch
+    :return: seconds the whole batch may take, eman-am.pl -batch posts one
+    request per BATCH_SIZE commands
+    """
+    if timeout is None:
+        return None
+    return timeout * max(1, math.ceil(len(commands) / BATCH_SIZE))
+
+
+def timeout_error(timeout):
+    """
+    :return: (str) the error reported for a call that ran out of time, worded
+    so retry.classify sees it as transient
+    """
+    return f"ERROR:eman-am.pl timed out after {timeout}s"
+
+
+def kill_process_group(process):
+    """
+    Kills a process started with start_new_session=True together with its
+    children (the shell of a shell=True command and the perl it runs).
+    """
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+
+
+class PerlTransport:
+    """
+    Runs one ``perl eman-am.pl`` process per command. This is the original
+    behaviour of Eman.send_command.
+
+    Attributes:
+        username: User with rights to make changes in Eman-am or eman-cli
+        password: Password for expected user
+        timeout: seconds a call may take, after that the process is killed
+        batch_timeout: seconds each BATCH_SIZE commands of a batch may take,
+            timeout if not given
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        script="",
+        timeout=DEFAULT_TIMEOUT,
+        batch_timeout=None,
+    ):
+        self.username = username
+        self.password = password
+        self.script = script or find_perl_script()
+        self.timeout = timeout
+        self.batch_timeout = timeout if batch_timeout is None else batch_timeout
+
+    def command_line(self, command):
+        """
+        :param command: command that will be sent to eman
+        :return: (str) shell command line running eman-am.pl with credentials
+        """
+        header = f'{self.script} -username={self.username} \
+        -password="{self.password}"'
+
+        return f"perl {header} {command}"
+
+    def run(self, command, timeout=None):
+        """
+        Both pipes are drained together, so a full stderr can not block the
+        process while stdout is read. A call running past timeout is killed.
+
+        :param command: command that will be sent to eman
+        :param timeout: seconds this call may take, self.timeout if not given
+        :return: (output, error) as stripped strings
+        """
+        if timeout is None:
+            timeout = self.timeout
+        full_command = self.command_line(command)
+
+        os.environ["PERL_LWP_SSL_VERIFY_HOSTNAME"] = "0"
+        process = subprocess.Popen(
+            full_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            shell=True,
+            start_new_session=True,
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            kill_process_group(process)
+            process.communicate()
+            return "", timeout_error(timeout)
+        output = stdout.decode(errors="replace").strip()
+        error = stderr.decode(errors="replace").strip()
+        return output, error
+
+    def run_batch(self, commands):
+        """
+        Writes the commands to a file and runs eman-am.pl -batch on it,
+        allowing batch_timeout for every request it posts.
+
+        :param commands: (list) command strings
+        :return: (output, error) for the whole batch
+        """
+        batch_file = write_batch_file(commands)
+        try:
+            return self.run(
+                f"-batch={batch_file}", batch_time(self.batch_timeout, commands)
+            )
+        finally:
+            os.unlink(batch_file)
+
+    def close(self):
+        """Nothing to release, every command runs in its own process."""
+
+
+class PerlSession:
+    """
+    A single long-lived eman-am.pl process driven through its interactive
+    ``AM>`` loop. Perl, LWP and the TLS connection are only set up once. A
+    command that gets no prompt back within timeout seconds kills the
+    process; the next command starts a new one.
+    """
+
+    def __init__(self, username, password, script="", timeout=DEFAULT_TIMEOUT):
+        self.username = username
+        self.password = password
+        self.script = script or find_perl_script()
+        self.timeout = timeout
+        self.process = None
+        self.selector = None
+
+    def start(self):
+        """
+        Starts eman-am.pl in interactive mode and logs in.
+
+        :return: Nothing. Raises PermissionError if the login is refused.
+        """
+        env = dict(os.environ, PERL_LWP_SSL_VERIFY_HOSTNAME="0")
+        self.process = subprocess.Popen(
+            ["perl", self.script],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            start_new_session=True,
+        )
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.process.stdout, selectors.EVENT_READ, "stdout")
+        self.selector.register(self.process.stderr, selectors.EVENT_READ, "stderr")
+
+        # interactive mode prompts for the username and password on STDIN
+        self.process.stdin.write(f"{self.username}\n{self.password}\n".encode())
+        self.process.stdin.flush()
+
+        __output, error = self._read_until_prompt(stop_on_error=True)
+        if not self.alive():
+            raise PermissionError(error or "eman-am.pl exited during login")
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def run(self, command):
+        """
+        Sends one command line to the AM> prompt and waits for the next prompt.
+
+        :param command: command that will be sent to eman
+        :return: (output, error) as stripped strings
+        """
+        if not self.alive():
+            self.start()
+
+        line = " ".join(split_command(command))
+        self.process.stdin.write(f"{line}\n".encode())
+        self.process.stdin.flush()
+
+        return self._read_until_prompt()
+
+    def _read_until_prompt(self, stop_on_error=False):
+        """
+        Reads stdout and stderr until eman-am.pl prints its prompt again.
+
+        :param stop_on_error: (bool) give up as soon as an ERROR shows on stderr.
+        Used while logging in, where eman-am.pl would otherwise re-prompt for
+        credentials forever.
+        :return: (output, error) as stripped strings
+        """
+        stdout = bytearray()
+        stderr = bytearray()
+        deadline = time.monotonic() + self.timeout
+        while not stdout.endswith(PROMPT):
+            remaining = deadline - time.monotonic()
+            events = self.selector.select(timeout=remaining) if remaining > 0 else []
+            if not events:
+                self.kill()
+                return self._decode(stdout), timeout_error(self.timeout)
+            for key, __mask in events:
+                data = os.read(key.fileobj.fileno(), 65536)
+                if not data:
+                    self.close()
+                    return self._decode(stdout), self._decode(stderr)
+                if key.data == "stdout":
+                    stdout += data
+                else:
+                    stderr += data
+            if stop_on_error and b"ERROR" in stderr:
+                self.close()
+                return self._decode(stdout), self._decode(stderr)
+
+        # stderr is written before the prompt, so anything left is already
+        # sitting in the pipe.
+        for key, __mask in self.selector.select(timeout=0):
+            if key.data == "stderr":
+                stderr += os.read(key.fileobj.fileno(), 65536)
+
+        return self._decode(stdout[: -len(PROMPT)]), self._decode(stderr)
+
+    @staticmethod
+    def _decode(data):
+        return data.decode(errors="replace").strip()
+
+    def kill(self):
+        """Kills a process that stopped answering and releases its pipes."""
+        if self.process is not None and self.process.poll() is None:
+            kill_process_group(self.process)
+            self.process.wait()
+        self.close()
+
+    def close(self):
+        """Leaves the AM> loop and reaps the process."""
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b"exit\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        if self.selector:
+            self.selector.close()
+            self.selector = None
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            pipe.close()
+        self.process = None
+
+
+class PerlSessionTransport:
+    """
+    Pool of PerlSession workers. A command borrows an idle session, so up to
+    ``size`` commands can run at the same time without forking perl per call.
+
+    Attributes:
+        username: User with rights to make changes in Eman-am or eman-cli
+        password: Password for expected user
+        size: maximum number of eman-am.pl processes kept open
+        timeout: seconds a command may take, after that its session is killed
+    """
+
+    def __init__(
+        self, username, password, size=1, script="", timeout=DEFAULT_TIMEOUT
+    ):
+        self.username = username
+        self.password = password
+        self.size = size
+        self.script = script or find_perl_script()
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return PerlSession(
+                    self.username, self.password, self.script, self.timeout
+                )
+        return self._idle.get()
+
+    def run(self, command):
+        """
+        :param command: command that will be sent to eman
+        :return: (output, error) as stripped strings
+        """
+        session = self._acquire()
+        try:
+            try:
+                return session.run(command)
+            except PermissionError as error:
+                return "", str(error)
+        finally:
+            self._idle.put(session)
+
+    def close(self):
+        """Shuts down every idle session."""
+        while True:
+            try:
+                session = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            session.close()
+        with self._lock:
+            self._created = 0
+
+
+def cli_url(server=DEFAULT_SERVER):
+    """
+    :param server: (str) EMAN server, '.cisco.com' is added like eman-am.pl -server does
+    :return: (str) cli.pcgi url (e.g. 'https://am.cisco.com/cli.pcgi')
+    """
+    if not server.lower().endswith(".cisco.com"):
+        server = f"{server}.cisco.com"
+    return f"https://{server}{CGI_PATH}"
+
+
+def ssl_context(verify=False):
+    """
+    :param verify: (bool) verify the server certificate. eman-am.pl runs with
+    PERL_LWP_SSL_VERIFY_HOSTNAME=0, so it is off by default.
+    :return: ssl.SSLContext
+    """
+    context = ssl.create_default_context()
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def request_headers(username, password):
+    """
+    :return: (dict) headers for a basic auth form post to cli.pcgi
+    """
+    credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return {
+        "Authorization": f"Basic {credentials}",
+        "Content-Type": "application/x-www-form-urlencoded",
+        "User-Agent": USER_AGENT,
+        "Connection": "keep-alive",
+    }
+
+
+def encode_args(args):
+    """
+    Builds the form body eman-am.pl's query sub posts to cli.pcgi.
+
+    :param args: (list) arguments as returned by split_command
+    :return: (str) form-urlencoded body (e.g. '&-function=int-find&-n=dhcp-sjc%2A')
+    """
+    query_string = ""
+    for arg in args:
+        if arg.startswith(("-p=", "-password=", "-server")):
+            continue
+        key, sep, val = arg[1:].rpartition("=")
+        if sep and not key.startswith("ARGS"):
+            arg = f"-{key}={urllib.parse.quote(val, safe='_.-')}"
+        query_string += f"&{arg}"
+        if "=" not in arg:
+            query_string += "="
+    return query_string
+
+
+class HttpTransport:
+    """
+    Posts commands straight to the EMAN cli.pcgi endpoint, the same request
+    eman-am.pl's query sub sends, over a pool of keep-alive connections.
+
+    Attributes:
+        username: User with rights to make changes in Eman-am or eman-cli
+        password: Password for expected user
+        url: cli.pcgi endpoint (e.g. 'https://am.cisco.com/cli.pcgi')
+        size: maximum number of idle connections kept open
+        timeout: seconds a request may wait on eman
+        batch_timeout: seconds each batch request of BATCH_SIZE commands may
+            wait on eman, timeout if not given
+    """
+
+    def __init__(
+        self,
+        username,
+        password,
+        server=DEFAULT_SERVER,
+        url="",
+        size=4,
+        timeout=DEFAULT_TIMEOUT,
+        verify=False,
+        batch_timeout=None,
+    ):
+        self.username = username
+        self.password = password
+        self.url = url or cli_url(server)
+        self.size = size
+        self.timeout = timeout
+        self.batch_timeout = timeout if batch_timeout is None else batch_timeout
+
+        parsed = urllib.parse.urlsplit(self.url)
+        self._scheme = parsed.scheme
+        self._host = parsed.hostname
+        self._port = parsed.port
+        self._path = parsed.path or CGI_PATH
+
+        self._ssl_context = ssl_context(verify)
+        self._headers = request_headers(username, password)
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self, timeout):
+        if self._scheme == "http":
+            return http.client.HTTPConnection(self._host, self._port, timeout=timeout)
+        return http.client.HTTPSConnection(
+            self._host, self._port, timeout=timeout, context=self._ssl_context
+        )
+
+    @staticmethod
+    def _dropped(connection):
+        """
+        :return: True if the server closed an idle connection: it has no
+        socket, or the socket is readable although no request is in flight
+        """
+        if connection.sock is None:
+            return True
+        with selectors.DefaultSelector() as selector:
+            selector.register(connection.sock, selectors.EVENT_READ)
+            return bool(selector.select(timeout=0))
+
+    def _reuse(self, body, timeout):
+        """
+        Sends body on an idle keep-alive connection, if one is left open.
+
+        :param body: (str) form-urlencoded body
+        :param timeout: seconds the request may wait on eman
+        :return: the connection body was sent on, or None if there was no
+        idle connection or sending failed. A request that could not be sent
+        never reached eman, so it is safe to send it on a new connection.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                return None
+            if self._dropped(connection):
+                connection.close()
+                continue
+            connection.timeout = timeout
+            connection.sock.settimeout(timeout)
+            try:
+                connection.request("POST", self._path, body=body, headers=self._headers)
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                return None
+            return connection
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post(self, body, timeout=None):
+        """
+        Posts a form body to cli.pcgi. The body is only sent a second time
+        when it could not be sent on an idle keep-alive connection; once it
+        was sent any failure is returned, eman may have applied it and
+        RetryPolicy decides whether to send it again.
+
+        :param body: (str) form-urlencoded body
+        :param timeout: seconds the request may wait on eman, self.timeout if
+        not given
+        :return: (output, error) as stripped strings, matching eman-am.pl's
+        stdout and stderr
+        """
+        if timeout is None:
+            timeout = self.timeout
+        connection = self._reuse(body, timeout)
+        if connection is None:
+            connection = self._connect(timeout)
+            try:
+                connection.request("POST", self._path, body=body, headers=self._headers)
+            except (http.client.HTTPException, OSError) as error:
+                connection.close()
+                return "", f"ERROR:{error}"
+        try:
+            response = connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError) as error:
+            connection.close()
+            return "", f"ERROR:{error}"
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(connection)
+
+        if 200 <= response.status < 300:
+            return content.decode(errors="replace").strip(), ""
+        return "", f"ERROR:{response.reason}"
+
+    def run(self, command):
+        """
+        :param command: command that will be sent to eman
+        :return: (output, error) as stripped strings
+        """
+        return self.post(encode_args(split_command(command)))
+
+    def run_batch(self, commands):
+        """
+        Posts the commands the way eman-am.pl -batch does, BATCH_SIZE per
+        request, each of which may take batch_timeout.
+
+        :param commands: (list) command strings
+        :return: (output, error) for the whole batch
+        """
+        outputs = []
+        errors = []
+        for body in batch_bodies(commands):
+            output, error = self.post(body, self.batch_timeout)
+            if output:
+                outputs.append(output)
+            if error:
+                errors.append(error)
+        return "\n".join(outputs), "\n".join(errors)
+
+    def close(self):
+        """Closes every idle connection."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+TRANSPORTS = {
+    "perl": PerlTransport,
+    "session": PerlSessionTransport,
+    "http": HttpTransport,
+}
+
+
+def make_transport(name, username, password, **options):
+    """
+    Builds a transport by name.
+
+    :param name: (str) one of TRANSPORTS (e.g. 'perl', 'session' or 'http'), or
+    'simulator' for the offline eman_simulator
+    :param username: User with rights to make changes in Eman-am or eman-cli
+    :param password: Password for expected user
+    :param options: passed to the transport (e.g. size=4 for 'session')
+    :return: transport instance
+    """
+    if name == "simulator":
+        # eman_simulator builds on this module, so it is only imported when used
+        from eman_simulator import SimulatorTransport
+
+        return SimulatorTransport(username, password, **options)
+
+    try:
+        transport = TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown transport {name!r}, expected one of "
+            f"{sorted(TRANSPORTS) + ['simulator']}"
+        )
+    return transport(username, password, **options)
@@ -0,0 +1,120 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import datetime
+import json
+import os
+import threading
+
+# steps of one onboarded row, in the order they are done
+CLEANUP = "cleanup"
+SUBNET = "subnet"
+SCOPE = "scope"
+GATEWAY = "gateway"
+INTERFACES = tuple(f"ip{count}" for count in range(1, 6))
+DONE = "done"
+STEPS = (CLEANUP, SUBNET, SCOPE, GATEWAY) + INTERFACES + (DONE,)
+
+
+def journal_path(csv_file):
+    """
+    :param csv_file: (str) path to the csv file of a run
+    :return: (str) default journal path for that csv file
+    """
+    return f"{os.path.splitext(csv_file)[0]}.journal.jsonl"
+
+
+class StepJournal:
+    """
+    Append-only JSON lines journal of the completed steps of an onboarding
+    run, one line per step and hostname:
+
+    {"time": "...", "hostname": "host-a", "step": "subnet", "value": "10.0.0.0/29"}
+
+    Every line is flushed and fsynced before record returns, so after a crash
+    the journal holds every step that eman confirmed. A resumed run replays
+    the journal and skips those steps.
+
+    e.g.
+    journal = StepJournal("devices.journal.jsonl", resume=True)
+    if journal.get("host-a", SUBNET) is None:
+        journal.record("host-a", SUBNET, am.add_subnet(...))
+
+    Attributes:
+        path: journal file
+        resume: False starts a new journal, True continues the existing one
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.resume = resume
+        self.steps = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            self._replay()
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def _replay(self):
+        with open(self.path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn write of the last line when the run died
+                    continue
+                self.steps.setdefault(entry["hostname"], {})[entry["step"]] = entry[
+                    "value"
+                ]
+
+    def get(self, hostname, step):
+        """
+        :return: value recorded for the step, or None if it was not completed
+        """
+        with self._lock:
+            return self.steps.get(hostname, {}).get(step)
+
+    def record(self, hostname, step, value=True):
+        """
+        Appends a completed step to the journal.
+
+        :param hostname: (str) row the step belongs to
+        :param step: (str) one of STEPS
+        :param value: JSON serializable result of the step, needed to resume
+        the steps after it (e.g. the subnet that was added)
+        """
+        line = json.dumps(
+            {
+                "time": datetime.datetime.now().isoformat(),
+                "hostname": hostname,
+                "step": step,
+                "value": value,
+            }
+        )
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.steps.setdefault(hostname, {})[step] = value
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -14,25 +14,86 @@
 # limitations under the License.
 # ------------------------------------------------------------------
 
+import atexit
+import datetime
+import json
 import logging
+import logging.handlers
 from logging.config import dictConfig
 import os
+import queue
+import random
+import threading
 
-def configure_logger(name, log_path):
+# defaults of configure_logging, read from the environment
+MODE_VARIABLE = "EMAN_LOG_MODE"  # 'queue' (default) or 'sync'
+FORMAT_VARIABLE = "EMAN_LOG_FORMAT"  # 'text' (default) or 'json' for the log files
+LEVEL_VARIABLE = "EMAN_LOG_LEVEL"  # level of the eman logger, INFO by default
+SAMPLE_VARIABLE = "EMAN_LOG_SAMPLE"  # share of eman records below WARNING kept
+
+LOGGERS = ("__main__", "eman", "onboarding")
+
+_lock = threading.Lock()
+_listeners = []
+_configured = False
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "file": record.filename,
+            "line": record.lineno,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps a random share of the records below WARNING, so per-call chatter
+    can be thinned out without losing warnings and errors.
+
+    Attributes:
+        rate: share (0-1) of the records below WARNING that are kept
+    """
 
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def logging_dict(log_format="text", level="INFO", sample=1.0):
     onboarding_log_path = os.path.abspath(os.curdir) + "/logs/viptela_onboarding.log"
     eman_log_path = os.path.abspath(os.curdir) + "/logs/ete_lib.log"
+    file_formatter = "json" if log_format == "json" else "standard"
 
-    if os.path.isdir("logs") is False:
-        os.mkdir("logs")
-
-    logging.config.dictConfig({
+    return {
         'version': 1,
         'disable_existing_loggers': False,
         'formatters': {
             'standard': {
                 'format': "%(asctime)s %(levelname)-5s [%(filename)s:%(lineno)d] %(message)s"
-            }
+            },
+            'json': {
+                '()': JsonFormatter,
+            },
+        },
+        'filters': {
+            'sample': {
+                '()': SampleFilter,
+                'rate': sample,
+            },
         },
         'handlers': {
             'console': {
@@ -44,7 +105,7 @@ def configure_logger(name, log_path):
             'eman': {
                 'level': 'DEBUG',
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'standard',
+                'formatter': file_formatter,
                 'filename': eman_log_path,
                 'maxBytes': 10*1024*1024,
                 'backupCount': 3
@@ -52,17 +113,13 @@ def configure_logger(name, log_path):
             'onboarding': {
                 'level': 'DEBUG',
                 'class': 'logging.handlers.RotatingFileHandler',
-                'formatter': 'standard',
+                'formatter': file_formatter,
                 'filename': onboarding_log_path,
                 'maxBytes': 10 * 1024 * 1024,
                 'backupCount': 3
             }
         },
         'loggers': {
-            # '': {
-            #     'level': 'INFO',
-            #     'handlers': ['console', 'file']
-            # },
             '__main__': {  # if __name__ == '__main__'
                 'handlers': ['console', 'onboarding'],
                 'level': 'DEBUG',
@@ -70,27 +127,100 @@ def configure_logger(name, log_path):
             },
             'eman': {
                 'handlers': ['console', 'eman'],
-                'level': 'INFO',
+                'level': level,
+                'filters': ['sample'] if sample < 1 else [],
                 'propagate': False
             },
             'onboarding': {
                 'handlers': ['console', 'onboarding'],
                 'level': 'INFO',
-                  'propagate': False
+                'propagate': False
             }
         },
-    })
+    }
+
+
+def _start_listeners():
+    """
+    Moves the handlers of LOGGERS behind queues. Logging a record then only
+    puts it on a queue; one listener thread per set of handlers formats and
+    writes it.
+    """
+    queues = {}
+    for name in LOGGERS:
+        logger = logging.getLogger(name)
+        handlers = tuple(logger.handlers)
+        if handlers not in queues:
+            queues[handlers] = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(
+                queues[handlers], *handlers, respect_handler_level=True
+            )
+            listener.start()
+            _listeners.append(listener)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        logger.addHandler(logging.handlers.QueueHandler(queues[handlers]))
+
+
+def stop_listeners():
+    """Writes out the records still queued and stops the listener threads."""
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def configure_logging(mode=None, log_format=None, level=None, sample=None):
+    """
+    Sets up the eman and onboarding loggers. Arguments left as None are
+    read from the environment (see the *_VARIABLE names above). May be
+    called again to change the settings.
+
+    :param mode: (str) 'queue' hands records to background threads so file
+    and console writes stay off the calling thread, 'sync' writes them
+    right away
+    :param log_format: (str) 'text' or 'json' (one JSON object per line)
+    for the log files, the console always gets text
+    :param level: (str) level of the eman logger, e.g. 'WARNING' to drop
+    the per-call INFO records
+    :param sample: (float) share (0-1) of the eman records below WARNING
+    that are kept
+    """
+    global _configured
+
+    mode = mode or os.environ.get(MODE_VARIABLE, "queue")
+    log_format = log_format or os.environ.get(FORMAT_VARIABLE, "text")
+    level = (level or os.environ.get(LEVEL_VARIABLE, "INFO")).upper()
+    if sample is None:
+        sample = float(os.environ.get(SAMPLE_VARIABLE, 1.0))
+
+    with _lock:
+        stop_listeners()
+        os.makedirs("logs", exist_ok=True)
+        for name in LOGGERS:
+            logging.getLogger(name).filters.clear()
+        dictConfig(logging_dict(log_format, level, sample))
+        if mode == "queue":
+            _start_listeners()
+        if not _configured:
+            atexit.register(stop_listeners)
+        _configured = True
+
+
+def configure_logger(name, log_path):
+    """
+    :return: the logger called name. Logging is configured the first time
+    this is called, later calls reuse that configuration.
+    """
+    if not _configured:
+        configure_logging()
     return logging.getLogger(name)
 
-if __name__ == "__main__":
-    # dictConfig(LOGGING)
-    # logger = logging.getLogger(__name__)
 
+if __name__ == "__main__":
     log_path = os.path.abspath(os.curdir) + "/logs/log_testing.log"
-    logger = configure_logger(log_path)
+    logger = configure_logger(__name__, log_path)
 
     logger.debug('debug message!')
     logger.info('info message!')
     logger.error('error message')
     logger.critical('critical message')
-    logger.warning('warning message')
\ No newline at end of file
+    logger.warning('warning message')
@@ -0,0 +1,206 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import collections
+import contextlib
+import json
+import math
+import re
+import threading
+import time
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+DESCRIPTIONS = {
+    "eman_command_seconds": "Round trip of one eman-am command through the transport",
+    "eman_batch_seconds": "Round trip of one eman-am batch",
+    "onboarding_stage_seconds": "Time of one onboarding stage of a csv row",
+    "onboarding_row_seconds": "Time to onboard one csv row",
+}
+
+FUNCTION_PATTERN = re.compile(r"-(?:f|function)=([\w-]+)")
+
+
+def command_function(command):
+    """
+    :param command: (str) command string (e.g. '-function=int-add -name=a')
+    :return: (str) the eman function of the command (e.g. 'int-add')
+    """
+    match = FUNCTION_PATTERN.search(command)
+    return match.group(1) if match else "unknown"
+
+
+def command_outcome(output, error):
+    """
+    :return: (str) 'ok', 'error' or 'unauthorized' for what eman printed
+    """
+    if "Unauthorized" in error:
+        return "unauthorized"
+    if not output or "ERROR" in output:
+        return "error"
+    return "ok"
+
+
+def batch_outcome(output, error):
+    """
+    :return: (str) like command_outcome, but a batch with output is 'ok' even
+    if some of its commands failed
+    """
+    if output and "Unauthorized" not in error:
+        return "ok"
+    return command_outcome(output, error)
+
+
+def quantile(samples, q):
+    """
+    :param samples: sorted list of numbers
+    :param q: (float) quantile between 0 and 1
+    :return: nearest-rank quantile of the samples
+    """
+    return samples[max(0, math.ceil(q * len(samples)) - 1)]
+
+
+class Metrics:
+    """
+    Collects timings, each tagged with labels, and aggregates them per
+    series into count, sum, p50/p95/p99 and, for series with an outcome
+    label, the error rate.
+
+    e.g.
+    metrics = Metrics()
+    with metrics.timer("onboarding_stage_seconds", stage="scope") as labels:
+        if am.add_scope(...) is None:
+            labels["outcome"] = "error"
+    metrics.write("logs/onboarding_metrics.prom")
+
+    Every sample is kept until the run ends, a few floats per eman call.
+    """
+
+    def __init__(self):
+        self._samples = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """
+        Times the block. The yielded labels may be changed inside it, e.g.
+        to set the outcome; an exception sets outcome to 'exception'.
+        """
+        labels.setdefault("outcome", "ok")
+        start = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            labels["outcome"] = "exception"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summary(self):
+        """
+        :return: (list) one dict per series with name, labels, count, sum and
+        the QUANTILES, then one dict per name and label set (outcome left out)
+        with the error_rate of the series that have an outcome
+        """
+        with self._lock:
+            samples = {key: sorted(values) for key, values in self._samples.items()}
+
+        series = []
+        outcomes = collections.defaultdict(lambda: [0, 0])
+        for (name, labels), values in sorted(samples.items()):
+            series.append(
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": len(values),
+                    "sum": sum(values),
+                    "quantiles": {str(q): quantile(values, q) for q in QUANTILES},
+                }
+            )
+            labels = dict(labels)
+            if "outcome" in labels:
+                outcome = labels.pop("outcome")
+                counts = outcomes[(name, tuple(sorted(labels.items())))]
+                counts[0] += len(values)
+                if outcome != "ok":
+                    counts[1] += len(values)
+
+        for (name, labels), (total, failed) in sorted(outcomes.items()):
+            series.append(
+                {
+                    "name": f"{name.rsplit('_seconds', 1)[0]}_error_rate",
+                    "labels": dict(labels),
+                    "count": total,
+                    "error_rate": failed / total,
+                }
+            )
+        return series
+
+    def to_json(self):
+        return json.dumps({"time": time.time(), "series": self.summary()}, indent=2)
+
+    def to_prometheus(self):
+        """
+        :return: (str) the summary in the Prometheus text exposition format
+        """
+        lines = []
+        typed = set()
+        for item in self.summary():
+            name = item["name"]
+            if name not in typed:
+                typed.add(name)
+                base = name.replace("_error_rate", "_seconds")
+                description = DESCRIPTIONS.get(base, name)
+                if "error_rate" in item:
+                    lines.append(f"# HELP {name} Share of failed calls: {description}")
+                    lines.append(f"# TYPE {name} gauge")
+                else:
+                    lines.append(f"# HELP {name} {description}")
+                    lines.append(f"# TYPE {name} summary")
+
+            labels = item["labels"]
+            if "error_rate" in item:
+                lines.append(f"{name}{_labels(labels)} {item['error_rate']:.6g}")
+                continue
+            for q, value in item["quantiles"].items():
+                lines.append(f"{name}{_labels(dict(labels, quantile=q))} {value:.6g}")
+            lines.append(f"{name}_sum{_labels(labels)} {item['sum']:.6g}")
+            lines.append(f"{name}_count{_labels(labels)} {item['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the summary as JSON if path ends with .json, in the Prometheus
+        text format otherwise.
+        """
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        with open(path, "w") as handle:
+            handle.write(text)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in sorted(labels.items()):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        pairs.append(f'{key}="{value}"'.replace("\n", "\\n"))
+    return "{" + ",".join(pairs) + "}"
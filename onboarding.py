@@ -16,17 +16,75 @@
 # ------------------------------------------------------------------
 
 import os
+import contextlib
 import datetime
-from secrets import USERNAME, PASSWORD
 import ipaddress
-import xlsxwriter
-import pandas as pd
+import re
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
 import constants
-from eman import Eman
+from csv_source import read_rows, chunked
+import journal
+from result_sink import FAILED, NOT_FINISHED, OK, RowResult, make_sink
+from reconcile import Reconciler
+from metrics import Metrics
+from eman import Eman, get_ip_from_string
+from subnet_allocator import SubnetAllocator
+from address_plan import (
+    address_plan,
+    device_subnet,
+    scope_range,
+    subnet_gateway,
+    verify_plan,
+)
+from task_graph import CANCELLED, DONE, Cancelled, TaskGraph
+from credentials import load_credentials
 from logging_config import configure_logger
 
 LOGPATH = os.path.abspath(os.curdir) + "/logs/viptela_onboarding.log"
-LOGGER = configure_logger(__name__, LOGPATH)
+# configured by the first UserOnboard, importing this module writes nothing
+LOGGER = logging.getLogger(__name__)
+METRICSPATH = os.path.abspath(os.curdir) + "/logs/onboarding_metrics.prom"
+# metrics outcome of a row by its status
+ROW_OUTCOMES = {OK: "ok", FAILED: "error", NOT_FINISHED: "unfinished"}
+# interfaces of a row, each one step of its own unless they are batched
+INTERFACE_STEPS = (journal.GATEWAY,) + journal.INTERFACES
+# steps of a row (see UserOnboard.plan_row) in the order a failure is reported
+STEP_ORDER = ("reconcile", "subnet", "range", "scope", "interfaces") + INTERFACE_STEPS
+# eman's answer to deleting a scope or subnet that is not there (any more)
+GONE_PATTERN = re.compile(r"\bno (?:scope|subnet) found\b", re.IGNORECASE)
+# failed stage of a row whose step raised something other than StepFailed
+STEP_STAGES = dict(
+    {
+        "reconcile": "reconcile",
+        "subnet": "subnet",
+        "range": "scope",
+        "scope": "scope",
+        "interfaces": "interface",
+    },
+    **{step: "interface" for step in INTERFACE_STEPS},
+)
+
+
+def deleted(result):
+    """
+    Returns: True if a scope-del or subnet-del result means it is gone: eman
+             deleted it, or had nothing to delete. An ERROR or a batch whose
+             outcome is unknown does not count.
+
+    """
+    result = str(result)
+    return "Success" in result or bool(GONE_PATTERN.search(result))
+
+
+class StepFailed(Exception):
+    """Exception raised by a step of a row that failed, eman's output is logged"""
+
+    def __init__(self, stage):
+        super().__init__(stage)
+        self.stage = stage
 
 
 class UserOnboard:
@@ -38,23 +96,234 @@ class UserOnboard:
     USERNAME = "username"
     PASSWORD = "password"
 
-    Please provide absolute path to the csv file.
+    Please provide absolute path to the csv file. The file is streamed
+    chunk_size rows at a time, so it may be of any length; limit stops the run
+    after that many rows.
+
+    Every completed step of a row (subnet, scope, gateway and ipN interfaces)
+    is appended to a journal next to the csv file (see journal.StepJournal).
+    With resume=True the journal of the previous run is replayed and steps it
+    already holds are skipped, so a run that died part way only redoes the
+    rows and steps that were not finished.
+
+    With reconcile=True rows with a csv-deviceIP are not deleted and
+    recreated. The scopes and interfaces eman has in the subnet are read and
+    only what differs from the csv is changed (see reconcile.Reconciler), so
+    re-running an unchanged csv is almost read-only.
+
+    Every eman call and every stage of a row is timed. At the end of a run
+    count, p50/p95/p99 and error rate per eman function and per stage are
+    written to metrics_file, as JSON if it ends with .json and in the
+    Prometheus text format otherwise ('' turns this off).
+
+    eman reads that fail for a transient reason (timeouts, 5xx) are retried
+    with backoff; writes only when the request never reached eman, since a
+    timed out write may have been applied (the row fails and a resume or
+    reconcile run picks it up). After repeated failures calls stop for a
+    while instead of failing every remaining row against a struggling server
+    (see retry.RetryPolicy). retry=False turns this off, a RetryPolicy tunes
+    it.
+
+    timeout caps every eman call in seconds; a call that takes longer is
+    killed and counts as a transient failure. A batch gets batch_timeout
+    (default timeout) for each 250 commands, the size of the requests
+    eman-am.pl -batch posts. deadline caps the whole run:
+    once it has passed no new row is started, rows in flight finish their
+    current step, and the rows that did not finish are logged, written to
+    the results as not finished and returned by read_csv. Their completed steps
+    are journaled, so a run with resume=True picks them up.
+
+    The result of every row is written to results_file as soon as the row
+    completes: an xlsx (written in constant memory), a csv or a jsonl file,
+    by extension (see result_sink). Next to the vEdge template columns each
+    row gets its status and the stage that failed, if any. A row missing
+    csv-host-name or REGION fails at the 'csv' stage and is logged with its
+    line number, the rest of the file is still onboarded. The default is an
+    xlsx called vedge_onboarding-<current date>.xlsx in the working directory.
+
+    With batch=True the deletes and re-adds of existing subnets and the
+    interface adds are sent through eman-am batch mode instead of one call
+    at a time.
+
+    With workers > 1 the steps of a row (subnet, range, scope, interfaces,
+    see plan_row) run as a dependency graph shared by the rows of a chunk:
+    up to workers steps of any rows run at once, so one row's interfaces are
+    added while the next row's subnet is allocated, and a failed step only
+    skips the steps that depend on it. region_limit caps how many steps of
+    one region run at the same time (region_limits overrides it per region,
+    e.g. {"SJC": 2}) so the EMAN server is not flooded. Subnet allocation
+    from one address block is serialized, and the results are still written
+    in csv order.
 
-    An xlsx called vedge_onboarding-<current date>.xls is created in the same
-    directory as onboarding.py with the results.
+    With local_allocation=True new /29s are picked from a local map of each
+    address block (see SubnetAllocator) and only reserved in eman, so rows
+    no longer wait on eman's next available search or on each other.
+
+    The gateway, scope range and dhcp interface addresses of a device come
+    from the layout of its /29 (see address_plan) rather than from eman.
+    With verify_addresses=True eman is asked for the subnet's free range
+    before the scope and interfaces are added, and a row whose addresses
+    are not all free fails at the scope stage.
     """
 
-    def __init__(self, username="", password=""):
+    def __init__(
+        self,
+        username="",
+        password="",
+        csv_file="",
+        limit=None,
+        chunk_size=100,
+        batch=False,
+        transport="perl",
+        workers=1,
+        region_limit=None,
+        region_limits=None,
+        local_allocation=False,
+        resume=False,
+        journal_file="",
+        reconcile=False,
+        metrics_file=METRICSPATH,
+        retry=True,
+        timeout=None,
+        deadline=None,
+        results_file="",
+        verify_addresses=False,
+        batch_timeout=None,
+    ):
+        configure_logger(__name__, LOGPATH)
         self.username = username
         self.password = password
         self.csv_file = csv_file
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.batch = batch
+        self.transport = transport
+        self.workers = workers
+        self.region_limit = region_limit or workers
+        self.region_limits = region_limits or {}
+        self.local_allocation = local_allocation
+        self.resume = resume
+        self.journal_file = journal_file
+        self.journal = None
+        self.reconcile = reconcile
+        self.metrics_file = metrics_file
+        self.metrics = Metrics()
+        self.retry = retry
+        self.timeout = timeout
+        self.batch_timeout = batch_timeout
+        self.deadline = deadline
+        self._deadline = None
+        self.results_file = results_file
+        self.verify_addresses = verify_addresses
+        self.allocator = None
+        self._block_locks = {
+            addressblock: threading.Lock()
+            for addressblock in constants.regionsab.values()
+        }
+
+    def connect(self):
+        """
+        Creates the Eman instance for a run. Session and http transports keep
+        one connection per worker.
+
+        Returns: Eman
+
+        """
+        # get username/password for address management access
+        username, password = load_credentials(self.username, self.password)
+
+        options = {}
+        if self.transport in ("session", "http"):
+            options["size"] = self.workers
+        if self.timeout:
+            options["timeout"] = self.timeout
+        if self.batch_timeout and self.transport != "session":
+            options["batch_timeout"] = self.batch_timeout
+        return Eman(
+            username,
+            password,
+            transport=self.transport,
+            metrics=self.metrics,
+            retry=self.retry,
+            **options,
+        )
+
+    def address_block(self, subnet, region):
+        """
+        Args:
+            subnet: a subnet or address, e.g. a device's gateway
+            region: region of the row, its address block is tried first
+
+        Returns: the address block of constants.regionsab holding subnet, or
+                 None if there is none
+
+        """
+        try:
+            network = ipaddress.ip_network(subnet, strict=False)
+        except ValueError:
+            return None
+        blocks = [constants.regionsab.get(region)] + list(constants.regionsab.values())
+        for addressblock in blocks:
+            if addressblock is None or addressblock not in self._block_locks:
+                continue
+            if network.subnet_of(ipaddress.ip_network(addressblock, strict=False)):
+                return addressblock
+        return None
+
+    def block_lock(self, subnet, region):
+        """
+        Deleting and re-adding the subnet of a device frees it for a moment,
+        so it has to hold the same lock as the next available lookups of its
+        address block.
+
+        Returns: the lock of the address block holding subnet, or a no-op
+                 context if no known block holds it
+
+        """
+        addressblock = self.address_block(subnet, region)
+        if addressblock is None:
+            return contextlib.nullcontext()
+        if self.allocator is not None:
+            return self.allocator.block_lock(addressblock)
+        return self._block_locks[addressblock]
+
+    def stage(self, name):
+        """
+        Times one stage of a row, see Metrics.timer.
+
+        """
+        return self.metrics.timer("onboarding_stage_seconds", stage=name)
+
+    def expired(self):
+        """
+        Returns: True once the run deadline has passed
+
+        """
+        return self._deadline is not None and time.monotonic() >= self._deadline
+
+    def completed(self, hostname, step):
+        """
+        Returns: the journaled result of a step, or None if it still has to run
+
+        """
+        if self.journal is None:
+            return None
+        return self.journal.get(hostname, step)
+
+    def record(self, hostname, step, value=True):
+        """
+        Journals a completed step of a row, if the run keeps a journal.
+
+        """
+        if self.journal is not None:
+            self.journal.record(hostname, step, value)
 
     def read_csv(self):
         """
         Reads the CSV file, row by row and creates the subnets, scope and dhco
         interfaces accordingly.
 
-        :return:
+        :return: (list) hostnames of the rows left unfinished by the deadline
         """
         LOGGER.info(
             "\n"
@@ -62,55 +331,65 @@ class UserOnboard:
             "Starting new on-boarding run.\n"
             "+++++++++++++++++++++++++++++\n"
         )
-        # get username/password for address management access
-        if self.username and self.password:
-            am = Eman(self.username, self.password)
-        else:
-            am = Eman(USERNAME, PASSWORD)
+        self.metrics = Metrics()
+        self._deadline = None
+        if self.deadline is not None:
+            self._deadline = time.monotonic() + self.deadline
+        am = self.connect()
+        if self.local_allocation:
+            self.allocator = SubnetAllocator(am, prefix=29)
 
         # Checking Authentication with EMAN
         self.check_eman_auth(am)
 
-        # Open xlsx workbook for editing
-        workbook, worksheet = self.openxlsx()
-
-        # read dataset from csv file into data with pandas
-        data = pd.read_csv(self.csv_file)
-        outputrow = 2
-        # read and act upon each row in dataset
-        for index, row in data.head(n=1000).iterrows():
-            hostname = row["csv-host-name"]
-            LOGGER.info("\n\n" f"++++++++++++++{hostname}+++++++++++++++\n")
-            region = row["REGION"].upper()
-            if pd.isnull(row["csv-deviceIP"]):
-                subnet = self.create_subnet(am, region, hostname)
-                if subnet == 1:
-                    continue
-                gateway = str(ipaddress.ip_address(subnet.rsplit("/")[0]) + 1)
-            else:
-                gateway = row["csv-deviceIP"].strip()
-                subnet = f"{str(ipaddress.ip_address(gateway) - 1)}/29"
-                subnet = self.create_subnet(
-                    am, region, hostname, existing_subnet=subnet
-                )
-
-            if subnet == 1:
-                gateway = "Failed Subnet"
-            else:
-                # create scope for subnet...5 ip's
-                errors = self.create_scope(am, hostname, subnet, gateway, region)
-                if errors == 1:
-                    gateway = "Failed Scope"
-                errors = self.add_interfaces(am, hostname, gateway)
-                if errors == 1:
-                    gateway = "Failed Interface"
-
-            # write info to xlsx spreadsheet
-            worksheet.write(f"B{outputrow}", hostname)
-            worksheet.write(f"A{outputrow}", gateway)
-            worksheet.write(f"C{outputrow}", f"{gateway}/29")
-            worksheet.write(f"D{outputrow}", gateway)
-            outputrow += 1
+        # Open the results file, rows are written as they complete
+        sink = self.open_results()
+
+        self.journal = journal.StepJournal(
+            self.journal_file or journal.journal_path(self.csv_file),
+            resume=self.resume,
+        )
+        if self.resume:
+            LOGGER.info(f"Resuming from journal {self.journal.path}")
+
+        # stream the csv file, a chunk of rows at a time
+        executor = None
+        if self.workers > 1:
+            executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        unfinished = []
+        try:
+            rows = read_rows(self.csv_file, limit=self.limit)
+            for chunk in chunked(rows, self.chunk_size):
+                if self.expired():
+                    # keep reading, only to report the rows that were left
+                    results = [
+                        RowResult(row.hostname, "", "", NOT_FINISHED, "")
+                        for row in chunk
+                    ]
+                else:
+                    results = self.onboard_chunk(am, chunk, executor)
+
+                for result in results:
+                    sink.write(result)
+                    if result.status == NOT_FINISHED:
+                        unfinished.append(result.hostname)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            self.journal.close()
+            sink.close()
+            LOGGER.info(f"Results written to {sink.path}")
+            if self.metrics_file:
+                self.metrics.write(self.metrics_file)
+                LOGGER.info(f"Metrics written to {self.metrics_file}")
+
+        if unfinished:
+            LOGGER.warning(
+                f"Run deadline of {self.deadline}s passed, {len(unfinished)} rows "
+                f"not finished, run again with resume to complete them: "
+                f"{', '.join(unfinished)}"
+            )
 
         LOGGER.info(
             "\n"
@@ -119,7 +398,375 @@ class UserOnboard:
             "++++++++++++++++++++++++++++++\n"
         )
 
-        self.closexlsx(workbook)
+        am.close()
+        return unfinished
+
+    def onboard_chunk(self, am, rows, executor=None):
+        """
+        Onboards one chunk of csv rows. With an executor the steps of every
+        row in the chunk go on one TaskGraph, so one row's interfaces are
+        added while the next row's subnet is allocated. In batch mode the
+        chunk's cleanup and interface adds are each sent as one batch, and
+        its results only come once the batch is flushed.
+
+        Args:
+            am: Function call to Eman
+            rows: list of CsvRow
+            executor: ThreadPoolExecutor to run the steps in parallel, if any
+
+        Returns: generator of RowResult in csv order, each one as soon as its
+                 row and the rows before it are done
+
+        """
+        batch = None
+        if self.batch:
+            batch = am.batch()
+            with self.stage("batch_cleanup"):
+                self.cleanup_batch(batch, rows)
+
+        # read and act upon each row in the chunk
+        if executor is not None:
+            graph = TaskGraph(executor, size=self.workers)
+            for row in rows:
+                self.plan_row(graph, am, row, batch)
+            graph.start()
+            results = (self.row_result(graph, row, batch) for row in rows)
+        else:
+            results = (self.onboard_row(am, row, batch) for row in rows)
+
+        if batch is None:
+            yield from results
+            return
+
+        results = list(results)
+        with self.stage("batch_interfaces"):
+            failed = self.flush_interfaces(batch)
+        for result in results:
+            if result.hostname in failed:
+                result = result._replace(status=FAILED, stage="interface")
+            elif result.status == OK:
+                if self.completed(result.hostname, journal.DONE) is None:
+                    self.record(result.hostname, journal.DONE, result.gateway)
+            yield result
+
+    def onboard_row(self, am, row, batch=None):
+        """
+        Creates the subnet, scope and interfaces for one csv row, one step
+        after the other.
+
+        Args:
+            am: Function call to Eman
+            row: CsvRow read from the csv file
+            batch: EmanBatch the interface adds are queued on, if any
+
+        Returns: RowResult
+
+        """
+        graph = TaskGraph()
+        self.plan_row(graph, am, row, batch)
+        graph.start()
+        return self.row_result(graph, row, batch)
+
+    def plan_row(self, graph, am, row, batch=None):
+        """
+        Adds the steps of one csv row to graph, as the group row.line:
+
+            subnet -> scope -> gateway, ip1, ..., ip5
+
+        The addresses come from the subnet's address plan. The interfaces
+        wait for the scope, so a row whose scope could not be created adds
+        none. Each interface is a step of its own, so the interface adds in
+        flight are bounded by the graph's size like every other call; in
+        batch mode they are queued by a single interfaces step. With
+        verify_addresses a range step checks the plan against eman first,
+        before the scope takes its addresses. Every step holds a slot
+        of the row's region, and the subnet step one of its address block:
+        next-avail and subnet-add are two calls, and re-adding an existing
+        subnet frees it in between. A row
+        completed by a previous run adds nothing, a row to reconcile adds a
+        single reconcile step.
+
+        Args:
+            graph: TaskGraph the steps are added to
+            am: Function call to Eman
+            row: CsvRow read from the csv file
+            batch: EmanBatch the interface adds are queued on, if any
+
+        """
+        if row.error or self.completed(row.hostname, journal.DONE) is not None:
+            return
+
+        region = ("region", row.region)
+        graph.limit(region, self.region_limits.get(row.region, self.region_limit))
+
+        def add(name, function, requires=(), slots=(), stage=None):
+            graph.add(
+                row.line,
+                name,
+                self.step(stage or name, function),
+                requires=requires,
+                slots=(region,) + tuple(slots),
+            )
+
+        if self.reconcile and row.device_ip is not None:
+            add("reconcile", lambda: self.reconcile_step(am, row))
+            return
+
+        slots = ()
+        if self.allocator is None:
+            # a new subnet is allocated from the region's block, an existing
+            # one is deleted and re-added in the block holding it
+            if row.device_ip is None:
+                addressblock = constants.regionsab.get(row.region)
+            else:
+                addressblock = self.address_block(row.device_ip, row.region)
+            if addressblock is not None:
+                block = ("block", addressblock)
+                graph.limit(block, 1)
+                slots = (block,)
+        add("subnet", lambda: self.subnet_step(am, row, batch), slots=slots)
+        after = "subnet"
+        if self.verify_addresses:
+            add(
+                "range",
+                lambda subnet: self.range_step(am, row, subnet),
+                requires=["subnet"],
+            )
+            after = "range"
+        add(
+            "scope",
+            lambda subnet: self.scope_step(am, row, subnet),
+            requires=[after],
+        )
+        if batch is not None:
+            add(
+                "interfaces",
+                lambda subnet: self.interfaces_step(am, row, subnet, batch),
+                requires=["scope"],
+            )
+            return
+        for step in INTERFACE_STEPS:
+            add(
+                step,
+                lambda subnet, step=step: self.interfaces_step(
+                    am, row, subnet, steps=(step,)
+                ),
+                requires=["scope"],
+                stage="interfaces",
+            )
+
+    def step(self, stage, function):
+        """
+        Wraps one step of a row for the TaskGraph: it is timed as stage and
+        cancelled once the deadline has passed, so rows in flight stop after
+        their current step.
+
+        Returns: the wrapped function
+
+        """
+
+        def run(*values):
+            if self.expired():
+                raise Cancelled(stage)
+            with self.stage(stage) as labels:
+                try:
+                    return function(*values)
+                except StepFailed as error:
+                    labels["outcome"] = "error"
+                    failed = error
+            raise failed
+
+        return run
+
+    def row_result(self, graph, row, batch=None):
+        """
+        Waits for the steps of a row and sums them up. The first step that
+        failed, in the order subnet, range, scope, interfaces, is the
+        failed stage; a row with steps cancelled by the deadline is not
+        finished.
+
+        Args:
+            graph: TaskGraph the row was planned on (see plan_row)
+            row: CsvRow read from the csv file
+            batch: EmanBatch the interface adds were queued on, if any
+
+        Returns: RowResult
+
+        """
+        if row.error:
+            LOGGER.warning(f"{self.csv_file}:{row.line}: {row.error}")
+            return RowResult(row.hostname or f"line {row.line}", "", "", FAILED, "csv")
+
+        hostname = row.hostname
+        results = graph.results(row.line)
+        done = self.completed(hostname, journal.DONE)
+        if not results and done is not None:
+            LOGGER.info(f"{hostname} was completed by a previous run")
+            return RowResult(hostname, done, device_subnet(done), OK, "")
+
+        gateway = subnet = ""
+        if row.device_ip is not None:
+            gateway, subnet = row.device_ip, device_subnet(row.device_ip)
+        if "subnet" in results and results["subnet"].status == DONE:
+            subnet = results["subnet"].value
+            gateway = subnet_gateway(subnet)
+
+        status, stage = OK, ""
+        for name in STEP_ORDER:
+            result = results.get(name)
+            if result is None:
+                continue
+            if result.status == FAILED:
+                error = result.value
+                if isinstance(error, StepFailed):
+                    stage = error.stage
+                else:
+                    LOGGER.error(f"{hostname}: {name} raised {error!r}")
+                    stage = STEP_STAGES[name]
+                status = FAILED
+                break
+            if result.status == CANCELLED:
+                status = NOT_FINISHED
+
+        self.metrics.observe(
+            "onboarding_row_seconds",
+            graph.elapsed(row.line),
+            outcome=ROW_OUTCOMES[status],
+        )
+        if status == OK and batch is None:
+            self.record(hostname, journal.DONE, gateway)
+        return RowResult(hostname, gateway, subnet, status, stage)
+
+    def reconcile_step(self, am, row):
+        """
+        Returns: nothing, raises StepFailed with the stage reconcile_row
+                 could not bring up to date
+
+        """
+        LOGGER.info("\n\n" f"++++++++++++++{row.hostname}+++++++++++++++\n")
+        failed_stage = self.reconcile_row(am, row.hostname, row.device_ip, row.region)
+        if failed_stage:
+            raise StepFailed(failed_stage)
+
+    def subnet_step(self, am, row, batch=None):
+        """
+        Returns: the subnet of the row, created unless a previous run did,
+                 raises StepFailed if it could not be created
+
+        """
+        hostname = row.hostname
+        subnet = self.completed(hostname, journal.SUBNET)
+        if subnet is not None:
+            return subnet
+
+        LOGGER.info("\n\n" f"++++++++++++++{hostname}+++++++++++++++\n")
+        if row.device_ip is None:
+            subnet = self.create_subnet(am, row.region, hostname)
+        elif batch is not None:
+            # cleanup_batch re-adds the subnet, it failed if none was journaled
+            existing_subnet = device_subnet(row.device_ip)
+            LOGGER.info(f"{hostname}: {existing_subnet} was not re-created")
+            raise StepFailed("subnet")
+        else:
+            subnet = self.create_subnet(
+                am,
+                row.region,
+                hostname,
+                existing_subnet=device_subnet(row.device_ip),
+            )
+        if subnet in (None, 1):
+            raise StepFailed("subnet")
+        self.record(hostname, journal.SUBNET, subnet)
+        return subnet
+
+    def range_step(self, am, row, subnet):
+        """
+        Checks the address plan of the subnet against eman, unless a
+        previous run already added the scope or interfaces using it.
+
+        Returns: the subnet, raises StepFailed if eman does not have the
+                 planned addresses free
+
+        """
+        hostname = row.hostname
+        if self.completed(hostname, journal.SCOPE) is not None or any(
+            self.completed(hostname, step) for step in journal.INTERFACES
+        ):
+            return subnet
+        try:
+            mismatch = verify_plan(am, address_plan(subnet))
+        except Exception as error:
+            LOGGER.info(f"Could not verify the addresses of {subnet}: {error}")
+            raise StepFailed("scope")
+        if mismatch:
+            LOGGER.info(f"{hostname}: {mismatch}")
+            raise StepFailed("scope")
+        return subnet
+
+    def scope_step(self, am, row, subnet):
+        """
+        Creates the scope unless a previous run did.
+
+        Returns: the subnet, raises StepFailed if the scope could not be
+                 created
+
+        """
+        hostname = row.hostname
+        if self.completed(hostname, journal.SCOPE) is None:
+            plan = address_plan(subnet)
+            errors = self.create_scope(
+                am, hostname, subnet, plan.gateway, row.region, scope_range(plan)
+            )
+            if errors == 1:
+                raise StepFailed("scope")
+            self.record(hostname, journal.SCOPE)
+        return subnet
+
+    def interfaces_step(self, am, row, subnet, batch=None, steps=INTERFACE_STEPS):
+        """
+        Adds the gateway and dhcp interfaces of steps, raises StepFailed if
+        one could not be added.
+
+        """
+        errors = self.add_interfaces(
+            am, row.hostname, subnet_gateway(subnet), batch, steps
+        )
+        if errors == 1:
+            raise StepFailed("interface")
+
+    def reconcile_row(self, am, hostname, gateway, region):
+        """
+        Changes only what differs between eman and the csv for a device that
+        already has a subnet.
+
+        Args:
+            am: Function call to Eman
+            hostname: Name used to label subnet, scope and interfaces.
+            gateway: gateway from csv-deviceIP
+            region: region from the csv file
+
+        Returns: the stage that failed, "" if eman is up to date
+
+        """
+        subnet = device_subnet(gateway)
+        interfaces = [
+            (name, ip, options)
+            for step, name, ip, options in self.interface_specs(hostname, gateway)
+        ]
+        reconciler = Reconciler(am)
+        changes = reconciler.plan(
+            hostname,
+            subnet,
+            subnet_options=dict(self.subnet_options(hostname), prefix="29"),
+            scope_options=self.scope_options(
+                hostname, subnet, gateway, region, scope_range(address_plan(subnet))
+            ),
+            interfaces=interfaces,
+        )
+        failed = reconciler.apply(changes)
+        if not failed:
+            return ""
+        return failed[0].stage
 
     def check_eman_auth(self, am):
         """
@@ -148,16 +795,103 @@ class UserOnboard:
             hostname: hostname determined from csv-host-name and used as
                       scope name.
 
-        Returns: Nothing
+        Returns: Nothing. The cleanup is only journaled once both are gone,
+                 so a resumed run deletes them again otherwise.
 
         """
+        if self.completed(hostname, journal.CLEANUP) is not None:
+            return
+
         LOGGER.info(f"Deleting existing scope: {hostname}")
-        results = am.del_scope(hostname)
-        LOGGER.info(f"Eman output: {results}")
+        scope_result = am.del_scope(hostname)
+        LOGGER.info(f"Eman output: {scope_result}")
 
         LOGGER.info(f"Deleting existing subnet: {existing_subnet}")
-        results = am.del_subnet(existing_subnet)
-        LOGGER.info(f"Eman output: {results}")
+        subnet_result = am.del_subnet(existing_subnet)
+        LOGGER.info(f"Eman output: {subnet_result}")
+        if deleted(scope_result) and deleted(subnet_result):
+            self.record(hostname, journal.CLEANUP)
+
+    def cleanup_batch(self, batch, rows):
+        """
+        Removes the scopes and subnets of every row with a csv-deviceIP and
+        re-creates the subnets in one batch, ahead of the per-row work. No
+        row of the chunk allocates a subnet until the batch is done, so
+        none of them can take a subnet in between its delete and re-add.
+
+        Args:
+            batch: EmanBatch from am.batch()
+            rows: CsvRows read from the csv file
+
+        Returns: Nothing
+
+        """
+        for row in rows:
+            if row.error or row.device_ip is None or self.reconcile:
+                continue
+            hostname = row.hostname
+            if self.completed(hostname, journal.SUBNET) is not None:
+                continue
+            existing_subnet = device_subnet(row.device_ip)
+            if self.completed(hostname, journal.CLEANUP) is None:
+                batch.del_scope(hostname, key=(hostname, journal.CLEANUP))
+                batch.del_subnet(existing_subnet, key=(hostname, journal.CLEANUP))
+            batch.add_subnet(
+                existing_subnet,
+                key=(hostname, journal.SUBNET),
+                **self.subnet_options(hostname),
+            )
+
+        LOGGER.info(f"Sending {len(batch)} deletes and re-adds of existing subnets")
+        cleaned = {}
+        created = []
+        for (hostname, step), command, result in batch.flush():
+            LOGGER.info(f"Eman output for {hostname}: {result}")
+            if step == journal.CLEANUP:
+                # both deletes of a row have to be gone for its cleanup to count
+                cleaned[hostname] = cleaned.get(hostname, True) and deleted(result)
+            elif "Success" in result:
+                created.append((hostname, get_ip_from_string(string=result)))
+        for hostname, done in cleaned.items():
+            if done:
+                self.record(hostname, journal.CLEANUP)
+        for hostname, subnet in created:
+            self.record(hostname, journal.SUBNET, subnet)
+
+    def flush_interfaces(self, batch):
+        """
+        Sends the queued interface adds.
+
+        Args:
+            batch: EmanBatch filled by add_interfaces
+
+        Returns: set of hostnames that had an interface fail
+
+        """
+        LOGGER.info(f"Adding {len(batch)} interfaces")
+        failed = set()
+        added = []
+        for (hostname, step), command, result in batch.flush():
+            LOGGER.info(f"Eman output for {hostname}: {result}")
+            if "Success" not in result:
+                failed.add(hostname)
+            else:
+                added.append((hostname, step))
+        for hostname, step in added:
+            self.record(hostname, step)
+        return failed
+
+    def subnet_options(self, hostname):
+        """
+        Returns: add_subnet options for the subnet of a device
+
+        """
+        return dict(
+            description=hostname,
+            function="LAN",
+            contact1='"ete-sec"',
+            contact1_type='"Mail Alias"',
+        )
 
     def create_subnet(self, am, region, hostname, existing_subnet=""):
         """
@@ -171,7 +905,9 @@ class UserOnboard:
                     from constants.py
             hostname: Name to be used to label subnet, scope and interfaces.
             existing_subnet: Existing subnet specified in csv-deviceIP which
-                             should be deleted nd recreated.
+                             should be deleted nd recreated. The lock of its
+                             address block is held from the delete until it
+                             is re-added.
 
         Returns: subnet or errors
 
@@ -179,38 +915,38 @@ class UserOnboard:
         errors = 0
         # determine address block based on region from csv file
         if existing_subnet:
-            self.cleanup_ab(am, existing_subnet, hostname)
+            with self.block_lock(existing_subnet, region):
+                self.cleanup_ab(am, existing_subnet, hostname)
 
-            subnet, prefix = existing_subnet.rsplit("/")
-            try:
-                LOGGER.info(f"Re-creating subnet: {existing_subnet}")
-                subnet = am.add_subnet(
-                    subnet=existing_subnet,
-                    prefix=prefix,
-                    description=hostname,
-                    function="LAN",
-                    contact1='"ete-sec"',
-                    contact1_type='"Mail Alias"',
-                )
-                LOGGER.info(f"Eman output: {subnet}")
-                return subnet
-            except Exception as error:
-                LOGGER.info(error)
-                errors = 1
-                return errors
+                subnet, prefix = existing_subnet.rsplit("/")
+                try:
+                    LOGGER.info(f"Re-creating subnet: {existing_subnet}")
+                    subnet = am.add_subnet(
+                        subnet=existing_subnet,
+                        prefix=prefix,
+                        **self.subnet_options(hostname),
+                    )
+                    LOGGER.info(f"Eman output: {subnet}")
+                    return subnet
+                except Exception as error:
+                    LOGGER.info(error)
+                    errors = 1
+                    return errors
         else:
             if region in constants.regionsab:
                 addressblock = constants.regionsab.get(region)
+                options = self.subnet_options(hostname)
                 try:
                     LOGGER.info(f"Creating new subnet")
-                    subnet = am.add_subnet(
-                        address_block=addressblock,
-                        prefix="29",
-                        description=hostname,
-                        function="LAN",
-                        contact1='"ete-sec"',
-                        contact1_type='"Mail Alias"',
-                    )
+                    if self.allocator is not None:
+                        subnet = self.allocator.add_subnet(addressblock, **options)
+                    else:
+                        # next-avail and subnet-add are two calls, only one row
+                        # at a time may allocate from the same address block
+                        with self._block_locks[addressblock]:
+                            subnet = am.add_subnet(
+                                address_block=addressblock, prefix="29", **options
+                            )
                     LOGGER.info(f"Eman output: {subnet}")
                     return subnet
                 except Exception as error:
@@ -218,7 +954,7 @@ class UserOnboard:
                     errors = 1
                     return errors
 
-    def create_scope(self, am, hostname, subnet, gateway, region):
+    def create_scope(self, am, hostname, subnet, gateway, region, ranges=None):
         """
         Creates scope for the specified subnet. s
         Args:
@@ -228,126 +964,149 @@ class UserOnboard:
             gateway: IP address of gateway interface
             region: region from xlsxfile to determine call manager details
                     from constants.py
+            ranges: scope range as 'first:last', the subnet's address plan
+                    if not given
 
         Returns: Success or Error
 
         """
 
-        print(f"subnet = {subnet}")
-        scope_name = hostname
-        description = hostname
-        range = am.get_range(subnet, 5)
-        ranges = f"{range[0]}:{range[1]}"
-
-        dhcpserver = constants.dhcpservers.get(region)
+        if ranges is None:
+            ranges = scope_range(address_plan(subnet))
 
-        policy = constants.regionspolicys.get(region)
-
-        callmanager = constants.callmanagers.get(region)
         errors = 0
         try:
             LOGGER.info(f"Creating scope for {hostname}")
             scope = am.add_scope(
-                scope_name=scope_name,
-                description=description,
-                subnet=subnet,
-                ranges=ranges,
-                policy=policy,
-                selectiontags=("IPPhones", "OtherDevices"),
-                dhcpserver=dhcpserver,
-                defaultrouter=gateway,
-                callmanager=callmanager,
+                **self.scope_options(hostname, subnet, gateway, region, ranges)
             )
             LOGGER.info(f"Eman output: {scope}")
+            if scope is None or "ERROR" in str(scope):
+                errors = 1
+                return errors
             return "success"
         except Exception as error:
             LOGGER.info(error)
             errors = 1
             return errors
 
-    def add_interfaces(self, am, hostname, gateway):
+    def scope_options(self, hostname, subnet, gateway, region, ranges):
         """
-        Creates gateway and dhcp interfaces.
+        Args:
+            hostname: Name used for the scope and its description.
+            subnet: subnet of the scope
+            gateway: IP address of gateway interface
+            region: region from xlsxfile to determine call manager details
+                    from constants.py
+            ranges: scope range as 'first:last'
+
+        Returns: add_scope options for the scope of a device
+
+        """
+        return dict(
+            scope_name=hostname,
+            description=hostname,
+            subnet=subnet,
+            ranges=ranges,
+            policy=constants.regionspolicys.get(region),
+            selectiontags=("IPPhones", "OtherDevices"),
+            dhcpserver=constants.dhcpservers.get(region),
+            defaultrouter=gateway,
+            callmanager=constants.callmanagers.get(region),
+        )
+
+    def add_interfaces(self, am, hostname, gateway, batch=None, steps=INTERFACE_STEPS):
+        """
+        Creates gateway and dhcp interfaces, one at a time.
 
         Args:
             am: Function call to Eman
             hostname: Name to be used to label subnet, scope and interfaces.
             gateway: IP address of gateway interface
+            batch: EmanBatch to queue the interfaces on instead of adding
+                   them right away (see flush_interfaces).
+            steps: journal steps of the interfaces to add, all by default
 
         Returns: Errors
 
         """
-        errors = 0
-        try:
-            LOGGER.info(f"Adding gateway interface: {gateway}")
-            interface = am.add_interface(
-                hostname,
-                hostname=hostname,
-                ip=gateway,
-                ptr="Y",
-                status="Active",
-                description=hostname,
-                contact1='"ete-sec"',
-                contact1_type='"Mail Alias"',
-            )
-            LOGGER.info(f"Eman output: {interface}")
-        except Exception as error:
-            LOGGER.info(error)
-            errors = 1
+        specs = [
+            spec
+            for spec in self.interface_specs(hostname, gateway)
+            if spec[0] in steps and self.completed(hostname, spec[0]) is None
+        ]
+        if not specs:
+            return 0
 
-        interfaceip = ipaddress.ip_address(gateway)
+        if batch is not None:
+            errors = 0
+            for step, name, ip, options in specs:
+                try:
+                    batch.add_interface(name, key=(hostname, step), ip=ip, **options)
+                except Exception as error:
+                    LOGGER.info(error)
+                    errors = 1
+            return errors
 
-        count = 1
-        while count <= 5:
-            interfaceip = interfaceip + 1
+        errors = 0
+        for step, name, ip, options in specs:
+            LOGGER.info(f"Adding interface {name} ({ip})")
             try:
-                LOGGER.info(f"Adding dhcp interface: {interfaceip}")
-                interface = am.add_interface(
-                    f"{hostname}-ip{count}",
-                    hostname=f"{hostname}-ip{count}",
-                    ip=interfaceip,
-                    ptr="Y",
-                    status="Active",
-                    description=f"{hostname}-ip{count}",
-                    contact1='"ete-sec"',
-                    contact1_type='"Mail Alias"',
-                )
-                LOGGER.info(f"Eman output: {interface}")
+                result = am.add_interface(name, ip=ip, **options)
             except Exception as error:
-                LOGGER.info(error)
+                LOGGER.info(f"Failed to add {name} ({ip}): {error}")
                 errors = 1
-            count += 1
+                continue
+            LOGGER.info(f"Eman output for {name}: {result}")
+            self.record(hostname, step)
         return errors
 
-    def openxlsx(self):
+    def interface_specs(self, hostname, gateway):
         """
-        Creates a spreadsheet in the working directory to provide
-        details.
+        The gateway interface and the dhcp interfaces after it, from the
+        address plan of the gateway's subnet.
 
-        Returns: workbook, worksheet
+        Args:
+            hostname: Name to be used to label the interfaces.
+            gateway: IP address of gateway interface
+
+        Returns: list of (journal step, interface name, ip, add_interface options)
 
         """
-        nowdate = datetime.datetime.now()
-        dirpath = os.getcwd()
-        xlsxpath = f"{dirpath}/vedge_onboarding-{nowdate}.xlsx"
-        workbook = xlsxwriter.Workbook(xlsxpath)
-        worksheet = workbook.add_worksheet()
-        worksheet.write("A1", "csv-deviceIP")
-        worksheet.write("B1", "csv-host-name")
-        worksheet.write("C1", "/100/irb1/interface/ip/address")
-        worksheet.write("D1", "//system/system-ip")
+        specs = []
+        plan = address_plan(device_subnet(gateway))
+        ips = (plan.gateway,) + plan.hosts
+        for count, step in enumerate((journal.GATEWAY,) + journal.INTERFACES):
+            name = hostname if count == 0 else f"{hostname}-ip{count}"
+            options = dict(
+                hostname=name,
+                ptr="Y",
+                status="Active",
+                description=name,
+                contact1='"ete-sec"',
+                contact1_type='"Mail Alias"',
+            )
+            specs.append((step, name, ips[count], options))
+        return specs
 
-        return workbook, worksheet
+    def open_results(self):
+        """
+        Opens results_file, or an xlsx in the working directory named after
+        the current date if none was given.
 
-    def closexlsx(self, workbook):
-        workbook.close()
-#
-#
-# if __name__ == "__main__":
-#     # for testing
-#     print("\n++++++++++++++++++++++")
-#     print("Starting New Test Run!")
-#     print("++++++++++++++++++++++\n")
-#     print("\n++++++++++++++++++")
-#     print("Test Run Complete!")
-#     print("++++++++++++++++++\n")
+        Returns: result_sink.ResultSink
+
+        """
+        path = self.results_file
+        if not path:
+            nowdate = datetime.datetime.now()
+            dirpath = os.getcwd()
+            path = f"{dirpath}/vedge_onboarding-{nowdate}.xlsx"
+        return make_sink(path)
+
+
+if __name__ == "__main__":
+    import sys
+    from cli import main
+
+    sys.exit(main(["onboard"] + sys.argv[1:]))
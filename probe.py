@@ -0,0 +1,213 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import errno
+import ipaddress
+import logging
+import os
+import select
+import socket
+import struct
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger("eman")
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+TCP_PORTS = (22, 80, 443)
+
+
+def _checksum(data):
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _echo_request(identifier, sequence):
+    payload = b"eman-probe"
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _checksum(header + payload)
+    return (
+        struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence)
+        + payload
+    )
+
+
+def _icmp_socket():
+    """
+    :return: (socket, raw) an unprivileged ICMP datagram socket if the kernel
+    allows it (net.ipv4.ping_group_range), otherwise a raw socket. Raises
+    PermissionError if neither can be opened.
+    """
+    try:
+        return (
+            socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP),
+            False,
+        )
+    except OSError:
+        return (
+            socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP),
+            True,
+        )
+
+
+def icmp_sweep(addresses, timeout=1.0, concurrency=64):
+    """
+    Sends ICMP echo requests from a single socket, ``concurrency`` addresses
+    at a time, and collects the replies.
+
+    :param addresses: iterable of IPv4 address strings
+    :param timeout: (float) seconds to wait for the replies of each window
+    :param concurrency: (int) echo requests outstanding at once
+    :return: (set) addresses that replied
+    """
+    addresses = list(addresses)
+    alive = set()
+    sock, raw = _icmp_socket()
+    identifier = os.getpid() & 0xFFFF
+    try:
+        for start in range(0, len(addresses), concurrency):
+            pending = set(addresses[start : start + concurrency])
+            for sequence, address in enumerate(pending, start):
+                try:
+                    packet = _echo_request(identifier, sequence & 0xFFFF)
+                    sock.sendto(packet, (address, 0))
+                except OSError as error:
+                    LOGGER.debug("icmp %s: %s", address, error)
+
+            deadline = time.monotonic() + timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                readable, __writable, __errors = select.select(
+                    [sock], [], [], remaining
+                )
+                if not readable:
+                    break
+                packet, (source, __port) = sock.recvfrom(1024)
+                if raw:
+                    packet = packet[(packet[0] & 0x0F) * 4 :]
+                if packet and packet[0] == ICMP_ECHO_REPLY and source in pending:
+                    pending.discard(source)
+                    alive.add(source)
+    finally:
+        sock.close()
+    return alive
+
+
+def tcp_alive(address, timeout=1.0, ports=TCP_PORTS):
+    """
+    Unprivileged liveness check: a host that accepts or actively refuses a
+    TCP connection on any port is up.
+
+    :return: (bool)
+    """
+    for port in ports:
+        try:
+            with socket.create_connection((address, port), timeout=timeout):
+                return True
+        except ConnectionRefusedError:
+            return True
+        except OSError as error:
+            if error.errno == errno.ECONNREFUSED:
+                return True
+    return False
+
+
+def ping_alive(address, timeout=1.0):
+    """
+    Runs the system ping once, or falls back to tcp_alive if there is no
+    ping binary.
+
+    :return: (bool)
+    """
+    try:
+        result = subprocess.run(
+            ["ping", "-c", "1", "-W", str(max(1, int(round(timeout)))), str(address)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        return tcp_alive(address, timeout)
+    return result.returncode == 0
+
+
+class Prober:
+    """
+    Sweeps candidate addresses concurrently and returns the ones that answer.
+
+    method:
+        'auto' - native ICMP, falling back to a pool of system pings when
+                 ICMP sockets are not permitted
+        'icmp' - native ICMP only
+        'ping' - pool of system ping processes
+        'tcp'  - TCP connect to TCP_PORTS, needs no privileges at all
+
+    Attributes:
+        timeout: seconds to wait for each probe
+        concurrency: probes in flight at once
+        method: one of the methods above
+    """
+
+    def __init__(self, timeout=1.0, concurrency=64, method="auto"):
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.method = method
+
+    def _pool(self, check, addresses):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            results = executor.map(lambda ip: check(ip, self.timeout), addresses)
+            return {ip for ip, up in zip(addresses, results) if up}
+
+    def sweep(self, addresses):
+        """
+        :param addresses: iterable of ip address strings
+        :return: (set) addresses that are in use
+        """
+        addresses = [str(ip).strip() for ip in addresses if str(ip).strip()]
+        if not addresses:
+            return set()
+
+        LOGGER.debug("probing %s addresses with %s", len(addresses), self.method)
+        if self.method == "tcp":
+            return self._pool(tcp_alive, addresses)
+        if self.method == "ping":
+            return self._pool(ping_alive, addresses)
+
+        ipv4 = []
+        others = []
+        for ip in addresses:
+            try:
+                version = ipaddress.ip_address(ip).version
+            except ValueError:
+                continue
+            (ipv4 if version == 4 else others).append(ip)
+        try:
+            alive = icmp_sweep(ipv4, self.timeout, self.concurrency)
+        except PermissionError:
+            if self.method == "icmp":
+                raise
+            LOGGER.info("ICMP sockets not permitted, using system ping")
+            return self._pool(ping_alive, addresses)
+        if others:
+            alive |= self._pool(ping_alive, others)
+        return alive
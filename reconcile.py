@@ -0,0 +1,208 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import collections
+import re
+
+from eman import LOGGER
+
+IPV4_PATTERN = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b")
+# key of get_scopes_by_subnet, a detail label and the number of its scope
+DETAIL_KEY = re.compile(r"(.*\D)(\d+)")
+
+# stage: 'cleanup', 'subnet', 'scope' or 'interface'
+# method: Eman method that applies the change
+# args, options: positional and keyword arguments for the method
+Change = collections.namedtuple("Change", ["stage", "method", "args", "options"])
+
+# scope_options fields compared with a scope's scope-info -details, if eman
+# lists them; a scope whose name and range match gets a mod_scope for these
+SCOPE_FIELDS = (
+    "description",
+    "policy",
+    "dhcpserver",
+    "defaultrouter",
+    "callmanager",
+    "selectiontags",
+)
+
+# subnet: the subnet looked at
+# scopes: {scope name: (first ip, last ip) of its range}
+# interfaces: {ip: interface name without domain}
+# details: {scope name: {field: value}} of the SCOPE_FIELDS eman listed
+HostState = collections.namedtuple(
+    "HostState", ["subnet", "scopes", "interfaces", "details"]
+)
+
+
+def _short_name(name):
+    return name.strip().split(".")[0].lower()
+
+
+def _field(label):
+    """'Default Router' -> 'defaultrouter', the scope_options name"""
+    return re.sub(r"[^a-z]", "", label.lower())
+
+
+def _values(value):
+    """a field value as a set of items, for comparing 'a,b' with ('a', 'b')"""
+    if not isinstance(value, (list, tuple)):
+        value = str(value).split(",")
+    return {str(item).strip().strip('"').strip().casefold() for item in value} - {""}
+
+
+class Reconciler:
+    """
+    Brings the subnet, scope and interfaces of a host in line with what the
+    csv asks for by reading what eman already has and only sending the
+    difference, instead of deleting and recreating everything.
+
+    e.g.
+    reconciler = Reconciler(am)
+    changes = reconciler.plan(
+        "host-a",
+        "10.0.0.8/29",
+        subnet_options=dict(description="host-a", function="LAN"),
+        scope_options=dict(scope_name="host-a", ranges="10.0.0.10:10.0.0.14", ...),
+        interfaces=[("host-a", "10.0.0.9", dict(ptr="Y", ...)), ...],
+    )
+    failed = reconciler.apply(changes)
+
+    Attributes:
+        am: Eman instance
+    """
+
+    def __init__(self, am):
+        self.am = am
+
+    def fetch(self, subnet):
+        """
+        Reads the scopes and interfaces eman has for a subnet.
+
+        :param subnet: (str) subnet (e.g. '10.0.0.8/29')
+        :return: HostState
+        """
+        scopes = {}
+        details = {}
+        found = self.am.get_scopes_by_subnet(subnet)
+        fields = collections.defaultdict(dict)
+        for key, value in found.items():
+            match = DETAIL_KEY.fullmatch(key)
+            if match and _field(match[1]) in SCOPE_FIELDS:
+                fields[int(match[2])][_field(match[1])] = value.strip()
+        count = 1
+        while f"Scope Name{count}" in found:
+            addresses = IPV4_PATTERN.findall(found.get(f"Range{count}", ""))
+            name = found[f"Scope Name{count}"].strip()
+            scopes[name] = tuple(addresses[:1] + addresses[-1:])
+            details[name] = fields[count]
+            count += 1
+
+        interfaces = {}
+        found = self.am.find_interfaces(subnet=subnet, return_as_dictionary=True)
+        if isinstance(found, dict):
+            interfaces = {ip.strip(): _short_name(name) for ip, name in found.items()}
+
+        LOGGER.info(f"{subnet}: scopes {scopes}, interfaces {interfaces}")
+        return HostState(subnet, scopes, interfaces, details)
+
+    def plan(self, hostname, subnet, subnet_options, scope_options, interfaces):
+        """
+        Computes the changes that turn the current state of a subnet into the
+        desired one. A scope with the wanted name and range whose SCOPE_FIELDS
+        differ is modified in place. Fields scope-info -details does not
+        list can not be compared and are taken as up to date.
+
+        :param hostname: (str) host the subnet belongs to, used for logging
+        :param subnet: (str) subnet of the host
+        :param subnet_options: (dict) add_subnet options, used if the subnet
+        has to be recreated
+        :param scope_options: (dict) add_scope options of the host's scope,
+        ranges as 'first:last'
+        :param interfaces: list of (name, ip, add_interface options)
+        :return: list of Change, empty if eman is already up to date
+        """
+        state = self.fetch(subnet)
+        changes = []
+
+        if not state.scopes and not state.interfaces:
+            # eman shows nothing in the subnet, so whether the subnet itself
+            # exists is unknown: recreate it as a full run would
+            LOGGER.info(f"{hostname}: nothing found in {subnet}, recreating it")
+            changes.append(Change("cleanup", "del_subnet", (subnet,), {}))
+            changes.append(
+                Change("subnet", "add_subnet", (), dict(subnet_options, subnet=subnet))
+            )
+
+        scope_name = scope_options["scope_name"]
+        wanted_range = tuple(scope_options["ranges"].split(":"))
+        for name, current_range in state.scopes.items():
+            if name == scope_name and current_range == wanted_range:
+                continue
+            changes.append(
+                Change("scope", "del_scope", (name,), dict(Delete_interfaces="No"))
+            )
+        if state.scopes.get(scope_name) != wanted_range:
+            changes.append(Change("scope", "add_scope", (), scope_options))
+        else:
+            current = state.details.get(scope_name, {})
+            drift = {
+                field: scope_options[field]
+                for field in SCOPE_FIELDS
+                if field in current
+                and scope_options.get(field)
+                and _values(current[field]) != _values(scope_options[field])
+            }
+            if drift:
+                LOGGER.info(f"{hostname}: scope {scope_name} differs in {drift}")
+                changes.append(
+                    Change("scope", "mod_scope", (), dict(drift, scope_name=scope_name))
+                )
+
+        wanted = {str(ip): name for name, ip, options in interfaces}
+        for ip, name in state.interfaces.items():
+            if _short_name(wanted.get(ip, "")) != name:
+                options = dict(ip=ip, interface_name=name)
+                changes.append(Change("interface", "del_interface", (), options))
+        for name, ip, options in interfaces:
+            if state.interfaces.get(str(ip)) != _short_name(name):
+                changes.append(
+                    Change("interface", "add_interface", (name,), dict(options, ip=ip))
+                )
+
+        LOGGER.info(f"{hostname}: {len(changes)} changes to apply")
+        return changes
+
+    def apply(self, changes):
+        """
+        Sends the changes in order.
+
+        :param changes: list of Change from plan
+        :return: (list) the changes that failed. Failed cleanups are ignored.
+        """
+        failed = []
+        for change in changes:
+            method = getattr(self.am, change.method)
+            try:
+                result = method(*change.args, **change.options)
+            except Exception as error:
+                result = f"ERROR: {error}"
+            LOGGER.info(f"{change.method} {change.args}: {result}")
+            if change.stage == "cleanup":
+                continue
+            if result is None or "ERROR" in str(result):
+                failed.append(change)
+        return failed
@@ -0,0 +1,173 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import abc
+import collections
+import csv
+import json
+
+# status of a row
+OK = "ok"
+FAILED = "failed"
+NOT_FINISHED = "not finished"
+
+# hostname: csv-host-name
+# gateway: gateway address of the row's /29, "" if none was allocated
+# subnet: the row's subnet (e.g. '10.0.0.8/29'), "" if none was allocated
+# status: OK, FAILED or NOT_FINISHED
+# stage: the stage that failed ('subnet', 'scope' or 'interface', 'csv' for a
+# row missing a required column), "" otherwise
+RowResult = collections.namedtuple(
+    "RowResult", ["hostname", "gateway", "subnet", "status", "stage"]
+)
+
+# header of the vEdge template columns, then the status of the row
+COLUMNS = [
+    "csv-deviceIP",
+    "csv-host-name",
+    "/100/irb1/interface/ip/address",
+    "//system/system-ip",
+    "status",
+    "failed-stage",
+]
+
+
+def row_values(result):
+    """
+    :param result: RowResult
+    :return: (list) one value per COLUMNS. The address columns are only
+    filled for rows that were onboarded, so failed rows can not be mistaken
+    for usable template rows.
+    """
+    gateway = result.gateway if result.status == OK else ""
+    return [
+        gateway,
+        result.hostname,
+        f"{gateway}/29" if gateway else "",
+        gateway,
+        result.status,
+        result.stage,
+    ]
+
+
+class ResultSink(abc.ABC):
+    """
+    Where the result of every onboarded row goes. Rows are written one at a
+    time as they complete, so memory use does not grow with the csv and the
+    rows written so far survive a crash.
+
+    e.g.
+    with make_sink("results.csv") as sink:
+        sink.write(RowResult("host-a", "10.0.0.9", "10.0.0.8/29", OK, ""))
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @abc.abstractmethod
+    def write(self, result):
+        """:param result: RowResult of one row"""
+
+    @abc.abstractmethod
+    def close(self):
+        """Flushes the rows written and closes the file."""
+
+
+class XlsxSink(ResultSink):
+    """
+    Writes an xlsx workbook in xlsxwriter's constant_memory mode: every row
+    is flushed to a temporary file as soon as the next one starts, so only
+    the current row is held in memory. The workbook itself is only complete
+    once closed.
+    """
+
+    def __init__(self, path):
+        # xlsxwriter is only needed for xlsx results
+        import xlsxwriter
+
+        super().__init__(path)
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.worksheet = self.workbook.add_worksheet()
+        self.worksheet.write_row(0, 0, COLUMNS)
+        self.row = 1
+
+    def write(self, result):
+        self.worksheet.write_row(self.row, 0, row_values(result))
+        self.row += 1
+
+    def close(self):
+        self.workbook.close()
+
+
+class CsvSink(ResultSink):
+    """Writes a csv file, flushed after every row."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.handle = open(path, "w", newline="")
+        self.writer = csv.writer(self.handle)
+        self.writer.writerow(COLUMNS)
+        self.handle.flush()
+
+    def write(self, result):
+        self.writer.writerow(row_values(result))
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+class JsonlSink(ResultSink):
+    """Writes one JSON object of RowResult fields per row, flushed after every row."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.handle = open(path, "w")
+
+    def write(self, result):
+        self.handle.write(json.dumps(result._asdict()) + "\n")
+        self.handle.flush()
+
+    def close(self):
+        self.handle.close()
+
+
+SINKS = {
+    ".xlsx": XlsxSink,
+    ".csv": CsvSink,
+    ".jsonl": JsonlSink,
+}
+
+
+def make_sink(path):
+    """
+    Builds a sink from the extension of path.
+
+    :param path: (str) results file ending in .xlsx, .csv or .jsonl
+    :return: ResultSink
+    """
+    for extension, sink in SINKS.items():
+        if path.endswith(extension):
+            return sink(path)
+    raise ValueError(
+        f"Unknown results file type {path!r}, expected one of {list(SINKS)}"
+    )
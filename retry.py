@@ -0,0 +1,266 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import logging
+import random
+import re
+import threading
+import time
+
+from metrics import FUNCTION_PATTERN
+
+LOGGER = logging.getLogger("eman")
+
+# what eman-am.pl (LWP status messages) and the http transports print when
+# the request never got a real answer from eman
+RETRYABLE_PATTERN = re.compile(
+    r"time-?out|timed out|can't connect|connection (?:reset|refused|aborted)"
+    r"|service unavailable|bad gateway|gateway time|internal server error"
+    r"|temporarily|try again|broken pipe|remote end closed|closed by server"
+    r"|connect call failed|\b50[0234]\b",
+    re.IGNORECASE,
+)
+# retryable failures where the request never reached eman, so even a write
+# can be sent again
+UNSENT_PATTERN = re.compile(
+    r"can't connect|connection refused|connect call failed|name or service not known"
+    r"|no route to host|network is unreachable",
+    re.IGNORECASE,
+)
+# eman functions that only read, sending one again changes nothing
+READ_FUNCTIONS = frozenset(("int-find", "next-avail", "scope-info", "subnets-free"))
+
+OK = "ok"
+RETRYABLE = "retryable"
+PERMANENT = "permanent"
+
+
+class CircuitOpenError(Exception):
+    """Exception raised instead of calling eman while the circuit is open"""
+
+
+def classify(output, error):
+    """
+    Sorts the result of one eman-am call. Anything eman printed on stdout is
+    its answer, even an ERROR, and is not retried. With nothing on stdout,
+    stderr tells a transport or server failure (retryable) from an eman
+    error such as a duplicate name or bad credentials (permanent).
+
+    :return: OK, RETRYABLE or PERMANENT
+    """
+    if output:
+        return OK
+    if "Unauthorized" not in error and RETRYABLE_PATTERN.search(error):
+        return RETRYABLE
+    return PERMANENT
+
+
+def is_read(command):
+    """
+    :param command: (str) command string, or a description like 'batch of 5'
+    :return: True if every eman function in command only reads
+    """
+    functions = FUNCTION_PATTERN.findall(command)
+    return bool(functions) and all(name in READ_FUNCTIONS for name in functions)
+
+
+def resendable(command, reason):
+    """
+    A write that failed after it was sent may have been applied anyway (a
+    timeout kills eman-am.pl after posting, a 5xx may come after the
+    change), and sending it again adds duplicates or allocates twice.
+
+    :param command: (str) the command that failed
+    :param reason: (str) the error it failed with
+    :return: True if command may be sent again: it only reads, or the
+    request never reached eman
+    """
+    return is_read(command) or bool(UNSENT_PATTERN.search(reason))
+
+
+class CircuitBreaker:
+    """
+    Stops calls to eman after threshold retryable failures in a row. Once
+    reset_timeout seconds have passed one trial call is let through; if it
+    works the circuit closes again, otherwise it stays open for another
+    reset_timeout.
+
+    Attributes:
+        threshold: consecutive retryable failures that open the circuit
+        reset_timeout: seconds the circuit stays open
+    """
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """
+        Raises CircuitOpenError if calls are not allowed right now.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return
+            waited = time.monotonic() - self.opened_at
+            if waited >= self.reset_timeout and not self._trial:
+                self._trial = True
+                return
+            raise CircuitOpenError(
+                f"eman circuit is open after {self.failures} failures, "
+                f"retrying in {max(0.0, self.reset_timeout - waited):.0f}s"
+            )
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                LOGGER.info("eman circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (
+                self.opened_at is None and self.failures >= self.threshold
+            ):
+                LOGGER.error(
+                    "eman circuit opened after %s failures, pausing calls for %ss",
+                    self.failures,
+                    self.reset_timeout,
+                )
+                self.opened_at = time.monotonic()
+                self._trial = False
+
+
+class RetryPolicy:
+    """
+    Retries eman calls that failed for a retryable reason (see classify),
+    as long as that is safe (see resendable): reads always, writes and
+    batches only if the request never reached eman. A write whose outcome
+    is unknown fails instead, for the caller to check eman (a resume or
+    reconcile run reads what is there first). Retries wait a random time
+    between 0 and base * 2 ** attempt seconds, capped at cap ("full
+    jitter"), so many rows failing together do not come back together.
+    Every result also goes to the circuit breaker.
+
+    e.g.
+    am = Eman(USERNAME, PASSWORD, retry=RetryPolicy(attempts=5, base=1.0))
+
+    Attributes:
+        attempts: calls made at most, the first one included
+        base: seconds of the first backoff
+        cap: longest backoff in seconds
+        breaker: CircuitBreaker, None to never open the circuit
+    """
+
+    def __init__(self, attempts=4, base=0.5, cap=30.0, breaker=True):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        if breaker is True:
+            breaker = CircuitBreaker()
+        self.breaker = breaker or None
+
+    def backoff(self, attempt):
+        """:return: (float) seconds to wait before retry number attempt + 1"""
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def _settle(self, attempt, command, result, error=None):
+        """
+        Records one attempt.
+
+        :return: seconds to wait before retrying, or None if the call is done
+        """
+        kind = RETRYABLE if error is not None else classify(*result)
+        if self.breaker is not None:
+            if kind == RETRYABLE:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+        if kind != RETRYABLE or attempt + 1 >= self.attempts:
+            return None
+        reason = str(error) if error is not None else result[1]
+        if not resendable(command, reason):
+            LOGGER.warning(
+                "%s failed (%s) after it may have reached eman, not resending",
+                command.strip(),
+                reason,
+            )
+            return None
+        delay = self.backoff(attempt)
+        LOGGER.info(
+            "%s failed (%s), retry %s/%s in %.1fs",
+            command.strip(),
+            reason,
+            attempt + 1,
+            self.attempts - 1,
+            delay,
+        )
+        return delay
+
+    def call(self, run, command):
+        """
+        :param run: function sending the command, returning (output, error)
+        :param command: (str) the command, for logging
+        :return: (output, error) of the last attempt. Raises CircuitOpenError
+        if the circuit is open, or the transport's OSError if every attempt
+        raised one.
+        """
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.allow()
+            try:
+                result = run()
+                delay = self._settle(attempt, command, result)
+            except OSError as error:
+                delay = self._settle(attempt, command, None, error)
+                if delay is None:
+                    raise
+            if delay is None:
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def call_async(self, run, command):
+        """Awaitable call, run returns an awaitable."""
+        # only the async client needs asyncio, so it is not imported up front
+        import asyncio
+
+        attempt = 0
+        while True:
+            if self.breaker is not None:
+                self.breaker.allow()
+            try:
+                result = await run()
+                delay = self._settle(attempt, command, result)
+            except OSError as error:
+                delay = self._settle(attempt, command, None, error)
+                if delay is None:
+                    raise
+            if delay is None:
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
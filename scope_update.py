@@ -0,0 +1,151 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import csv
+import fnmatch
+import re
+
+from csv_source import HOSTNAME_COLUMN, chunked
+from eman import SCOPE_FIELDS, ScopeResult
+from eman_transport import BATCH_SIZE
+
+# column naming the scope in an update csv. Onboarding names scopes after
+# the device, so an onboarding csv (csv-host-name) works as well.
+NAME_COLUMN = "name"
+
+# csv columns named after the eman flag rather than the mod_scope field
+COLUMN_ALIASES = {"descr": "description", "r": "ranges", "range": "ranges"}
+
+TAG_SEPARATOR = re.compile(r"[;,\s]+")
+
+
+def scope_changes(fields, strict=True):
+    """
+    :param fields: (dict) {field or column name: value}, empty values are dropped
+    :param strict: False to skip names that are not scope fields instead of
+    raising ValueError
+    :return: (dict) mod_scope keyword arguments. selectiontags given as
+    'IPPhones;OtherDevices' becomes ('IPPhones', 'OtherDevices').
+    """
+    changes = {}
+    for name, value in fields.items():
+        field = (name or "").strip().lower()
+        field = COLUMN_ALIASES.get(field, field)
+        if field not in SCOPE_FIELDS:
+            if not strict:
+                continue
+            raise ValueError(
+                f"Unknown scope field {name!r}, "
+                f"expected one of {', '.join(SCOPE_FIELDS)}"
+            )
+        if isinstance(value, str):
+            value = value.strip()
+        if not value:
+            continue
+        if field == "selectiontags" and isinstance(value, str):
+            value = tuple(tag for tag in TAG_SEPARATOR.split(value) if tag)
+        changes[field] = value
+    return changes
+
+
+def read_updates(csv_file):
+    """
+    Streams the scopes of an update csv: a name (or csv-host-name) column
+    and one column per field to change. Empty cells leave the field as it is
+    and columns that are not scope fields are ignored, so an onboarding csv
+    can be used to select its scopes.
+
+    :param csv_file: (str) path to the csv file
+    :return: generator of (scope_name, changes)
+    """
+    with open(csv_file, newline="") as handle:
+        reader = csv.DictReader(handle)
+        for line, fields in enumerate(reader, start=2):
+            name = fields.get(NAME_COLUMN) or fields.get(HOSTNAME_COLUMN) or ""
+            name = name.strip()
+            if not name:
+                raise ValueError(
+                    f"{csv_file}:{line}: {NAME_COLUMN} or {HOSTNAME_COLUMN} is required"
+                )
+            yield name, scope_changes(fields, strict=False)
+
+
+def match_scopes(am, pattern, subnets):
+    """
+    :param am: Eman
+    :param pattern: (str) shell style pattern (e.g. '*-cvo-vEdge100WM')
+    :param subnets: subnets to look for scopes in. eman lists the scopes of
+    the subnet itself, not of the subnets inside it, so give each device
+    subnet rather than the block holding them.
+    :return: (list) names of the scopes in subnets matching pattern, in the
+    order eman lists them. Raises ValueError if no scope matches.
+    """
+    names = []
+    for subnet in subnets:
+        for key, value in am.get_scopes_by_subnet(subnet).items():
+            name = value.strip()
+            if key.startswith("Scope Name") and fnmatch.fnmatchcase(name, pattern):
+                names.append(name)
+    if not names:
+        raise ValueError(f"No scope in {', '.join(subnets)} matches {pattern!r}")
+    return names
+
+
+def select_updates(am, names=(), pattern="", subnets=(), csv_file="", changes=None):
+    """
+    Collects the scopes to update and what to change in each.
+
+    :param am: Eman, only used to look up pattern
+    :param names: scope names
+    :param pattern: shell style pattern matched against the scopes in subnets
+    :param subnets: subnets searched for pattern
+    :param csv_file: update csv, see read_updates
+    :param changes: (dict) fields changed in every scope. Values from the csv
+    take precedence.
+    :return: (list) (scope_name, changes) once per scope, in the order found
+    """
+    changes = scope_changes(changes or {})
+    updates = {}
+    selected = list(names)
+    if pattern:
+        selected += match_scopes(am, pattern, subnets)
+    for name in selected:
+        updates.setdefault(name, dict(changes))
+    if csv_file:
+        for name, row_changes in read_updates(csv_file):
+            updates.setdefault(name, dict(changes)).update(row_changes)
+    return list(updates.items())
+
+
+def update_scopes(am, updates, workers=6, chunk_size=BATCH_SIZE):
+    """
+    Applies updates a chunk at a time through Eman.mod_scopes_bulk, so the
+    results of a long run come in as it goes.
+
+    :param am: Eman
+    :param updates: iterable of (scope_name, changes), e.g. from select_updates
+    :param workers: (int) mod_scope calls in flight at once without batch mode
+    :param chunk_size: (int) scopes sent per bulk call
+    :return: generator of ScopeResult(name, result, error), in the order given.
+    Scopes with nothing to change are reported without calling eman.
+    """
+    for chunk in chunked(updates, chunk_size):
+        results = {}
+        send = [(name, changes) for name, changes in chunk if changes]
+        for result in am.mod_scopes_bulk(send, workers=workers):
+            results[result.name] = result
+        for name, changes in chunk:
+            yield results.get(name) or ScopeResult(name, None, "nothing to change")
@@ -0,0 +1,188 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import ipaddress
+import re
+import threading
+
+from eman import LOGGER, UnableToFindError, UnableToReserveError
+
+SUBNET_PATTERN = re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}/\d{1,2}\b")
+
+
+class BlockBitmap:
+    """
+    Free/used map of the equally sized subnets in one address block. One byte
+    per subnet, 0 is free.
+
+    Attributes:
+        network: the address block (ipaddress.IPv4Network)
+        prefix: prefix length of the subnets handed out (e.g. 29)
+    """
+
+    def __init__(self, network, prefix):
+        self.network = network
+        self.prefix = prefix
+        self.slot_size = 2 ** (network.max_prefixlen - prefix)
+        self.slots = bytearray(b"\x01") * (network.num_addresses // self.slot_size)
+        self.cursor = 0
+
+    def _slot(self, subnet):
+        return (int(subnet.network_address) - int(self.network.network_address)) // (
+            self.slot_size
+        )
+
+    def mark_free(self, free_network):
+        """Marks every whole subnet inside free_network as free."""
+        if free_network.prefixlen > self.prefix:
+            return
+        if not free_network.subnet_of(self.network):
+            return
+        first = self._slot(free_network)
+        count = free_network.num_addresses // self.slot_size
+        self.slots[first : first + count] = bytes(count)
+        self.cursor = min(self.cursor, first)
+
+    def take(self):
+        """
+        :return: the lowest free subnet, now marked used, or None if the block is full
+        """
+        slot = self.slots.find(0, self.cursor)
+        if slot == -1:
+            return None
+        self.slots[slot] = 1
+        self.cursor = slot + 1
+        address = self.network.network_address + slot * self.slot_size
+        return ipaddress.ip_network(f"{address}/{self.prefix}")
+
+    def free_count(self):
+        return self.slots.count(0)
+
+
+class SubnetAllocator:
+    """
+    Hands out subnets from address blocks locally instead of asking eman for
+    the next available subnet on every row. Each block is seeded once from
+    find_subnets_free, a candidate is picked from the local bitmap and then
+    reserved explicitly with add_subnet(subnet=...). If eman refuses the
+    candidate (someone else took it) it is marked used and the next one is
+    tried; after too many refusals the block is re-read from eman.
+
+    e.g.
+    allocator = SubnetAllocator(am)
+    subnet = allocator.add_subnet("192.168.0.0/21", description=hostname, function="LAN")
+
+    Attributes:
+        am: Eman instance
+        prefix: prefix length of the subnets to hand out (default 29)
+        retries: refused candidates before the block is re-read from eman
+    """
+
+    def __init__(self, am, prefix=29, retries=3):
+        self.am = am
+        self.prefix = int(prefix)
+        self.retries = retries
+        self._blocks = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def block_lock(self, address_block):
+        """
+        :param address_block: (str) address block
+        :return: (Lock) held while the block's map is read from eman or a
+        subnet is taken from it. Holding it keeps the map from being read
+        while a subnet of the block is deleted and re-added.
+        """
+        with self._lock:
+            return self._locks.setdefault(address_block, threading.Lock())
+
+    def seed(self, address_block):
+        """
+        Reads the free space of an address block from eman.
+
+        :param address_block: (str) address block (e.g. '192.168.0.0/21')
+        :return: (BlockBitmap) the refreshed map. Raises UnableToFindError if
+        eman did not return any free subnet.
+        """
+        network = ipaddress.ip_network(address_block, strict=False)
+        bitmap = BlockBitmap(network, self.prefix)
+
+        result = self.am.find_subnets_free(address_block)
+        LOGGER.info("subnets-free %s: %s", address_block, result)
+        if "ERROR" in result:
+            raise UnableToFindError(result)
+
+        for free in SUBNET_PATTERN.findall(result):
+            bitmap.mark_free(ipaddress.ip_network(free, strict=False))
+
+        LOGGER.info(
+            "%s: %s free /%s subnets", address_block, bitmap.free_count(), self.prefix
+        )
+        self._blocks[address_block] = bitmap
+        return bitmap
+
+    def allocate(self, address_block):
+        """
+        Picks the next free subnet from the local map, seeding it on first use.
+        The subnet is not reserved in eman.
+
+        :param address_block: (str) address block
+        :return: (str) subnet (e.g. '192.168.0.8/29'). Raises UnableToFindError
+        if the block is full.
+        """
+        with self.block_lock(address_block):
+            bitmap = self._blocks.get(address_block) or self.seed(address_block)
+            subnet = bitmap.take()
+        if subnet is None:
+            raise UnableToFindError(
+                f"No free /{self.prefix} subnet left in {address_block}"
+            )
+        return str(subnet)
+
+    def add_subnet(self, address_block, **options):
+        """
+        Allocates a subnet locally and reserves it in eman.
+
+        :param address_block: (str) address block to allocate from
+        :param options: passed to Eman.add_subnet (e.g. description, function)
+        :return: the added subnet. Raises UnableToReserveError if no subnet
+        could be reserved.
+        """
+        refused = 0
+        reseeded = False
+        while True:
+            try:
+                subnet = self.allocate(address_block)
+            except UnableToFindError as error:
+                raise UnableToReserveError(error)
+
+            try:
+                return self.am.add_subnet(subnet=subnet, **options)
+            except UnableToReserveError as error:
+                LOGGER.info("%s was refused: %s", subnet, error)
+                refused += 1
+
+            if refused >= self.retries:
+                if reseeded:
+                    raise UnableToReserveError(
+                        f"Unable to reserve a subnet in {address_block} "
+                        f"after {refused} attempts"
+                    )
+                # our view of the block is stale, read it again
+                with self.block_lock(address_block):
+                    self.seed(address_block)
+                reseeded = True
+                refused = 0
@@ -0,0 +1,224 @@
+#  ----------------------------------------------------------------
+# Copyright 2016 Cisco Systems
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ------------------------------------------------------------------
+
+import collections
+import threading
+import time
+
+# status of a task
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+# status: DONE, FAILED, SKIPPED or CANCELLED
+# value: what the task returned if DONE, the exception if FAILED or
+#     CANCELLED, the name of the task that stopped it if SKIPPED
+TaskResult = collections.namedtuple("TaskResult", ["status", "value"])
+
+
+class Cancelled(Exception):
+    """Raised by a task that should not run any more, e.g. past a deadline"""
+
+
+class TaskGraph:
+    """
+    Runs the tasks of many independent groups (e.g. one group per device)
+    on one executor. A task starts as soon as the tasks it requires are
+    done, whatever state the other groups are in, so the steps of different
+    groups overlap and the executor stays busy. A task that fails or is
+    cancelled skips the tasks depending on it; the rest of its group still
+    runs.
+
+    Tasks may take slots (e.g. the region of a device) that only limit(slot)
+    tasks hold at once. A task waiting for a slot waits in the graph, not on
+    an executor thread, so the threads are free for tasks that can run.
+    Of the tasks ready to run the one added first goes first, which finishes
+    groups in about the order they were added.
+
+    e.g.
+    graph = TaskGraph(executor, size=8)
+    graph.add("host-a", "subnet", create_subnet, slots=["block"])
+    graph.add("host-a", "scope", create_scope, requires=["subnet"])
+    graph.add("host-a", "gateway", add_gateway, requires=["subnet"])
+    graph.limit("block", 1)
+    graph.start()
+    graph.results("host-a")  # {"subnet": TaskResult("done", ...), ...}
+
+    Attributes:
+        executor: runs the tasks, None runs them one at a time in the thread
+            calling start
+        size: tasks running at once, the executor's max_workers
+    """
+
+    def __init__(self, executor=None, size=1):
+        self.executor = executor
+        self.size = size if executor is not None else 1
+        self._functions = {}
+        self._requires = {}
+        self._slots = {}
+        self._order = {}
+        self._dependents = collections.defaultdict(list)
+        self._pending = {}
+        self._ready = []
+        self._running = 0
+        self._limits = {}
+        self._held = collections.Counter()
+        self._results = collections.defaultdict(dict)
+        self._unfinished = collections.Counter()
+        self._spans = {}
+        self._condition = threading.Condition()
+
+    def add(self, group, name, function, requires=(), slots=()):
+        """
+        :param group: anything hashable the task belongs to
+        :param name: (str) name of the task, unique within its group
+        :param function: called with the values of the required tasks, in
+        the order of requires. It fails by raising, or raises Cancelled.
+        :param requires: names of tasks of the same group, added before this one
+        :param slots: slots the task holds while it runs, see limit
+        """
+        key = (group, name)
+        for required in requires:
+            if (group, required) not in self._functions:
+                raise ValueError(f"{name} requires {required}, which was not added")
+        self._functions[key] = function
+        self._requires[key] = tuple(requires)
+        self._slots[key] = tuple(slots)
+        self._order[key] = len(self._order)
+        self._pending[key] = len(requires)
+        for required in requires:
+            self._dependents[(group, required)].append(key)
+        self._unfinished[group] += 1
+        if not requires:
+            self._ready.append(key)
+
+    def limit(self, slot, count):
+        """
+        :param slot: anything hashable named in the slots of add
+        :param count: (int) tasks holding slot at once. Slots that are never
+        limited do not limit anything.
+        """
+        with self._condition:
+            self._limits[slot] = count
+
+    def start(self):
+        """
+        Starts the tasks that require nothing. Without an executor every
+        task has run when start returns.
+        """
+        if self.executor is not None:
+            with self._condition:
+                keys = self._take_ready()
+            for key in keys:
+                self.executor.submit(self._run, key)
+            return
+
+        while True:
+            with self._condition:
+                keys = self._take_ready()
+            if not keys:
+                return
+            for key in keys:
+                self._run(key)
+
+    def results(self, group):
+        """
+        :return: (dict) {task name: TaskResult} of group, once all of its
+        tasks have finished
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._unfinished[group] == 0)
+            return dict(self._results[group])
+
+    def elapsed(self, group):
+        """
+        :return: (float) seconds from the start of the first task of group to
+        the end of its last one, 0 if none ran
+        """
+        with self._condition:
+            start, end = self._spans.get(group, (0.0, 0.0))
+        return end - start
+
+    def _free(self, key):
+        return all(
+            self._held[slot] < self._limits[slot]
+            for slot in self._slots[key]
+            if slot in self._limits
+        )
+
+    def _take_ready(self):
+        """
+        Called holding the condition.
+
+        :return: the ready tasks to start now, already counted as running
+        """
+        keys = []
+        while self._running < self.size:
+            free = [key for key in self._ready if self._free(key)]
+            if not free:
+                break
+            key = min(free, key=self._order.get)
+            self._ready.remove(key)
+            for slot in self._slots[key]:
+                self._held[slot] += 1
+            self._running += 1
+            keys.append(key)
+        return keys
+
+    def _run(self, key):
+        group, name = key
+        with self._condition:
+            start = time.perf_counter()
+            self._spans.setdefault(group, (start, start))
+            results = self._results[group]
+            values = [results[required].value for required in self._requires[key]]
+        try:
+            result = TaskResult(DONE, self._functions[key](*values))
+        except Cancelled as error:
+            result = TaskResult(CANCELLED, error)
+        except Exception as error:
+            result = TaskResult(FAILED, error)
+        self._finish(key, result)
+
+    def _finish(self, key, result):
+        with self._condition:
+            self._running -= 1
+            for slot in self._slots[key]:
+                self._held[slot] -= 1
+            self._spans[key[0]] = (self._spans[key[0]][0], time.perf_counter())
+
+            finished = [(key, result)]
+            while finished:
+                key, result = finished.pop()
+                group, name = key
+                if name in self._results[group]:
+                    continue
+                self._results[group][name] = result
+                self._unfinished[group] -= 1
+                for dependent in self._dependents.get(key, ()):
+                    if result.status != DONE:
+                        stopped_by = name if result.status != SKIPPED else result.value
+                        finished.append((dependent, TaskResult(SKIPPED, stopped_by)))
+                        continue
+                    self._pending[dependent] -= 1
+                    if self._pending[dependent] == 0:
+                        self._ready.append(dependent)
+            self._condition.notify_all()
+
+            keys = self._take_ready() if self.executor is not None else []
+        for key in keys:
+            self.executor.submit(self._run, key)
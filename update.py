@@ -14,18 +14,23 @@
 # limitations under the License.
 # ------------------------------------------------------------------
 
-from eman import Eman
-from secrets import USERNAME, PASSWORD
+"""
+Sets the IPPhones and OtherDevices selection tags on the scopes given, e.g.
 
-am = Eman(USERNAME, PASSWORD)
+    python update.py host-a-cvo-vEdge100WM host-b-cvo-vEdge100WM
+    python update.py --match "*-cvo-vEdge100WM" --subnet 10.35.105.0/29 --subnet 10.35.105.8/29
 
-interfaces = (
+Takes every option of "cli.py update-scopes", which does the work.
+"""
 
-)
+import sys
 
-for i in interfaces:
-    result = am.Eman.mod_scope(scope_name=i,
-                         selectiontags=("IPPhones", "OtherDevices"))
-    print(result)
+from cli import main
 
-    result = am.Eman.mod_scope
\ No newline at end of file
+SELECTION_TAGS = ["IPPhones", "OtherDevices"]
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    if "--selection-tags" not in argv:
+        argv += ["--selection-tags"] + SELECTION_TAGS
+    sys.exit(main(["update-scopes"] + argv))